@@ -0,0 +1,227 @@
+import fcntl
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import uuid
+from contextlib import contextmanager
+from pathlib import Path
+
+MANIFEST_NAME = 'manifest.json'
+LOCK_NAME = '.lock'
+
+
+def file_digest(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def cache_key(run_id, model_id):
+    return hashlib.sha256(f'{run_id}/{model_id}'.encode('utf-8')).hexdigest()[:32]
+
+
+def write_json_atomic(path, data):
+    fd, tmp_path = tempfile.mkstemp(dir=path.parent, prefix='.tmp-')
+    with os.fdopen(fd, 'w', encoding='utf-8') as f:
+        json.dump(data, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+class ArtifactCache:
+    """Local on-disk cache of model artifacts keyed by (run_id, model_id).
+
+    Every cached file is recorded in a per-entry manifest with its size and sha256 digest.
+    Reads check the sizes, which catches truncated files without reading them; with
+    verify_reads the digests are checked too. Each put stages the artifact in a new,
+    uniquely named directory and switches the manifest to it in one rename, so readers
+    always see a complete version. Writers (put, removals, eviction) hold an exclusive
+    lock on the cache and readers a shared one, so a version is never deleted while a
+    reader checks it. The least recently used entries are evicted once the cache grows
+    past max_bytes. A read_only cache (e.g. artifacts baked into the image) is never
+    modified and needs no locking.
+    """
+
+    def __init__(self, cache_dir, max_bytes, read_only=False, verify_reads=False):
+        self.cache_dir = Path(cache_dir)
+        self.max_bytes = max_bytes
+        self.read_only = read_only
+        self.verify_reads = verify_reads
+        if not read_only:
+            self.cache_dir.mkdir(parents=True, exist_ok=True)
+
+    @contextmanager
+    def locked(self, exclusive):
+        # One lock for the whole cache, shared between processes using the same directory
+        if self.read_only:
+            yield
+            return
+        with open(self.cache_dir / LOCK_NAME, 'a', encoding='utf-8') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def entry_dir(self, run_id, model_id):
+        return self.cache_dir / cache_key(run_id, model_id)
+
+    def read_manifest(self, entry_dir):
+        try:
+            with open(entry_dir / MANIFEST_NAME, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def get(self, run_id, model_id, name):
+        with self.locked(exclusive=False):
+            entry_dir = self.entry_dir(run_id, model_id)
+            manifest = self.read_manifest(entry_dir)
+            if manifest is None or name not in manifest['artifacts']:
+                return None
+
+            artifact = manifest['artifacts'][name]
+            artifact_dir = entry_dir / artifact.get('dir', name)
+            intact = self.check_files(artifact_dir, artifact['files'])
+
+        if not intact:
+            print(f"Cached artifact {name} for run {run_id} failed its integrity check")
+            if not self.read_only:
+                with self.locked(exclusive=True):
+                    self.remove_artifact(entry_dir, name, artifact_dir)
+            return None
+
+        # Touch the manifest so eviction sees this entry as recently used
+        if not self.read_only:
+            try:
+                os.utime(entry_dir / MANIFEST_NAME)
+            except FileNotFoundError:
+                pass
+        return str(artifact_dir / artifact['root'])
+
+    def check_files(self, artifact_dir, files):
+        for relative_path, expected in files.items():
+            path = artifact_dir / relative_path
+            try:
+                size = path.stat().st_size
+            except OSError:
+                return False
+            if size != expected['size']:
+                return False
+            if self.verify_reads and file_digest(path) != expected['sha256']:
+                return False
+        return True
+
+    def put(self, run_id, model_id, name, source_path):
+        if self.read_only:
+            raise PermissionError(f"Artifact cache {self.cache_dir} is read-only")
+
+        source_path = Path(source_path)
+        entry_dir = self.entry_dir(run_id, model_id)
+        entry_dir.mkdir(parents=True, exist_ok=True)
+
+        # Staged outside the lock: copying and hashing is the slow part
+        staging_dir = Path(tempfile.mkdtemp(dir=entry_dir, prefix='.tmp-'))
+        try:
+            if source_path.is_dir():
+                root = '.'
+                shutil.copytree(source_path, staging_dir, dirs_exist_ok=True)
+            else:
+                root = source_path.name
+                shutil.copyfile(source_path, staging_dir / root)
+
+            files = {}
+            for path in sorted(staging_dir.rglob('*')):
+                if path.is_file():
+                    files[path.relative_to(staging_dir).as_posix()] = {
+                        'sha256': file_digest(path),
+                        'size': path.stat().st_size,
+                    }
+
+            with self.locked(exclusive=True):
+                # The entry may have been evicted while staging
+                entry_dir.mkdir(parents=True, exist_ok=True)
+                version_dir = f'{name}-{uuid.uuid4().hex[:12]}'
+                os.replace(staging_dir, entry_dir / version_dir)
+
+                manifest = self.read_manifest(entry_dir) or {
+                    'run_id': run_id,
+                    'model_id': model_id,
+                    'artifacts': {},
+                }
+                previous = manifest['artifacts'].get(name)
+                manifest['artifacts'][name] = {'root': root, 'dir': version_dir, 'files': files}
+                if name in manifest.get('missing', []):
+                    manifest['missing'].remove(name)
+                write_json_atomic(entry_dir / MANIFEST_NAME, manifest)
+
+                if previous is not None:
+                    shutil.rmtree(entry_dir / previous.get('dir', name), ignore_errors=True)
+                self.evict(keep=entry_dir)
+        finally:
+            shutil.rmtree(staging_dir, ignore_errors=True)
+
+        return str(entry_dir / version_dir / root)
+
+    def mark_missing(self, run_id, model_id, name):
+        """Record that the run has no artifact called name, so readers need not look for it"""
+        if self.read_only:
+            raise PermissionError(f"Artifact cache {self.cache_dir} is read-only")
+        with self.locked(exclusive=True):
+            entry_dir = self.entry_dir(run_id, model_id)
+            entry_dir.mkdir(parents=True, exist_ok=True)
+            manifest = self.read_manifest(entry_dir) or {
+                'run_id': run_id,
+                'model_id': model_id,
+                'artifacts': {},
+            }
+            manifest.setdefault('missing', [])
+            if name not in manifest['missing']:
+                manifest['missing'].append(name)
+            write_json_atomic(entry_dir / MANIFEST_NAME, manifest)
+
+    def is_missing(self, run_id, model_id, name):
+        manifest = self.read_manifest(self.entry_dir(run_id, model_id))
+        return manifest is not None and name in manifest.get('missing', [])
+
+    def remove_artifact(self, entry_dir, name, artifact_dir):
+        # Only removes the version that failed its check, not one a concurrent put replaced it with
+        manifest = self.read_manifest(entry_dir)
+        if manifest is None or name not in manifest['artifacts']:
+            return
+        if entry_dir / manifest['artifacts'][name].get('dir', name) != artifact_dir:
+            return
+        manifest['artifacts'].pop(name)
+        write_json_atomic(entry_dir / MANIFEST_NAME, manifest)
+        shutil.rmtree(artifact_dir, ignore_errors=True)
+
+    def entry_size(self, manifest):
+        return sum(
+            file_info['size']
+            for artifact in manifest['artifacts'].values()
+            for file_info in artifact['files'].values()
+        )
+
+    def evict(self, keep=None):
+        # Called by put with the exclusive lock held
+        entries = []
+        for entry_dir in self.cache_dir.iterdir():
+            manifest = self.read_manifest(entry_dir) if entry_dir.is_dir() else None
+            if manifest is not None:
+                last_used = (entry_dir / MANIFEST_NAME).stat().st_mtime
+                entries.append((last_used, entry_dir, self.entry_size(manifest)))
+
+        total_bytes = sum(size for _, _, size in entries)
+        for _, entry_dir, size in sorted(entries, key=lambda entry: entry[0]):
+            if total_bytes <= self.max_bytes:
+                break
+            if entry_dir == keep:
+                continue
+            print(f"Evicting cached artifacts in {entry_dir}")
+            shutil.rmtree(entry_dir, ignore_errors=True)
+            total_bytes -= size
@@ -0,0 +1,98 @@
+import pickle
+import tempfile
+from pathlib import Path
+
+import mlflow
+import xgboost as xgb
+
+import model
+from artifact_cache import ArtifactCache
+from feature_encoder import FeatureEncoder
+from serving_bundle import BUNDLE_FILENAME, write_bundle
+
+DEFAULT_OUTPUT_DIR = '/opt/model-artifacts'
+
+
+def bake_booster(cache, run_id, model_id, tmp_dir):
+    # Re-save the booster as UBJSON, which is smaller and faster to load than the JSON artifact
+    booster_json = mlflow.artifacts.download_artifacts(model.get_booster_location(run_id))
+    booster = xgb.Booster()
+    booster.load_model(booster_json)
+
+    booster_ubj = Path(tmp_dir) / f'{run_id}.ubj'
+    booster.save_model(booster_ubj)
+    return cache.put(run_id, model_id, 'booster', booster_ubj)
+
+
+def bake_preprocessor(cache, run_id, model_id, preprocessor_location, tmp_dir):
+    # Embed both the pickled DictVectorizer and its compiled FeatureEncoder export
+    preprocessor_path = mlflow.artifacts.download_artifacts(preprocessor_location)
+    cache.put(run_id, model_id, 'preprocessor', preprocessor_path)
+
+    with open(preprocessor_path, 'rb') as f:
+        dv = pickle.load(f)
+    encoder_path = Path(tmp_dir) / 'feature_encoder.npz'
+    FeatureEncoder.from_dict_vectorizer(dv).save(encoder_path)
+    return cache.put(run_id, model_id, 'feature_encoder', encoder_path)
+
+
+def bake_bundle(cache, run_id, model_id, booster_path, encoder_path, tmp_dir):
+    # Built from the baked booster and encoder, so runs trained before bundles existed get one too
+    booster = xgb.Booster()
+    booster.load_model(booster_path)
+    bundle_path = Path(tmp_dir) / BUNDLE_FILENAME
+    write_bundle(
+        bundle_path,
+        booster,
+        FeatureEncoder.load(encoder_path),
+        metadata={'run_id': run_id, 'xgboost_version': xgb.__version__},
+    )
+    return cache.put(run_id, model_id, 'serving_bundle', bundle_path)
+
+
+def bake(run_id, model_id, output_dir=DEFAULT_OUTPUT_DIR):
+    cache = ArtifactCache(output_dir, max_bytes=float('inf'))
+    model_location, preprocessor_location = model.get_model_location(run_id, model_id)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        booster_path = None
+        try:
+            booster_path = bake_booster(cache, run_id, model_id, tmp_dir)
+        except Exception as e:  # pylint: disable=broad-exception-caught
+            print(f"Native booster unavailable, embedding the pyfunc model instead: {e}")
+            cache.put(
+                run_id,
+                model_id,
+                'pyfunc_model',
+                mlflow.artifacts.download_artifacts(model_location),
+            )
+            # Recorded so the service loads the pyfunc model without looking for these remotely
+            cache.mark_missing(run_id, model_id, 'booster')
+            cache.mark_missing(run_id, model_id, 'serving_bundle')
+
+        encoder_path = bake_preprocessor(cache, run_id, model_id, preprocessor_location, tmp_dir)
+        if booster_path is not None:
+            bake_bundle(cache, run_id, model_id, booster_path, encoder_path, tmp_dir)
+
+    try:
+        profile_path = mlflow.artifacts.download_artifacts(
+            model.get_reference_profile_location(run_id)
+        )
+        cache.put(run_id, model_id, 'reference_profile', profile_path)
+    except Exception as e:  # pylint: disable=broad-exception-caught
+        print(f"No reference profile for run {run_id}, drift monitoring will be disabled: {e}")
+        cache.mark_missing(run_id, model_id, 'reference_profile')
+
+    print(f"Embedded artifacts for run {run_id} / model {model_id} in {output_dir}")
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Bake model artifacts into a local directory.')
+    parser.add_argument('--run-id', required=True, help='MLflow run ID of the preprocessor')
+    parser.add_argument('--model-id', required=True, help='MLflow logged model ID')
+    parser.add_argument('--output-dir', default=DEFAULT_OUTPUT_DIR, help='Directory to bake into')
+    args = parser.parse_args()
+
+    bake(run_id=args.run_id, model_id=args.model_id, output_dir=args.output_dir)
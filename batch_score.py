@@ -0,0 +1,173 @@
+import os
+import time
+import urllib.request
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import numpy as np
+import pyarrow as pa
+from pyarrow import parquet as pq
+
+import model
+from trip_features import build_pu_do, raw_columns
+
+RUN_ID = os.getenv('RUN_ID', '70123647ea1f49a2889fcff4d7032960')
+MODEL_ID = os.getenv('MODEL_ID', 'm-b312b4c1155a4197af44793c03b32ad4')
+
+# Rows per record batch read from the input and scored by a worker
+DEFAULT_BATCH_ROWS = 100_000
+
+# Model and encoder loaded once per worker process by init_worker
+worker_state = {}
+
+
+def month_location(year, month, data_dir='data'):
+    file_path = Path(data_dir) / f'green_tripdata_{year}-{month:02d}.parquet'
+    url = (
+        f'https://d37ci6vzurychx.cloudfront.net/trip-data/green_tripdata_{year}-{month:02d}.parquet'
+    )
+
+    if not file_path.exists():
+        print(f"Downloading {url}...")
+        file_path.parent.mkdir(parents=True, exist_ok=True)
+        urllib.request.urlretrieve(url, file_path)
+    return file_path
+
+
+def init_worker(run_id, model_id, backend=None):
+    # transform_frame needs the compiled encoder, whatever FEATURE_ENCODER is set to
+    serving_model, encoder = model.load_model(
+        run_id, model_id, backend=backend, encoder_mode='compiled'
+    )
+    worker_state.update(model=serving_model, encoder=encoder, run_id=run_id)
+
+
+def predict_frame(serving_model, encoder, df):
+    if 'PU_DO' not in df.columns:
+        df = df.assign(PU_DO=build_pu_do(df['PULocationID'], df['DOLocationID']))
+
+    features = encoder.transform_frame(df)
+    return np.asarray(serving_model.predict(features), dtype=np.float32)
+
+
+def score_batch(batch):
+    """Append predicted_duration and model_version columns to a record batch."""
+    predictions = predict_frame(worker_state['model'], worker_state['encoder'], batch.to_pandas())
+    model_version = pa.DictionaryArray.from_arrays(
+        pa.array(np.zeros(batch.num_rows, dtype=np.int32)), pa.array([worker_state['run_id']])
+    )
+
+    table = pa.Table.from_batches([batch])
+    table = table.append_column('predicted_duration', pa.array(predictions))
+    return table.append_column('model_version', model_version)
+
+
+def score_batches(batches, n_workers, worker_args):
+    """Yield the scored tables in input order.
+
+    With more than one worker the batches are scored on a process pool, keeping at most
+    two batches per worker in flight so memory stays bounded on months of any size.
+    """
+    if n_workers <= 1:
+        yield from map(score_batch, batches)
+        return
+
+    with ProcessPoolExecutor(n_workers, initializer=init_worker, initargs=worker_args) as pool:
+        in_flight = deque()
+        for batch in batches:
+            in_flight.append(pool.submit(score_batch, batch))
+            if len(in_flight) >= 2 * n_workers:
+                yield in_flight.popleft().result()
+
+        while in_flight:
+            yield in_flight.popleft().result()
+
+
+def write_tables(tables, output_path):
+    # The schema is only known once the first batch has been scored
+    n_rows = 0
+    writer = None
+    try:
+        for table in tables:
+            if writer is None:
+                writer = pq.ParquetWriter(output_path, table.schema)
+            writer.write_table(table)
+            n_rows += table.num_rows
+    finally:
+        if writer is not None:
+            writer.close()
+    return n_rows
+
+
+def run(
+    input_path,
+    output_path,
+    run_id=RUN_ID,
+    model_id=MODEL_ID,
+    n_workers=None,
+    batch_rows=DEFAULT_BATCH_ROWS,
+    backend=None,
+):
+    """Score a Parquet file of rides with the same model and encoder as the Lambda.
+
+    The input is streamed in record batches of batch_rows rows; the output Parquet file
+    has the input columns plus predicted_duration and model_version.
+    """
+    n_workers = n_workers or os.cpu_count() or 1
+    worker_args = (run_id, model_id, backend)
+
+    # Loads in-process for a single worker; otherwise downloads the artifacts into the
+    # local cache once, so the workers only read them from disk
+    init_worker(*worker_args)
+
+    parquet_file = pq.ParquetFile(input_path)
+    columns = [c for c in [*raw_columns, 'PU_DO'] if c in parquet_file.schema_arrow.names]
+    batches = (
+        batch
+        for batch in parquet_file.iter_batches(batch_size=batch_rows, columns=columns)
+        if batch.num_rows
+    )
+
+    start = time.perf_counter()
+    n_rows = write_tables(score_batches(batches, n_workers, worker_args), output_path)
+    seconds = time.perf_counter() - start
+
+    rows_per_minute = n_rows / seconds * 60 if seconds else 0.0
+    print(
+        f"Scored {n_rows} rows with {n_workers} worker(s) in {seconds:.1f}s "
+        f"({rows_per_minute:,.0f} rows/min) -> {output_path}"
+    )
+    return n_rows
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Score a month of rides to Parquet.')
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument('--input', help='Local Parquet file of rides to score')
+    source.add_argument('--year', type=int, help='Year of the green taxi month to score')
+    parser.add_argument('--month', type=int, help='Green taxi month to score (with --year)')
+    parser.add_argument('--output', required=True, help='Parquet file to write predictions to')
+    parser.add_argument('--run-id', default=RUN_ID, help='MLflow run ID of the model')
+    parser.add_argument('--model-id', default=MODEL_ID, help='MLflow logged model ID')
+    parser.add_argument('--workers', type=int, help='Worker processes (defaults to all cores)')
+    parser.add_argument(
+        '--batch-rows', type=int, default=DEFAULT_BATCH_ROWS, help='Rows per scored batch'
+    )
+    parser.add_argument('--backend', choices=['booster', 'pyfunc'], help='Model backend')
+    args = parser.parse_args()
+
+    if args.year is not None and args.month is None:
+        parser.error('--month is required with --year')
+
+    run(
+        input_path=args.input or month_location(args.year, args.month),
+        output_path=args.output,
+        run_id=args.run_id,
+        model_id=args.model_id,
+        n_workers=args.workers,
+        batch_rows=args.batch_rows,
+        backend=args.backend,
+    )
@@ -0,0 +1,429 @@
+# pylint: disable=wrong-import-position, import-outside-toplevel, too-many-locals
+
+import base64
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager, redirect_stdout
+
+import numpy as np
+
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(PROJECT_DIR)
+import model
+from handler_metrics import HandlerMetrics
+from prediction_cache import PredictionCache
+
+DEFAULT_BATCH_SIZES = (1, 10, 100, 500)
+KEY_DISTRIBUTIONS = ('uniform', 'zipf', 'repeated')
+N_LOCATIONS = 265
+
+# Synthetic model version served when no --run-id is given
+SYNTHETIC_RUN_ID = 'benchmark-run'
+SYNTHETIC_MODEL_ID = 'm-benchmark'
+
+RIE_URL = 'http://localhost:8080/2015-03-31/functions/function/invocations'
+
+# Metrics that regress when they go down; every other metric regresses when it goes up
+HIGHER_IS_BETTER = ('records_per_sec',)
+# Reported but not compared: p99 of 100 batches is the second slowest one, and the warm init is
+# tens of milliseconds; both swing by more than any useful tolerance between identical runs
+UNGATED_METRICS = ('p99_ms', 'warm_init_ms')
+DEFAULT_TOLERANCE = 0.2
+
+# Runs in a fresh interpreter: the cold init is the lambda_function import (as in a new
+# container), the warm init a second model.init in the same process
+INIT_SCRIPT = """
+import json, resource, time
+start = time.perf_counter()
+import lambda_function
+cold = time.perf_counter() - start
+import model
+start = time.perf_counter()
+model.init(lambda_function.PREDICTIONS_STREAM_NAME, lambda_function.RUN_ID,
+           lambda_function.MODEL_ID, lambda_function.TEST_RUN)
+warm = time.perf_counter() - start
+print(json.dumps({'cold_init_ms': cold * 1000, 'warm_init_ms': warm * 1000,
+                  'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024}))
+"""
+
+
+def synthetic_rides(n, distribution='uniform', rng=None, n_keys=1000, zipf_a=1.3):
+    """Rides shaped like integration_tests/input_event.json after PU_DO is built.
+
+    'uniform' draws every location pair equally, 'zipf' concentrates traffic on a few
+    hot routes and 'repeated' replays n_keys distinct rides (prediction cache hits).
+    """
+    rng = rng if rng is not None else np.random.default_rng(0)
+    if distribution == 'repeated':
+        keys = synthetic_rides(n_keys, 'uniform', rng)
+        return [keys[i] for i in rng.integers(0, n_keys, n)]
+
+    if distribution == 'uniform':
+        routes = rng.integers(0, N_LOCATIONS**2, n)
+    elif distribution == 'zipf':
+        routes = (rng.zipf(zipf_a, n) - 1) % N_LOCATIONS**2
+    else:
+        raise ValueError(
+            f"Unknown key distribution {distribution!r}, expected one of {KEY_DISTRIBUTIONS}"
+        )
+
+    distances = np.round(rng.lognormal(1.0, 0.8, n), 2)
+    return [
+        {'PU_DO': f'{route // N_LOCATIONS + 1}_{route % N_LOCATIONS + 1}', 'trip_distance': d}
+        for route, d in zip(routes.tolist(), distances.tolist())
+    ]
+
+
+def kinesis_event(rides, first_ride_id=0):
+    records = []
+    for ride_id, ride in enumerate(rides, start=first_ride_id):
+        data = json.dumps({'ride': ride, 'ride_id': ride_id}).encode('utf-8')
+        records.append(
+            {
+                'kinesis': {
+                    'kinesisSchemaVersion': '1.0',
+                    'partitionKey': str(ride_id),
+                    'sequenceNumber': f'{ride_id:056d}',
+                    'data': base64.b64encode(data).decode('ascii'),
+                },
+                'eventSource': 'aws:kinesis',
+                'eventVersion': '1.0',
+                'eventName': 'aws:kinesis:record',
+            }
+        )
+    return {'Records': records}
+
+
+def synthetic_events(batch_size, n_batches, distribution='uniform', seed=0):
+    rides = synthetic_rides(batch_size * n_batches, distribution, np.random.default_rng(seed))
+    return [
+        kinesis_event(rides[start : start + batch_size], start)
+        for start in range(0, len(rides), batch_size)
+    ]
+
+
+def build_synthetic_artifacts(output_dir, preset='accurate', n_rides=20000, seed=0):
+    """Train a booster on synthetic rides and embed it the way bake_artifacts does"""
+    import xgboost as xgb
+    from sklearn.feature_extraction import DictVectorizer
+
+    from artifact_cache import ArtifactCache
+    from feature_encoder import FeatureEncoder
+    from serving_bundle import BUNDLE_FILENAME, write_bundle
+    from training_performance import training_params
+
+    rng = np.random.default_rng(seed)
+    rides = synthetic_rides(n_rides, 'zipf', rng)
+    distances = np.array([ride['trip_distance'] for ride in rides])
+    durations = np.clip(4 + 3 * distances + rng.normal(0, 4, n_rides), 1, 60)
+
+    dv = DictVectorizer()
+    features = dv.fit_transform(rides)
+    booster = xgb.train(training_params(preset), xgb.DMatrix(features, label=durations), 30)
+
+    cache = ArtifactCache(output_dir, max_bytes=float('inf'))
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        booster_path = os.path.join(tmp_dir, f'{SYNTHETIC_RUN_ID}.ubj')
+        booster.save_model(booster_path)
+        cache.put(SYNTHETIC_RUN_ID, SYNTHETIC_MODEL_ID, 'booster', booster_path)
+
+        encoder = FeatureEncoder.from_dict_vectorizer(dv)
+        encoder_path = os.path.join(tmp_dir, 'feature_encoder.npz')
+        encoder.save(encoder_path)
+        cache.put(SYNTHETIC_RUN_ID, SYNTHETIC_MODEL_ID, 'feature_encoder', encoder_path)
+
+        bundle_path = os.path.join(tmp_dir, BUNDLE_FILENAME)
+        write_bundle(bundle_path, booster, encoder, metadata={'run_id': SYNTHETIC_RUN_ID})
+        cache.put(SYNTHETIC_RUN_ID, SYNTHETIC_MODEL_ID, 'serving_bundle', bundle_path)
+    return output_dir
+
+
+def percentile_ms(latencies, q):
+    return float(np.percentile(latencies, q) * 1000)
+
+
+def peak_rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def time_batches(invoke, events, warmup=3):
+    for event in events[:warmup]:
+        invoke(event)
+
+    latencies = []
+    for event in events:
+        start = time.perf_counter()
+        invoke(event)
+        latencies.append(time.perf_counter() - start)
+
+    n_records = sum(len(event['Records']) for event in events)
+    return {
+        'records_per_sec': n_records / sum(latencies),
+        'p50_ms': percentile_ms(latencies, 50),
+        'p99_ms': percentile_ms(latencies, 99),
+    }
+
+
+@contextmanager
+def serving_artifacts(embedded_dir):
+    # Serve from the given embedded artifacts only, like an image baked with them
+    if embedded_dir is None:
+        yield
+        return
+    previous = model.embedded_artifacts_dir, model.artifact_cache_dir
+    model.embedded_artifacts_dir, model.artifact_cache_dir = embedded_dir, ''
+    try:
+        yield
+    finally:
+        model.embedded_artifacts_dir, model.artifact_cache_dir = previous
+
+
+def create_service(run_id, model_id):
+    # No callbacks, so the run measures the serving path rather than Kinesis; the prediction
+    # cache and metrics follow PREDICTION_CACHE_SIZE and HANDLER_METRICS as in the Lambda
+    serving_model, preprocessor = model.load_model(run_id, model_id)
+    prediction_cache = None
+    if model.prediction_cache_size > 0:
+        prediction_cache = PredictionCache(model.prediction_cache_size, model.prediction_cache_ttl)
+    return model.ModelService(
+        serving_model,
+        preprocessor,
+        run_id,
+        model_id,
+        False,
+        prediction_cache=prediction_cache,
+        metrics=HandlerMetrics(model.metrics_namespace) if model.handler_metrics_enabled else None,
+    )
+
+
+def rie_invoker(url):
+    def invoke(event):
+        request = urllib.request.Request(
+            url,
+            data=json.dumps(event).encode('utf-8'),
+            headers={'Content-Type': 'application/json'},
+        )
+        with urllib.request.urlopen(request, timeout=60) as response:
+            response.read()
+
+    return invoke
+
+
+def measure_init(run_id, model_id, embedded_dir=None):
+    env = {
+        **os.environ,
+        'RUN_ID': run_id,
+        'MODEL_ID': model_id,
+        'TEST_RUN': 'false',
+        'HANDLER_METRICS': 'false',
+        'AWS_DEFAULT_REGION': os.getenv('AWS_DEFAULT_REGION', 'us-east-2'),
+    }
+    if embedded_dir is not None:
+        env.update({'EMBEDDED_ARTIFACTS_DIR': embedded_dir, 'ARTIFACT_CACHE_DIR': ''})
+
+    result = subprocess.run(
+        [sys.executable, '-c', INIT_SCRIPT],
+        cwd=PROJECT_DIR,
+        env=env,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def run_scenarios(invoke, batch_sizes, distributions, n_batches, seed=0, repeats=1):
+    # Each scenario keeps its fastest of repeats runs, which filters out noise from other load
+    scenarios = {}
+    for distribution in distributions:
+        for batch_size in batch_sizes:
+            events = synthetic_events(batch_size, n_batches, distribution, seed)
+            scenarios[f'batch_{batch_size}/{distribution}'] = max(
+                (time_batches(invoke, events) for _ in range(repeats)),
+                key=lambda stats: stats['records_per_sec'],
+            )
+    return scenarios
+
+
+def run(
+    target='in-process',
+    batch_sizes=DEFAULT_BATCH_SIZES,
+    distributions=('uniform',),
+    n_batches=100,
+    run_id=None,
+    model_id=None,
+    rie_url=RIE_URL,
+    preset='accurate',
+    repeats=1,
+):
+    results = {
+        'environment': {
+            'target': target,
+            'python': platform.python_version(),
+            'machine': platform.machine(),
+            'cpu_count': os.cpu_count(),
+            'prediction_cache_size': model.prediction_cache_size,
+            'handler_metrics': model.handler_metrics_enabled,
+        },
+    }
+
+    if target == 'rie':
+        invoke = rie_invoker(rie_url)
+        # The Runtime Interface Emulator initializes the function on the first invocation
+        start = time.perf_counter()
+        invoke(synthetic_events(1, 1)[0])
+        results['init'] = {'first_invocation_ms': (time.perf_counter() - start) * 1000}
+        results['scenarios'] = run_scenarios(
+            invoke, batch_sizes, distributions, n_batches, repeats=repeats
+        )
+        return results
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        embedded_dir = None
+        if run_id is None:
+            # Trained in a child process so the training memory stays out of peak_rss_mb
+            embedded_dir = os.path.join(tmp_dir, 'embedded')
+            with ProcessPoolExecutor(max_workers=1) as executor:
+                executor.submit(build_synthetic_artifacts, embedded_dir, preset).result()
+            run_id, model_id = SYNTHETIC_RUN_ID, SYNTHETIC_MODEL_ID
+
+        results['init'] = measure_init(run_id, model_id, embedded_dir)
+        with serving_artifacts(embedded_dir):
+            service = create_service(run_id, model_id)
+        # The handler's log lines are written (and paid for) but not shown
+        with open(os.devnull, 'w', encoding='utf-8') as devnull, redirect_stdout(devnull):
+            results['scenarios'] = run_scenarios(
+                service.lambda_handler, batch_sizes, distributions, n_batches, repeats=repeats
+            )
+    results['peak_rss_mb'] = peak_rss_mb()
+    return results
+
+
+def flatten(results):
+    metrics = {f'init/{name}': value for name, value in results.get('init', {}).items()}
+    for scenario, values in results.get('scenarios', {}).items():
+        metrics.update({f'{scenario}/{name}': value for name, value in values.items()})
+    if 'peak_rss_mb' in results:
+        metrics['peak_rss_mb'] = results['peak_rss_mb']
+    return metrics
+
+
+def compare(results, baseline, tolerance=DEFAULT_TOLERANCE, min_delta_ms=0.0):
+    """Returns a message per metric that is more than tolerance worse than the baseline.
+
+    Millisecond metrics must also be at least min_delta_ms worse, so jitter on sub-millisecond
+    latencies does not count as a regression.
+    """
+    current = flatten(results)
+    regressions = []
+    for name, expected in flatten(baseline).items():
+        actual = current.get(name)
+        if actual is None or not expected or name.endswith(UNGATED_METRICS):
+            continue
+        if name.endswith(HIGHER_IS_BETTER):
+            change = (expected - actual) / expected
+        else:
+            change = (actual - expected) / expected
+        if name.endswith('_ms') and actual - expected < min_delta_ms:
+            continue
+        if change > tolerance:
+            regressions.append(f"{name}: {actual:.2f} vs. baseline {expected:.2f}")
+    return regressions
+
+
+def print_results(results):
+    for name, values in results.get('scenarios', {}).items():
+        print(
+            f"{name:>25}: {values['records_per_sec']:>10.0f} records/s  "
+            f"p50 {values['p50_ms']:>8.2f} ms  p99 {values['p99_ms']:>8.2f} ms"
+        )
+    for name, value in flatten(results).items():
+        if name.startswith('init/') or name == 'peak_rss_mb':
+            print(f"{name:>25}: {value:.1f}")
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Benchmark the serving path under load.')
+    parser.add_argument('--target', choices=['in-process', 'rie'], default='in-process')
+    parser.add_argument(
+        '--batch-sizes',
+        type=lambda value: [int(size) for size in value.split(',')],
+        default=list(DEFAULT_BATCH_SIZES),
+        help='Comma-separated records per Kinesis event',
+    )
+    parser.add_argument(
+        '--distributions',
+        type=lambda value: value.split(','),
+        default=['uniform'],
+        help=f'Comma-separated key distributions out of {",".join(KEY_DISTRIBUTIONS)}',
+    )
+    parser.add_argument('--batches', type=int, default=100, help='Timed events per scenario')
+    parser.add_argument(
+        '--repeats', type=int, default=1, help='Runs per scenario, the fastest is reported'
+    )
+    parser.add_argument('--run-id', help='Benchmark this model instead of a synthetic one')
+    parser.add_argument('--model-id', help='MLflow logged model ID of --run-id')
+    parser.add_argument(
+        '--preset', default='accurate', help='Training preset of the synthetic model'
+    )
+    parser.add_argument('--rie-url', default=RIE_URL, help='Invocation URL of the RIE container')
+    parser.add_argument('--output', help='Write the results as JSON to this file')
+    parser.add_argument('--baseline', help='Fail if the results regress against this JSON file')
+    parser.add_argument(
+        '--tolerance',
+        type=float,
+        default=DEFAULT_TOLERANCE,
+        help='Allowed fraction by which a metric may be worse than the baseline',
+    )
+    parser.add_argument(
+        '--min-delta-ms',
+        type=float,
+        default=0.0,
+        help='Smallest increase of a millisecond metric that counts as a regression',
+    )
+    args = parser.parse_args()
+    if bool(args.run_id) != bool(args.model_id):
+        parser.error('--run-id and --model-id go together')
+
+    benchmark_results = run(
+        target=args.target,
+        batch_sizes=args.batch_sizes,
+        distributions=args.distributions,
+        n_batches=args.batches,
+        run_id=args.run_id,
+        model_id=args.model_id,
+        rie_url=args.rie_url,
+        preset=args.preset,
+        repeats=args.repeats,
+    )
+    print_results(benchmark_results)
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(benchmark_results, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            baseline_results = json.load(f)
+        for key in ('python', 'machine', 'cpu_count'):
+            recorded = baseline_results.get('environment', {}).get(key)
+            if recorded != benchmark_results['environment'][key]:
+                print(
+                    f"WARNING baseline was recorded with {key}={recorded}, this run has "
+                    f"{benchmark_results['environment'][key]}; re-record it on this machine"
+                )
+        found = compare(benchmark_results, baseline_results, args.tolerance, args.min_delta_ms)
+        for regression in found:
+            print(f"REGRESSION {regression}")
+        if found:
+            sys.exit(1)
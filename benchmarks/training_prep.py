@@ -0,0 +1,64 @@
+# pylint: disable=wrong-import-position
+
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from trip_features import prepare_trips, raw_columns
+
+
+def legacy_prepare_trips(df):
+    # The original read_dataframe prep: per-row duration and string concatenation
+    df = df.copy()
+    df['duration'] = df.lpep_dropoff_datetime - df.lpep_pickup_datetime
+    df.duration = df.duration.apply(lambda td: td.total_seconds() / 60)
+    df = df[(df.duration >= 1) & (df.duration <= 60)]
+    categorical = ['PULocationID', 'DOLocationID']
+    df[categorical] = df[categorical].astype(str)
+    df['PU_DO'] = df['PULocationID'] + '_' + df['DOLocationID']
+    return df
+
+
+def best_time(func, df, repeats):
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        result = func(df)
+        timings.append(time.perf_counter() - start)
+    return min(timings), result
+
+
+def run(year, month, repeats=3, path=None):
+    url = (
+        f'https://d37ci6vzurychx.cloudfront.net/trip-data/green_tripdata_{year}-{month:02d}.parquet'
+    )
+    raw = pd.read_parquet(path or url, columns=raw_columns)
+
+    legacy_seconds, expected = best_time(legacy_prepare_trips, raw, repeats)
+    vectorized_seconds, actual = best_time(prepare_trips, raw, repeats)
+
+    assert actual.index.equals(expected.index), "Vectorized prep kept different rows"
+    np.testing.assert_array_equal(actual['duration'], expected['duration'])
+    assert actual['PU_DO'].astype(str).tolist() == expected['PU_DO'].tolist()
+
+    print(f"{path or url}: {len(raw)} raw rows, {len(actual)} kept")
+    print(f"legacy prep:     {legacy_seconds:.3f}s")
+    print(f"vectorized prep: {vectorized_seconds:.3f}s")
+    print(f"speedup:         {legacy_seconds / vectorized_seconds:.1f}x")
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Benchmark the training data prep.')
+    parser.add_argument('--year', type=int, default=2022, help='Year of the month to benchmark')
+    parser.add_argument('--month', type=int, default=1, help='Month to benchmark')
+    parser.add_argument('--repeats', type=int, default=3, help='Timed runs per implementation')
+    parser.add_argument('--path', help='Local Parquet file to use instead of downloading the month')
+    args = parser.parse_args()
+
+    run(year=args.year, month=args.month, repeats=args.repeats, path=args.path)
@@ -0,0 +1,77 @@
+import json
+import queue
+import threading
+
+# Queue marker asking the worker to flush every sink once the events before it are delivered
+FLUSH = object()
+
+
+def callback_name(callback):
+    return getattr(callback, '__qualname__', repr(callback))
+
+
+class CallbackDispatcher:
+    """Delivers prediction events to the callbacks, inline or on a background worker thread.
+
+    In asynchronous mode events go through a bounded queue, so prediction and delivery
+    overlap while a sink that falls behind blocks submit() once the queue is full.
+    drain() only returns after every submitted event was delivered and the sinks flushed.
+    Callback failures are counted per callback instead of aborting the batch.
+    """
+
+    def __init__(self, callbacks, flush_callbacks=None, asynchronous=False, max_queue_size=1000):
+        self.callbacks = callbacks
+        self.flush_callbacks = flush_callbacks or []
+        self.error_counts = {}
+        self.queue = None
+
+        if asynchronous:
+            self.queue = queue.Queue(maxsize=max_queue_size)
+            worker = threading.Thread(target=self.run_worker, name='callback-dispatcher')
+            worker.daemon = True
+            worker.start()
+
+    def call(self, callback, *args):
+        try:
+            callback(*args)
+        except Exception:  # pylint: disable=broad-exception-caught
+            name = callback_name(callback)
+            self.error_counts[name] = self.error_counts.get(name, 0) + 1
+
+    def deliver(self, prediction_event):
+        for callback in self.callbacks:
+            self.call(callback, prediction_event)
+
+    def flush(self):
+        for flush_callback in self.flush_callbacks:
+            self.call(flush_callback)
+
+    def submit(self, prediction_event):
+        if self.queue is None:
+            self.deliver(prediction_event)
+        else:
+            # Blocks while the queue is full, applying backpressure to the prediction loop
+            self.queue.put(prediction_event)
+
+    def drain(self):
+        errors_before = sum(self.error_counts.values())
+
+        if self.queue is None:
+            self.flush()
+        else:
+            self.queue.put(FLUSH)
+            self.queue.join()
+
+        if sum(self.error_counts.values()) > errors_before:
+            print(json.dumps({'callback_errors': self.error_counts}))
+
+    def run_worker(self):
+        while True:
+            item = self.queue.get()
+            try:
+                if item is FLUSH:
+                    self.flush()
+                else:
+                    self.deliver(item)
+            finally:
+                self.queue.task_done()
@@ -0,0 +1,235 @@
+import json
+import math
+import time
+from numbers import Real
+
+import numpy as np
+
+# Ride feature and prediction compared with the training reference at serving time
+MONITORED_COLUMNS = ('trip_distance', 'predicted_duration')
+PROFILE_FORMAT_VERSION = 1
+QUANTILES = (0.05, 0.25, 0.5, 0.75, 0.95)
+
+# Bin proportions are floored at this in the PSI so an empty bin does not make it infinite
+PSI_EPSILON = 1e-4
+
+# Value types numeric_values converts in one numpy call
+NUMERIC_TYPES = {float, int, np.float64, type(None)}
+
+
+class QuantileSketch:
+    """Log-bucketed counts of values on a fixed grid, updated a whole batch at a time.
+
+    Bucket i holds values in (min_value * growth**(i - 1), min_value * growth**i]; bucket 0
+    also holds everything at or below min_value (zero and negative trip distances) and the
+    last bucket everything above max_value. Quantiles are within about (growth - 1) / 2
+    relative error, memory is fixed, and two sketches on the same grid compare bucket by
+    bucket, which is what the drift scores do.
+    """
+
+    def __init__(self, min_value=0.01, max_value=10000.0, growth=1.02):
+        self.min_value = min_value
+        self.max_value = max_value
+        self.growth = growth
+        self.log_growth = math.log(growth)
+        n_buckets = math.ceil(math.log(max_value / min_value) / self.log_growth) + 1
+        # The extra bucket holds values above max_value
+        self.counts = np.zeros(n_buckets + 1, dtype=np.int64)
+        self.count = 0
+        self.total = 0.0
+
+    def update(self, values):
+        values = np.asarray(values, dtype=np.float64)
+        values = values[~np.isnan(values)]
+        if not values.size:
+            return
+        with np.errstate(divide='ignore', invalid='ignore'):
+            indices = np.ceil(np.log(values / self.min_value) / self.log_growth)
+        indices = np.clip(np.nan_to_num(indices, nan=0.0, neginf=0.0), 0, len(self.counts) - 1)
+        self.counts += np.bincount(indices.astype(np.intp), minlength=len(self.counts))
+        self.count += len(values)
+        self.total += float(values.sum())
+
+    def clear(self):
+        self.counts[:] = 0
+        self.count = 0
+        self.total = 0.0
+
+    def bucket_values(self):
+        # Geometric middle of each bucket; bucket 0 and the overflow bucket use their bound
+        values = self.min_value * self.growth ** (np.arange(len(self.counts)) - 0.5)
+        values[0] = self.min_value
+        values[-1] = self.max_value
+        return values
+
+    def quantiles(self, qs=QUANTILES):
+        if not self.count:
+            return {}
+        cumulative = np.cumsum(self.counts)
+        indices = np.searchsorted(cumulative, np.ceil(np.asarray(qs) * self.count).clip(1))
+        values = self.bucket_values()[indices]
+        return {f'p{round(q * 100)}': round(float(value), 4) for q, value in zip(qs, values)}
+
+    def cdf(self):
+        return np.cumsum(self.counts) / self.count
+
+    def to_dict(self):
+        indices = np.flatnonzero(self.counts)
+        return {
+            'min_value': self.min_value,
+            'max_value': self.max_value,
+            'growth': self.growth,
+            'count': self.count,
+            'total': self.total,
+            'bucket_indices': indices.tolist(),
+            'bucket_counts': self.counts[indices].tolist(),
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        sketch = cls(data['min_value'], data['max_value'], data['growth'])
+        sketch.counts[data['bucket_indices']] = data['bucket_counts']
+        sketch.count = data['count']
+        sketch.total = data['total']
+        return sketch
+
+
+def bin_edges(sketch, n_bins=10):
+    """Bucket indices splitting the sketch into at most n_bins bins of about equal mass"""
+    cumulative = np.cumsum(sketch.counts)
+    edges = np.searchsorted(cumulative, np.arange(1, n_bins) / n_bins * sketch.count)
+    return np.unique(edges[edges < len(sketch.counts) - 1])
+
+
+def binned_proportions(sketch, edges):
+    # Bin j holds the buckets up to and including edges[j]; the last bin holds the rest
+    cumulative = np.cumsum(sketch.counts)[edges]
+    return np.diff(cumulative, prepend=0, append=sketch.count) / sketch.count
+
+
+def population_stability_index(reference, live, edges):
+    expected = np.maximum(binned_proportions(reference, edges), PSI_EPSILON)
+    actual = np.maximum(binned_proportions(live, edges), PSI_EPSILON)
+    return float(np.sum((actual - expected) * np.log(actual / expected)))
+
+
+def ks_statistic(reference, live):
+    # Largest CDF gap at the bucket bounds, a lower bound of the exact two-sample statistic
+    return float(np.max(np.abs(reference.cdf() - live.cdf())))
+
+
+class Profile:
+    """Quantile sketches of columns of rides and predictions.
+
+    Training saves the profile of its training-set outputs as the reference; serving
+    builds live profiles and compares them with it.
+    """
+
+    def __init__(self, columns=MONITORED_COLUMNS, sketches=None):
+        self.sketches = sketches or {column: QuantileSketch() for column in columns}
+
+    def update(self, columns):
+        # columns maps names to arrays of values, e.g. a DataFrame
+        for name, sketch in self.sketches.items():
+            if name in columns:
+                sketch.update(columns[name])
+
+    def clear(self):
+        for sketch in self.sketches.values():
+            sketch.clear()
+
+    def to_dict(self):
+        return {
+            'format_version': PROFILE_FORMAT_VERSION,
+            'columns': {name: sketch.to_dict() for name, sketch in self.sketches.items()},
+        }
+
+    def save(self, path):
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(self.to_dict(), f)
+
+    @classmethod
+    def load(cls, path):
+        with open(path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        if data['format_version'] > PROFILE_FORMAT_VERSION:
+            raise ValueError(f"Unsupported reference profile version {data['format_version']}")
+        return cls(
+            sketches={
+                name: QuantileSketch.from_dict(column) for name, column in data['columns'].items()
+            }
+        )
+
+
+def compare(reference, live, n_bins=10):
+    """Drift of every column both profiles have observed: PSI over the reference's
+    quantile bins, KS over the sketch buckets, and both sets of quantiles"""
+    drift = {}
+    for name, live_sketch in live.sketches.items():
+        reference_sketch = reference.sketches.get(name)
+        if reference_sketch is None or not reference_sketch.count or not live_sketch.count:
+            continue
+        edges = bin_edges(reference_sketch, n_bins)
+        drift[name] = {
+            'count': live_sketch.count,
+            'psi': round(population_stability_index(reference_sketch, live_sketch, edges), 4),
+            'ks': round(ks_statistic(reference_sketch, live_sketch), 4),
+            'quantiles': live_sketch.quantiles(),
+            'reference_quantiles': reference_sketch.quantiles(),
+        }
+    return drift
+
+
+def numeric_values(values):
+    # None (a missing feature or failed prediction) converts to nan
+    if set(map(type, values)) <= NUMERIC_TYPES:
+        return np.array(values, dtype=np.float64)
+    # Rides come from JSON, so a feature can also be a string or a bool, which numpy would convert
+    return np.array(
+        [
+            value if isinstance(value, Real) and not isinstance(value, bool) else np.nan
+            for value in values
+        ],
+        dtype=np.float64,
+    )
+
+
+class DriftMonitor:
+    """Compares the rides and predictions served by one run with its training reference.
+
+    Every batch goes into the live sketches; once report_interval seconds have passed,
+    the window's drift is emitted as a {'drift': ...} JSON line and a new window starts.
+    """
+
+    def __init__(self, reference, run_id, report_interval=300.0, clock=time.monotonic, emit=print):
+        self.reference = reference
+        self.run_id = run_id
+        self.live = Profile(
+            columns=[name for name in MONITORED_COLUMNS if name in reference.sketches]
+        )
+        self.report_interval = report_interval
+        self.clock = clock
+        self.emit = emit
+        self.window_start = clock()
+
+    def update(self, rides, predictions):
+        self.live.update(
+            {
+                'trip_distance': numeric_values([ride.get('trip_distance') for ride in rides]),
+                'predicted_duration': numeric_values(predictions),
+            }
+        )
+        if self.clock() - self.window_start >= self.report_interval:
+            self.report()
+
+    def report(self):
+        now = self.clock()
+        drift = {
+            'version': self.run_id,
+            'window_seconds': round(now - self.window_start, 1),
+            'columns': compare(self.reference, self.live),
+        }
+        self.emit(json.dumps({'drift': drift}))
+        self.live.clear()
+        self.window_start = now
+        return drift
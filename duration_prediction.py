@@ -2,13 +2,33 @@
 
 import os
 import pickle
+import tempfile
 from pathlib import Path
 
 import mlflow
+import numpy as np
 import pandas as pd
 import xgboost as xgb
+from pyarrow import feather
 from sklearn.feature_extraction import DictVectorizer
-from sklearn.metrics import root_mean_squared_error
+
+from drift_monitoring import MONITORED_COLUMNS, Profile, compare
+from feature_encoder import FeatureEncoder
+from serving_bundle import BUNDLE_FILENAME, write_bundle
+from streaming_training import (
+    DEFAULT_CHUNK_ROWS,
+    build_dmatrix,
+    fit_encoder,
+    iter_chunks,
+)
+from training_performance import (
+    TREE_METHODS,
+    PhaseTimer,
+    training_params,
+    training_presets,
+    uses_quantile_dmatrix,
+)
+from trip_features import cache_trips, prepare_trips, raw_columns
 
 # TRACKING_SERVER_URI='s3://mlops-learning-madamski/artifacts/'
 TRACKING_SERVER_URI = 'http://localhost:5000'
@@ -26,32 +46,33 @@ training_outputs_folder = Path('data/training_outputs')
 training_outputs_folder.mkdir(exist_ok=True)
 
 
-def read_dataframe(year, month):
-    file_path = f'./data/green_tripdata_{year}-{month:02d}.csv'
+training_columns = ['PU_DO', 'trip_distance', 'duration']
+
+num_boost_round = 30
+
+
+def cache_month(year, month):
+    file_path = f'./data/green_tripdata_{year}-{month:02d}.arrow'
     url = (
         f'https://d37ci6vzurychx.cloudfront.net/trip-data/green_tripdata_{year}-{month:02d}.parquet'
     )
+    return cache_trips(file_path, lambda: prepare_trips(pd.read_parquet(url, columns=raw_columns)))
 
-    if Path(file_path).exists():
-        print("Dataset already cached. Reading from local storage...")
-        df = pd.read_csv(file_path)
-    else:
-        print("Downloading dataset from URL...")
-        df = pd.read_parquet(url)
-
-        df['duration'] = df.lpep_dropoff_datetime - df.lpep_pickup_datetime
-        df.duration = df.duration.apply(lambda td: td.total_seconds() / 60)
 
-        df = df[(df.duration >= 1) & (df.duration <= 60)]
+def read_dataframe(year, month, columns=None):
+    table = feather.read_table(cache_month(year, month), columns=columns, memory_map=True)
+    return table.to_pandas()
 
-        categorical = ['PULocationID', 'DOLocationID']
-        df[categorical] = df[categorical].astype(str)
 
-        df['PU_DO'] = df['PULocationID'] + '_' + df['DOLocationID']
+def next_month(year, month):
+    return (year, month + 1) if month < 12 else (year + 1, 1)
 
-        df.to_csv(file_path)
 
-    return df
+def month_range(year, month, n_months):
+    months = [(year, month)]
+    while len(months) < n_months:
+        months.append(next_month(*months[-1]))
+    return months
 
 
 def create_X(df, dv=None):
@@ -68,114 +89,222 @@ def create_X(df, dv=None):
     return X, dv
 
 
-def train_model(X_train, y_train, X_val, y_val, dv, val_year, val_month):
+def write_predictions(booster, chunks, trip_distance_idx, location, profile=None):
+    """Predict chunk by chunk, appending each chunk to the CSV at location.
+
+    Returns the absolute errors of all rows, the only per-row values kept in memory.
+    Each chunk is also added to profile, when given.
+    """
+    absolute_errors = []
+
+    for X, y in chunks():
+        y_pred = booster.inplace_predict(X)
+        dataset = pd.DataFrame(
+            {
+                'trip_distance': X[:, trip_distance_idx].toarray().flatten(),
+                'actual_duration': y,
+                'predicted_duration': y_pred,
+                'prediction_error': y_pred - y,
+                'absolute_error': abs(y_pred - y),
+            }
+        )
+        header = not absolute_errors
+        dataset.to_csv(location, index=False, mode='w' if header else 'a', header=header)
+        if profile is not None:
+            profile.update(dataset)
+        absolute_errors.append(dataset['absolute_error'].to_numpy())
+
+    return np.concatenate(absolute_errors)
+
+
+def create_dmatrix(X, y, params, quantile=True):
+    # The training matrix is quantized once up front for 'hist'. Evaluation sets stay a
+    # plain DMatrix, per-round prediction on a quantile DMatrix is much slower.
+    if quantile and uses_quantile_dmatrix(params):
+        return xgb.QuantileDMatrix(
+            X, label=y, max_bin=params.get('max_bin'), nthread=params.get('nthread')
+        )
+    return xgb.DMatrix(X, label=y, nthread=params.get('nthread'))
+
+
+def train_model(X_train, y_train, X_val, y_val, dv, val_year, val_month, params=None, timer=None):
+    params = training_params() if params is None else params
+    timer = timer if timer is not None else PhaseTimer()
+
+    with timer.phase('dmatrix'):
+        train = create_dmatrix(X_train, y_train, params)
+        valid = create_dmatrix(X_val, y_val, params, quantile=False)
+
+    def train_chunks():
+        return iter([(X_train, y_train)])
+
+    def val_chunks():
+        return iter([(X_val, y_val)])
+
+    return fit_model(train, valid, train_chunks, val_chunks, dv, val_year, val_month, params, timer)
+
+
+def fit_model(train, valid, train_chunks, val_chunks, dv, val_year, val_month, params, timer):
+    # train_chunks/val_chunks return fresh iterators of (X, y) matching the train/valid
+    # DMatrix rows, so the prediction outputs never need the full matrices in memory
     with mlflow.start_run() as training_run:
-        train = xgb.DMatrix(X_train, label=y_train)
-        valid = xgb.DMatrix(X_val, label=y_val)
-
-        run_params = {
-            'learning_rate': 0.09585355369315604,
-            'max_depth': 30,
-            'min_child_weight': 1.060597050922164,
-            'objective': 'reg:linear',
-            'reg_alpha': 0.018060244040060163,
-            'reg_lambda': 0.011658731377413597,
-            'seed': 42,
-        }
-        all_params = run_params
+        all_params = dict(params)
+        all_params['num_boost_round'] = num_boost_round
         all_params['val_data_year'] = val_year
         all_params['val_data_month'] = val_month
 
         mlflow.log_params(all_params)
 
-        booster = xgb.train(
-            params=run_params,
-            dtrain=train,
-            num_boost_round=30,
-            evals=[(valid, 'validation')],
-            early_stopping_rounds=50,
-        )
+        with timer.phase('boost'):
+            booster = xgb.train(
+                params=params,
+                dtrain=train,
+                num_boost_round=num_boost_round,
+                evals=[(valid, 'validation')],
+                early_stopping_rounds=50,
+            )
 
         run_id = training_run.info.run_id
 
-        y_pred_train = booster.predict(train)
-        y_pred_val = booster.predict(valid)
-
-        rmse = root_mean_squared_error(y_val, y_pred_val)
-        mlflow.log_metric("rmse", rmse)
-
-        # Create a simple dataset with trip_distance and predictions
-        feature_names = dv.get_feature_names_out()
-        trip_distance_idx = feature_names.tolist().index('trip_distance')
-
-        training_dataset = pd.DataFrame(
-            {
-                'trip_distance': X_train[:, trip_distance_idx].toarray().flatten(),
-                'actual_duration': y_train,
-                'predicted_duration': y_pred_train,
-                'prediction_error': y_pred_train - y_train,
-                'absolute_error': abs(y_pred_train - y_train),
-            }
-        )
-        validation_dataset = pd.DataFrame(
-            {
-                'trip_distance': X_val[:, trip_distance_idx].toarray().flatten(),
-                'actual_duration': y_val,
-                'predicted_duration': y_pred_val,
-                'prediction_error': y_pred_val - y_val,
-                'absolute_error': abs(y_pred_val - y_val),
-            }
-        )
-        predictions_location = f"./data/training_outputs/{run_id}"
-        train_predictions_location = f"{predictions_location}/train_predictions.csv"
-        val_predictions_location = f"{predictions_location}/val_predictions.csv"
-
-        os.makedirs(predictions_location, exist_ok=True)
-        training_dataset.to_csv(train_predictions_location, index=False)
-        validation_dataset.to_csv(val_predictions_location, index=False)
-        print(f"Training dataset with predictions saved to: {train_predictions_location}")
-        print(f"Validation dataset with predictions saved to: {val_predictions_location}")
-
-        # Log the predictions file as an MLflow artifact
-        mlflow.log_artifact(train_predictions_location, artifact_path="predictions")
-        mlflow.log_artifact(val_predictions_location, artifact_path="predictions")
-
-        # Log additional metrics for analysis
-        val_mean_absolute_error = validation_dataset['absolute_error'].mean()
-        val_median_absolute_error = validation_dataset['absolute_error'].median()
-        mlflow.log_metric("val_mean_absolute_error", val_mean_absolute_error)
-        mlflow.log_metric("val_median_absolute_error", val_median_absolute_error)
-
-        train_mean_absolute_error = training_dataset['absolute_error'].mean()
-        train_median_absolute_error = training_dataset['absolute_error'].median()
-        mlflow.log_metric("train_mean_absolute_error", train_mean_absolute_error)
-        mlflow.log_metric("train_median_absolute_error", train_median_absolute_error)
-
-        with open("models/preprocessor.b", "wb") as f_out:
-            pickle.dump(dv, f_out)
-        mlflow.log_artifact("models/preprocessor.b", artifact_path="preprocessor")
-
-        booster.save_model(f"models/{run_id}.json")
-        mlflow.xgboost.log_model(booster, artifact_path="models_mlflow")
+        with timer.phase('eval'):
+            # Create a simple dataset with trip_distance and predictions
+            feature_names = dv.get_feature_names_out()
+            trip_distance_idx = feature_names.tolist().index('trip_distance')
+
+            predictions_location = f"./data/training_outputs/{run_id}"
+            train_predictions_location = f"{predictions_location}/train_predictions.csv"
+            val_predictions_location = f"{predictions_location}/val_predictions.csv"
+
+            os.makedirs(predictions_location, exist_ok=True)
+            # Sketches of the outputs; the training one is the reference drift is measured against
+            profile_columns = (*MONITORED_COLUMNS, 'absolute_error')
+            train_profile, val_profile = Profile(profile_columns), Profile(profile_columns)
+            train_absolute_errors = write_predictions(
+                booster, train_chunks, trip_distance_idx, train_predictions_location, train_profile
+            )
+            val_absolute_errors = write_predictions(
+                booster, val_chunks, trip_distance_idx, val_predictions_location, val_profile
+            )
+            print(f"Training dataset with predictions saved to: {train_predictions_location}")
+            print(f"Validation dataset with predictions saved to: {val_predictions_location}")
+
+            rmse = np.sqrt(np.mean(val_absolute_errors**2))
+            mlflow.log_metric("rmse", rmse)
+
+            # Log additional metrics for analysis
+            mlflow.log_metric("val_mean_absolute_error", np.mean(val_absolute_errors))
+            mlflow.log_metric("val_median_absolute_error", np.median(val_absolute_errors))
+            mlflow.log_metric("train_mean_absolute_error", np.mean(train_absolute_errors))
+            mlflow.log_metric("train_median_absolute_error", np.median(train_absolute_errors))
+            mlflow.log_metric("val_p90_absolute_error", np.percentile(val_absolute_errors, 90))
+
+            # Drift of the validation month from the training data, absolute_error included
+            for column, drift in compare(train_profile, val_profile).items():
+                mlflow.log_metric(f"val_psi_{column}", drift['psi'])
+                mlflow.log_metric(f"val_ks_{column}", drift['ks'])
+
+        with timer.phase('upload'):
+            # Log the predictions file as an MLflow artifact
+            mlflow.log_artifact(train_predictions_location, artifact_path="predictions")
+            mlflow.log_artifact(val_predictions_location, artifact_path="predictions")
+
+            with open("models/preprocessor.b", "wb") as f_out:
+                pickle.dump(dv, f_out)
+            mlflow.log_artifact("models/preprocessor.b", artifact_path="preprocessor")
+
+            booster.save_model(f"models/{run_id}.json")
+            mlflow.log_artifact(f"models/{run_id}.json", artifact_path="booster")
+            mlflow.xgboost.log_model(booster, artifact_path="models_mlflow")
+
+            # Single non-pickle file the serving path memory-maps (see serving_bundle.py)
+            write_bundle(
+                f"models/{BUNDLE_FILENAME}",
+                booster,
+                FeatureEncoder.from_dict_vectorizer(dv),
+                metadata={
+                    'run_id': run_id,
+                    'xgboost_version': xgb.__version__,
+                    'num_boost_round': booster.num_boosted_rounds(),
+                },
+            )
+            mlflow.log_artifact(f"models/{BUNDLE_FILENAME}", artifact_path="serving_bundle")
+
+            train_profile.save("models/reference_profile.json")
+            mlflow.log_artifact("models/reference_profile.json", artifact_path="monitoring")
+
+        # Per-phase training cost, comparable across releases alongside rmse
+        timings = timer.metrics()
+        mlflow.log_metrics(timings)
+        print("Training phase timings: " + ", ".join(f"{k}={v:.2f}" for k, v in timings.items()))
 
         return run_id
 
 
-def run(year, month):
-    df_train = read_dataframe(year=year, month=month)
+def run(year, month, preset='accurate', tree_method='hist', nthread=None):
+    params = training_params(preset, tree_method, nthread)
+    timer = PhaseTimer()
 
-    next_year = year if month < 12 else year + 1
-    next_month = month + 1 if month < 12 else 1
-    df_val = read_dataframe(year=next_year, month=next_month)
+    val_year, val_month = next_month(year, month)
+    with timer.phase('load'):
+        df_train = read_dataframe(year=year, month=month, columns=training_columns)
+        df_val = read_dataframe(year=val_year, month=val_month, columns=training_columns)
 
-    X_train, dv = create_X(df_train)
-    X_val, _ = create_X(df_val, dv)
+    with timer.phase('encode'):
+        X_train, dv = create_X(df_train)
+        X_val, _ = create_X(df_val, dv)
 
     target = 'duration'
     y_train = df_train[target].values
     y_val = df_val[target].values
 
-    run_id = train_model(X_train, y_train, X_val, y_val, dv, next_year, next_month)
+    run_id = train_model(
+        X_train, y_train, X_val, y_val, dv, val_year, val_month, params=params, timer=timer
+    )
+    print(f"MLflow run_id: {run_id}")
+    return run_id
+
+
+def run_streaming(
+    year, month, n_months, chunk_rows=DEFAULT_CHUNK_ROWS, preset='accurate', **param_options
+):
+    """Train on n_months consecutive months starting at year/month, validating on the next.
+
+    Months are cached and read one record batch at a time: the vocabulary is fixed in a
+    first pass, then each chunk is encoded straight to CSR and fed to XGBoost's
+    external-memory DMatrix, so memory stays bounded by the chunk size rather than the
+    number of months.
+    """
+    params = training_params(preset, **param_options)
+    timer = PhaseTimer()
+
+    train_months = month_range(year, month, n_months)
+    val_year, val_month = next_month(*train_months[-1])
+
+    with timer.phase('load'):
+        train_paths = [cache_month(*train_month) for train_month in train_months]
+        val_paths = [cache_month(val_year, val_month)]
+
+    with timer.phase('encode'):
+        dv, encoder = fit_encoder(train_paths)
+
+    def train_chunks():
+        return iter_chunks(train_paths, encoder, chunk_rows, timer)
+
+    def val_chunks():
+        return iter_chunks(val_paths, encoder, chunk_rows, timer)
+
+    with tempfile.TemporaryDirectory() as cache_dir:
+        with timer.phase('dmatrix'):
+            train = build_dmatrix(train_chunks, os.path.join(cache_dir, 'train'), params=params)
+            valid = build_dmatrix(
+                val_chunks, os.path.join(cache_dir, 'valid'), params=params, quantile=False
+            )
+        run_id = fit_model(
+            train, valid, train_chunks, val_chunks, dv, val_year, val_month, params, timer
+        )
+        # Release the pages before their cache directory is removed
+        del train, valid
+
     print(f"MLflow run_id: {run_id}")
     return run_id
 
@@ -186,6 +315,39 @@ if __name__ == "__main__":
     parser = argparse.ArgumentParser(description='Train a model to predict taxi trip duration.')
     parser.add_argument('--year', type=int, required=True, help='Year of the data to train on')
     parser.add_argument('--month', type=int, required=True, help='Month of the data to train on')
+    parser.add_argument(
+        '--months',
+        type=int,
+        default=1,
+        help='Number of consecutive months to train on, streamed in chunks when more than one',
+    )
+    parser.add_argument(
+        '--chunk-rows', type=int, default=DEFAULT_CHUNK_ROWS, help='Rows per streamed chunk'
+    )
+    parser.add_argument(
+        '--preset',
+        choices=list(training_presets),
+        default='accurate',
+        help='Depth vs. speed preset (accurate: max_depth 30, balanced: 12, fast: 6)',
+    )
+    parser.add_argument('--tree-method', choices=TREE_METHODS, default='hist', help='Tree method')
+    parser.add_argument(
+        '--nthread', type=int, help='Threads used by XGBoost (defaults to all cores)'
+    )
     args = parser.parse_args()
 
-    run(year=args.year, month=args.month)
+    performance_options = {
+        'preset': args.preset,
+        'tree_method': args.tree_method,
+        'nthread': args.nthread,
+    }
+    if args.months > 1:
+        run_streaming(
+            year=args.year,
+            month=args.month,
+            n_months=args.months,
+            chunk_rows=args.chunk_rows,
+            **performance_options,
+        )
+    else:
+        run(year=args.year, month=args.month, **performance_options)
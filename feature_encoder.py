@@ -0,0 +1,283 @@
+import bisect
+from collections.abc import Iterable, Mapping
+from numbers import Number
+
+import numpy as np
+from scipy import sparse
+
+# Marks a field that is absent from a ride
+MISSING = object()
+
+# Value types that can take the fast, type-homogeneous encoding paths
+NUMERIC_TYPES = (int, float, bool, type(None))
+
+
+class SortedLookup(Mapping):
+    """Read-only {value: column} lookup over a sorted array of UTF-8 keys.
+
+    The arrays can be views of a memory-mapped serving bundle, so the vocabulary is never
+    materialized as a dict; get_many() looks a whole column of values up with one
+    np.searchsorted.
+    """
+
+    def __init__(self, keys, columns):
+        self.sorted_keys = keys
+        self.columns = columns
+
+    def __len__(self):
+        return len(self.sorted_keys)
+
+    def __iter__(self):
+        return (key.decode('utf-8') for key in self.sorted_keys.tolist())
+
+    def __getitem__(self, value):
+        if not isinstance(value, str):
+            raise KeyError(value)
+        key = value.encode('utf-8')
+        index = bisect.bisect_left(self.sorted_keys, key)
+        if index == len(self.sorted_keys) or self.sorted_keys[index] != key:
+            raise KeyError(value)
+        return int(self.columns[index])
+
+    def get_many(self, values):
+        """Columns of a list of str (or MISSING) values, -1 where the value is unknown"""
+        if len(self.sorted_keys) == 0 or len(values) == 0:
+            return np.full(len(values), -1, dtype=np.int64)
+        # Queries keep their own width, a longer value is never truncated into a match
+        queries = np.array([v.encode('utf-8') if v is not MISSING else b'' for v in values])
+        indices = np.minimum(np.searchsorted(self.sorted_keys, queries), len(self.sorted_keys) - 1)
+        found = self.sorted_keys[indices] == queries
+        if MISSING in values:
+            found &= np.fromiter((v is not MISSING for v in values), dtype=bool, count=len(values))
+        return np.where(found, self.columns[indices], -1).astype(np.int64)
+
+
+def lookup_columns(lookup, values):
+    if isinstance(lookup, SortedLookup):
+        return lookup.get_many(values)
+    return np.fromiter(
+        (lookup.get(value, -1) if value is not MISSING else -1 for value in values),
+        dtype=np.int64,
+        count=len(values),
+    )
+
+
+class FeatureEncoder:
+    """Compiled replacement for a fitted DictVectorizer at serve time.
+
+    The vectorizer's vocabulary_ is split into, per field, a lookup from categorical
+    value to column (e.g. PU_DO '43_151' -> column id) and a fixed column for numerical
+    values (e.g. trip_distance). transform() gathers one value column per known field
+    for the whole batch and builds the CSR indptr/indices/data arrays with numpy. For the
+    known fields the output and errors match DictVectorizer.transform: unknown values are
+    ignored, categorical values are encoded as 1 and indices are sorted within each row.
+    Unknown fields are skipped without looking at their values, so a dict or non-string
+    iterable there is ignored where DictVectorizer raises TypeError.
+    """
+
+    def __init__(self, categorical, numerical, n_features, dtype=np.float64):
+        # categorical: {field: {value: column}}, numerical: {field: column}
+        self.categorical = categorical
+        self.numerical = numerical
+        self.n_features = n_features
+        self.dtype = dtype
+        self.fields = list(dict.fromkeys([*categorical, *numerical]))
+
+    @classmethod
+    def from_vocabulary(cls, vocabulary, separator='=', dtype=np.float64):
+        categorical = {}
+        numerical = {}
+        for feature_name, column in vocabulary.items():
+            if isinstance(feature_name, str) and separator in feature_name:
+                field, value = feature_name.split(separator, 1)
+                categorical.setdefault(field, {})[value] = int(column)
+            else:
+                numerical[feature_name] = int(column)
+        return cls(categorical, numerical, len(vocabulary), dtype)
+
+    @classmethod
+    def from_dict_vectorizer(cls, dv):
+        return cls.from_vocabulary(dv.vocabulary_, separator=dv.separator, dtype=dv.dtype)
+
+    def to_arrays(self):
+        categorical_fields = list(self.categorical)
+        return {
+            'categorical_fields': np.array(categorical_fields, dtype=str),
+            'categorical_field_ids': np.array(
+                [i for i, field in enumerate(categorical_fields) for _ in self.categorical[field]],
+                dtype=np.int32,
+            ),
+            'categorical_values': np.array(
+                [value for field in categorical_fields for value in self.categorical[field]],
+                dtype=str,
+            ),
+            'categorical_columns': np.array(
+                [c for field in categorical_fields for c in self.categorical[field].values()],
+                dtype=np.int32,
+            ),
+            'numerical_fields': np.array(list(self.numerical), dtype=str),
+            'numerical_columns': np.array(list(self.numerical.values()), dtype=np.int32),
+            'n_features': np.array(self.n_features, dtype=np.int64),
+            'dtype': np.array(np.dtype(self.dtype).name),
+        }
+
+    @classmethod
+    def from_arrays(cls, arrays):
+        categorical_fields = arrays['categorical_fields'].tolist()
+        categorical = {field: {} for field in categorical_fields}
+        for field_id, value, column in zip(
+            arrays['categorical_field_ids'].tolist(),
+            arrays['categorical_values'].tolist(),
+            arrays['categorical_columns'].tolist(),
+        ):
+            categorical[categorical_fields[field_id]][value] = column
+        numerical = dict(
+            zip(arrays['numerical_fields'].tolist(), arrays['numerical_columns'].tolist())
+        )
+        dtype = np.dtype(str(arrays['dtype'])).type
+        return cls(categorical, numerical, int(arrays['n_features']), dtype)
+
+    def save(self, path):
+        with open(path, 'wb') as f:
+            np.savez(f, **self.to_arrays())
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path, allow_pickle=False) as arrays:
+            return cls.from_arrays(arrays)
+
+    def encode_value(self, field, value):
+        # Mirrors DictVectorizer._transform for a single (field, value) pair
+        if isinstance(value, str):
+            column = self.categorical.get(field, {}).get(value)
+            return [] if column is None else [(column, 1.0)]
+        if isinstance(value, Number) or value is None:
+            column = self.numerical.get(field)
+            return [] if column is None else [(column, self.dtype(value))]
+        if not isinstance(value, Mapping) and isinstance(value, Iterable):
+            encoded = []
+            for item in value:
+                if not isinstance(item, str):
+                    raise TypeError(
+                        f"Unsupported type {type(item)} in iterable value. "
+                        "Only iterables of string are supported."
+                    )
+                encoded.extend(self.encode_value(field, item))
+            return encoded
+        raise TypeError(f"Unsupported value Type {type(value)} for {field}: {value}.")
+
+    def encode_field(self, field, values):
+        value_types = set(map(type, values))
+        has_missing = type(MISSING) in value_types
+        value_types.discard(type(MISSING))
+        lookup = self.categorical.get(field, {})
+
+        # Fast path: a column of strings is a single vectorised dictionary lookup
+        if value_types <= {str}:
+            columns = lookup_columns(lookup, values)
+            rows = np.flatnonzero(columns >= 0)
+            return rows, columns[rows], np.ones(len(rows), dtype=self.dtype)
+
+        # Fast path: a column of plain numbers maps onto one fixed column
+        if value_types <= set(NUMERIC_TYPES):
+            if field not in self.numerical:
+                return None
+            column = self.numerical[field]
+            if not has_missing and type(None) not in value_types:
+                rows = np.arange(len(values))
+                data = np.asarray(values, dtype=self.dtype)
+                return rows, np.full(len(rows), column, dtype=np.int64), data
+            present = np.fromiter(
+                (value is not MISSING for value in values), dtype=bool, count=len(values)
+            )
+            rows = np.flatnonzero(present)
+            data = np.array(
+                [np.nan if values[row] is None else values[row] for row in rows], dtype=self.dtype
+            )
+            return rows, np.full(len(rows), column, dtype=np.int64), data
+
+        # Mixed or unusual value types go through the exact per-value path
+        rows, columns, data = [], [], []
+        for row, value in enumerate(values):
+            if value is MISSING:
+                continue
+            for column, datum in self.encode_value(field, value):
+                rows.append(row)
+                columns.append(column)
+                data.append(datum)
+        return (
+            np.array(rows, dtype=np.int64),
+            np.array(columns, dtype=np.int64),
+            np.array(data, dtype=self.dtype),
+        )
+
+    def build_csr(self, encoded, n_rows):
+        rows = np.concatenate([e[0] for e in encoded] or [np.empty(0, dtype=np.int64)])
+        columns = np.concatenate([e[1] for e in encoded] or [np.empty(0, dtype=np.int64)])
+        data = np.concatenate([e[2] for e in encoded] or [np.empty(0, dtype=self.dtype)])
+
+        # Sort entries by (row, column) to get canonical CSR order
+        order = np.lexsort((columns, rows))
+        indptr = np.zeros(n_rows + 1, dtype=np.int32)
+        np.cumsum(np.bincount(rows, minlength=n_rows), out=indptr[1:])
+
+        return sparse.csr_matrix(
+            (data[order], columns[order].astype(np.int32), indptr),
+            shape=(n_rows, self.n_features),
+            dtype=self.dtype,
+        )
+
+    def transform(self, rides):
+        rides = [rides] if isinstance(rides, Mapping) else list(rides)
+        if not rides:
+            raise ValueError("Sample sequence X is empty.")
+
+        encoded = []
+        for field in self.fields:
+            field_values = [ride.get(field, MISSING) for ride in rides]
+            field_encoded = self.encode_field(field, field_values)
+            if field_encoded is not None:
+                encoded.append(field_encoded)
+
+        return self.build_csr(encoded, len(rides))
+
+    def encode_categorical_column(self, field, column):
+        # Look each distinct category up once, then map every row through its category code
+        lookup = self.categorical.get(field, {})
+        category_columns = np.append(
+            lookup_columns(lookup, column.cat.categories.tolist()), np.int64(-1)
+        )
+        columns = category_columns[column.cat.codes.to_numpy()]
+        rows = np.flatnonzero(columns >= 0)
+        return rows, columns[rows], np.ones(len(rows), dtype=self.dtype)
+
+    def transform_frame(self, df):
+        """Encode the known fields of a DataFrame without materializing per-row dicts.
+
+        Equivalent to transform(df[fields].to_dict(orient='records')) for str/categorical
+        and numeric columns; any other column falls back to the per-value path.
+        """
+        if len(df) == 0:
+            raise ValueError("Sample sequence X is empty.")
+
+        encoded = []
+        for field in self.fields:
+            if field not in df.columns:
+                continue
+            column = df[field]
+
+            if column.dtype == object and column.map(type).eq(str).all():
+                column = column.astype('category')
+
+            if column.dtype.name == 'category' and column.cat.categories.dtype == object:
+                encoded.append(self.encode_categorical_column(field, column))
+            elif column.dtype.kind in 'biuf' and field in self.numerical:
+                data = column.to_numpy(dtype=self.dtype, na_value=np.nan)
+                columns = np.full(len(data), self.numerical[field], dtype=np.int64)
+                encoded.append((np.arange(len(data)), columns, data))
+            elif column.dtype.kind not in 'biuf':
+                field_encoded = self.encode_field(field, column.tolist())
+                if field_encoded is not None:
+                    encoded.append(field_encoded)
+
+        return self.build_csr(encoded, len(df))
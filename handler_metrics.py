@@ -0,0 +1,174 @@
+import bisect
+import itertools
+import json
+import math
+import time
+from contextlib import contextmanager, nullcontext
+
+# Stages timed by ModelService, in handler order; 'shadow' includes its own encode and predict
+HANDLER_STAGES = ('decode', 'encode', 'predict', 'shadow', 'monitor', 'callbacks', 'total')
+HANDLER_COUNTS = (
+    'records',
+    'predictions',
+    'decode_errors',
+    'prediction_errors',
+    'batch_fallbacks',
+    'callback_errors',
+    'batch_item_failures',
+)
+PERCENTILES = (50, 95, 99)
+
+NULL_STAGE = nullcontext()
+
+
+class LatencyHistogram:
+    """Log-bucketed histogram of durations in seconds with constant memory.
+
+    Buckets grow by `growth` from min_value to max_value, so percentiles are accurate to
+    within about (growth - 1) relative error and recording is a single bisect.
+    """
+
+    def __init__(self, min_value=1e-5, max_value=900.0, growth=1.1):
+        n_buckets = math.ceil(math.log(max_value / min_value) / math.log(growth)) + 1
+        self.bounds = [min_value * growth**i for i in range(n_buckets)]
+        # The last bucket holds values above max_value
+        self.counts = [0] * (n_buckets + 1)
+        self.count = 0
+        self.max = 0.0
+
+    def record(self, value):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.max = max(self.max, value)
+
+    def percentiles(self, qs):
+        if not self.count:
+            return {}
+        cumulative = list(itertools.accumulate(self.counts))
+        result = {}
+        for q in qs:
+            index = bisect.bisect_left(cumulative, math.ceil(q / 100 * self.count))
+            upper = self.bounds[index] if index < len(self.bounds) else self.max
+            result[q] = min(upper, self.max)
+        return result
+
+
+class HandlerMetrics:  # pylint: disable=too-many-instance-attributes
+    """Per-invocation stage timings and counts, emitted as one CloudWatch EMF JSON line.
+
+    Stage timings accumulate over an invocation and go into a per-stage histogram for the
+    lifetime of the container when flush() is called. The p50/p95/p99 of those histograms
+    are added to the first line and then at most every summary_interval seconds, which
+    keeps flush() cheap on busy containers. Stage times are inclusive ('total' spans the
+    others); inside suspended() neither stages nor counts are recorded.
+    """
+
+    def __init__(
+        self,
+        namespace='RideDurationPrediction',
+        dimensions=None,
+        clock=time.perf_counter,
+        emit=print,
+        summary_interval=60.0,
+    ):
+        self.namespace = namespace
+        self.dimensions = dimensions or {'Service': 'ride-duration-prediction'}
+        self.clock = clock
+        self.emit = emit
+        self.seconds = {}
+        self.counts = {}
+        self.histograms = {stage: LatencyHistogram() for stage in HANDLER_STAGES}
+        self.suspended_depth = 0
+        self.summary_interval = summary_interval
+        self.last_summary = None
+
+    @contextmanager
+    def stage(self, name):
+        if self.suspended_depth:
+            yield
+            return
+        start = self.clock()
+        try:
+            yield
+        finally:
+            self.seconds[name] = self.seconds.get(name, 0.0) + self.clock() - start
+
+    @contextmanager
+    def suspended(self):
+        self.suspended_depth += 1
+        try:
+            yield
+        finally:
+            self.suspended_depth -= 1
+
+    def count(self, name, value=1):
+        if not self.suspended_depth:
+            self.counts[name] = self.counts.get(name, 0) + value
+
+    def flush(self, **properties):
+        seconds, self.seconds = self.seconds, {}
+        counts, self.counts = self.counts, {}
+        for name, value in seconds.items():
+            if name not in self.histograms:
+                self.histograms[name] = LatencyHistogram()
+            self.histograms[name].record(value)
+
+        metrics = {f'{name}_ms': seconds.get(name, 0.0) * 1000 for name in HANDLER_STAGES}
+        metrics.update({name: counts.get(name, 0) for name in HANDLER_COUNTS})
+        metrics.update({name: value for name, value in counts.items() if name not in metrics})
+
+        now = self.clock()
+        if self.last_summary is None or now - self.last_summary >= self.summary_interval:
+            self.last_summary = now
+            properties['latency_percentiles_ms'] = self.percentiles()
+
+        definitions = [
+            {'Name': name, 'Unit': 'Milliseconds' if name.endswith('_ms') else 'Count'}
+            for name in metrics
+        ]
+        emf = {
+            'Timestamp': int(time.time() * 1000),
+            'CloudWatchMetrics': [
+                {
+                    'Namespace': self.namespace,
+                    'Dimensions': [list(self.dimensions)],
+                    'Metrics': definitions,
+                }
+            ],
+        }
+        self.emit(
+            json.dumps(
+                {
+                    '_aws': emf,
+                    **self.dimensions,
+                    **metrics,
+                    **properties,
+                }
+            )
+        )
+
+    def percentiles(self):
+        return {
+            name: {
+                f'p{q}': round(value * 1000, 3)
+                for q, value in histogram.percentiles(PERCENTILES).items()
+            }
+            for name, histogram in self.histograms.items()
+            if histogram.count
+        }
+
+
+class NullMetrics:
+    """No-op stand-in for HandlerMetrics when instrumentation is disabled"""
+
+    def stage(self, _):
+        return NULL_STAGE
+
+    def suspended(self):
+        return NULL_STAGE
+
+    def count(self, name, value=1):
+        pass
+
+    def flush(self, **properties):
+        pass
@@ -0,0 +1,223 @@
+# pylint: disable=invalid-name, too-many-locals
+
+import math
+import os
+import tempfile
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+import mlflow
+import numpy as np
+import xgboost as xgb
+from scipy import sparse
+
+from streaming_training import DEFAULT_CHUNK_ROWS, fit_encoder, iter_chunks
+from training_performance import training_params
+
+# Sampled on top of training_params(); the ranges the tuned base_params were drawn from
+search_space = {
+    'max_depth': ('int', 4, 30),
+    'learning_rate': ('loguniform', math.exp(-3), 1.0),
+    'reg_alpha': ('loguniform', math.exp(-5), math.exp(-1)),
+    'reg_lambda': ('loguniform', math.exp(-6), math.exp(-1)),
+    'min_child_weight': ('loguniform', math.exp(-1), math.exp(3)),
+}
+
+# Matrices loaded once per worker process by init_worker and reused by every trial
+worker_matrices = {}
+
+
+def sample_params(rng, space=None):
+    space = search_space if space is None else space
+    params = {}
+    for name, (kind, low, high) in space.items():
+        if kind == 'int':
+            params[name] = int(rng.integers(low, high + 1))
+        elif kind == 'loguniform':
+            params[name] = float(math.exp(rng.uniform(math.log(low), math.log(high))))
+        elif kind == 'uniform':
+            params[name] = float(rng.uniform(low, high))
+        else:
+            raise ValueError(f"Unknown search space kind {kind!r} for {name}")
+    return params
+
+
+def median_curve(curves):
+    """Per boosting round, the median validation rmse of the trials that reached it."""
+    n_rounds = max((len(curve) for curve in curves), default=0)
+    return [
+        float(np.median([curve[step] for curve in curves if len(curve) > step]))
+        for step in range(n_rounds)
+    ]
+
+
+class MedianPruning(xgb.callback.TrainingCallback):
+    """Stop a trial once its validation rmse is worse than the median of completed trials.
+
+    reference is median_curve() of the trials completed when this one was submitted;
+    the first warmup_rounds rounds are never pruned.
+    """
+
+    def __init__(self, reference, warmup_rounds=5, data_name='validation', metric='rmse'):
+        self.reference = reference
+        self.warmup_rounds = warmup_rounds
+        self.data_name = data_name
+        self.metric = metric
+        self.pruned_at = None
+        super().__init__()
+
+    def after_iteration(self, model, epoch, evals_log):
+        score = evals_log[self.data_name][self.metric][-1]
+        if self.warmup_rounds <= epoch < len(self.reference) and score > self.reference[epoch]:
+            self.pruned_at = epoch
+            return True
+        return False
+
+
+def cache_search_data(train_paths, val_paths, cache_dir, chunk_rows=DEFAULT_CHUNK_ROWS):
+    """Encode the train/validation months once and save them as DMatrix binary buffers."""
+    _, encoder = fit_encoder(train_paths)
+    locations = {}
+
+    for name, paths in (('train', train_paths), ('valid', val_paths)):
+        chunks = list(iter_chunks(paths, encoder, chunk_rows))
+        X = sparse.vstack([X for X, _ in chunks], format='csr')
+        y = np.concatenate([y for _, y in chunks])
+
+        locations[name] = os.path.join(cache_dir, f'{name}.buffer')
+        xgb.DMatrix(X, label=y).save_binary(locations[name])
+
+    return locations
+
+
+def init_worker(locations):
+    # hist quantizes a DMatrix on first use and keeps the index, so later trials skip it
+    worker_matrices.update({name: xgb.DMatrix(path) for name, path in locations.items()})
+
+
+def run_trial(
+    trial, params, reference, num_boost_round=30, early_stopping_rounds=50, warmup_rounds=5
+):
+    pruning = MedianPruning(reference, warmup_rounds)
+    evals_result = {}
+
+    start = time.perf_counter()
+    xgb.train(
+        params=params,
+        dtrain=worker_matrices['train'],
+        num_boost_round=num_boost_round,
+        evals=[(worker_matrices['valid'], 'validation')],
+        early_stopping_rounds=early_stopping_rounds,
+        evals_result=evals_result,
+        callbacks=[pruning],
+        verbose_eval=False,
+    )
+    curve = [float(score) for score in evals_result['validation']['rmse']]
+
+    return {
+        'trial': trial,
+        'params': params,
+        'curve': curve,
+        'rmse': min(curve),
+        'best_iteration': int(np.argmin(curve)),
+        'pruned': pruning.pruned_at is not None,
+        'seconds': time.perf_counter() - start,
+    }
+
+
+def log_trial(result):
+    with mlflow.start_run(run_name=f"trial-{result['trial']}", nested=True):
+        mlflow.log_params(result['params'])
+        for step, score in enumerate(result['curve']):
+            mlflow.log_metric('validation_rmse', score, step=step)
+        mlflow.log_metric('rmse', result['rmse'])
+        mlflow.log_metric('best_iteration', result['best_iteration'])
+        mlflow.log_metric('trial_seconds', result['seconds'])
+        mlflow.set_tag('pruned', str(result['pruned']).lower())
+
+
+def search(
+    locations,
+    n_trials,
+    n_workers=None,
+    preset='accurate',
+    seed=42,
+    **trial_options,
+):
+    """Run n_trials sampled trials on a process pool, logging each as a nested MLflow run.
+
+    At most n_workers trials are in flight; each is pruned against the median curve of
+    the trials completed before it was submitted. trial_options are passed on to
+    run_trial(). Returns the results by rmse.
+    """
+    n_workers = n_workers or os.cpu_count() or 1
+    nthread = max(1, (os.cpu_count() or 1) // n_workers)
+    rng = np.random.default_rng(seed)
+    completed = []
+
+    with ProcessPoolExecutor(n_workers, initializer=init_worker, initargs=(locations,)) as pool:
+        pending = set()
+        for trial in range(n_trials):
+            if len(pending) >= n_workers:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    completed.append(future.result())
+                    log_trial(completed[-1])
+
+            params = {**training_params(preset, nthread=nthread), **sample_params(rng)}
+            reference = median_curve([result['curve'] for result in completed])
+            pending.add(pool.submit(run_trial, trial, params, reference, **trial_options))
+
+        for future in pending:
+            completed.append(future.result())
+            log_trial(completed[-1])
+
+    return sorted(completed, key=lambda result: result['rmse'])
+
+
+def run(train_paths, val_paths, n_trials, n_workers=None, chunk_rows=DEFAULT_CHUNK_ROWS, **options):
+    with mlflow.start_run(run_name='hyperparameter-search'):
+        start = time.perf_counter()
+        with tempfile.TemporaryDirectory() as cache_dir:
+            locations = cache_search_data(train_paths, val_paths, cache_dir, chunk_rows)
+            results = search(locations, n_trials, n_workers, **options)
+        seconds = time.perf_counter() - start
+
+        best = results[0]
+        mlflow.log_params({f'best_{name}': value for name, value in best['params'].items()})
+        mlflow.log_metric('rmse', best['rmse'])
+        mlflow.log_metric('n_trials', len(results))
+        mlflow.log_metric('n_pruned', sum(result['pruned'] for result in results))
+        mlflow.log_metric('trials_per_second', len(results) / seconds)
+
+    print(f"Best trial {best['trial']}: rmse={best['rmse']:.4f} params={best['params']}")
+    return results
+
+
+if __name__ == "__main__":
+    import argparse
+
+    # Sets the tracking server and the nyc-taxi-experiment the trials are logged under
+    import duration_prediction
+
+    parser = argparse.ArgumentParser(description='Search XGBoost hyperparameters in parallel.')
+    parser.add_argument('--year', type=int, required=True, help='Year of the first training month')
+    parser.add_argument('--month', type=int, required=True, help='First training month')
+    parser.add_argument('--months', type=int, default=1, help='Number of training months')
+    parser.add_argument('--trials', type=int, default=50, help='Number of sampled trials')
+    parser.add_argument('--workers', type=int, help='Worker processes (defaults to all cores)')
+    parser.add_argument('--num-boost-round', type=int, default=30, help='Boosting rounds per trial')
+    parser.add_argument('--seed', type=int, default=42, help='Sampling seed')
+    args = parser.parse_args()
+
+    train_months = duration_prediction.month_range(args.year, args.month, args.months)
+    val_month = duration_prediction.next_month(*train_months[-1])
+
+    run(
+        train_paths=[duration_prediction.cache_month(*month) for month in train_months],
+        val_paths=[duration_prediction.cache_month(*val_month)],
+        n_trials=args.trials,
+        n_workers=args.workers,
+        num_boost_round=args.num_boost_round,
+        seed=args.seed,
+    )
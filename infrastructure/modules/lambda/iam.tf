@@ -142,6 +142,17 @@ data "aws_iam_policy_document" "s3_model_access" {
       "arn:aws:s3:::${var.dev_bucket}/*"
     ]
   }
+
+  # Parquet archive of served predictions (PREDICTION_ARCHIVE_LOCATION)
+  statement {
+    effect = "Allow"
+    actions = [
+      "s3:PutObject"
+    ]
+    resources = [
+      "arn:aws:s3:::${var.model_bucket}/predictions/*"
+    ]
+  }
 }
 
 resource "aws_iam_policy" "model_lambda_s3_policy" {
@@ -10,9 +10,10 @@ resource "aws_lambda_function" "model_lambda" {
   }
   environment {
     variables = {
-      MODEL_S3_BUCKET         = var.model_bucket
-      PREDICTIONS_STREAM_NAME = var.output_stream_name
-      RUN_ID                  = "70123647ea1f49a2889fcff4d7032960"
+      MODEL_S3_BUCKET             = var.model_bucket
+      PREDICTIONS_STREAM_NAME     = var.output_stream_name
+      RUN_ID                      = "70123647ea1f49a2889fcff4d7032960"
+      PREDICTION_ARCHIVE_LOCATION = "s3://${var.model_bucket}/predictions"
     }
   }
 }
@@ -27,6 +28,13 @@ resource "aws_lambda_event_source_mapping" "kinesis_mapping" {
   event_source_arn  = var.source_stream_arn
   function_name     = aws_lambda_function.model_lambda.function_name
   starting_position = "LATEST"
+  # The handler returns the sequence numbers of failed records (and of the records queued
+  # behind them on the same partition key), so only the rest of the batch is checkpointed
+  function_response_types        = ["ReportBatchItemFailures"]
+  maximum_retry_attempts         = var.maximum_retry_attempts
+  bisect_batch_on_function_error = true
+  # Concurrent batches per shard; Lambda keeps records with the same partition key in order
+  parallelization_factor = var.parallelization_factor
   depends_on = [
     aws_iam_role_policy_attachment.model_kinesis_permissions
   ]
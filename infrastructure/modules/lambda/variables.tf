@@ -62,3 +62,15 @@ variable "s3_access_policy_name" {
   description = "Name of the IAM policy allowing the Lambda role to write to Kinesis"
   type = string
 }
+
+variable "parallelization_factor" {
+  description = "Number of batches from each shard processed concurrently, ordered per partition key"
+  type        = number
+  default     = 4
+}
+
+variable "maximum_retry_attempts" {
+  description = "Times a failed record is retried before its batch is skipped"
+  type        = number
+  default     = 3
+}
@@ -8,13 +8,16 @@ LOCAL_TAG=`date +"%Y-%m-%d_%H%M"`
 export LOCAL_IMAGE_NAME="ride-prediction-service-dev:${LOCAL_TAG}"
 export LOCAL_KINESIS_ENDPOINT="http://localhost:4566/"
 export PREDICTIONS_STREAM_NAME='ride-predictions'
+export INPUT_STREAM_NAME='ride-events'
 export SHARD_ID='shardId-000000000000'
 
 
-# Clean up existing compose containers and any processes on port 9999
-echo "Cleaning up port 9999..."
-docker stop $(docker ps -q --filter "publish=9999") 2>/dev/null || true
-lsof -ti:9999 | xargs kill -9 2>/dev/null || true
+# Clean up existing compose containers and any processes on ports 9999 and 9998
+echo "Cleaning up ports 9999 and 9998..."
+for port in 9999 9998; do
+    docker stop $(docker ps -q --filter "publish=${port}") 2>/dev/null || true
+    lsof -ti:${port} | xargs kill -9 2>/dev/null || true
+done
 sleep 1
 
 # Build image and push it to a container on port 9999
@@ -43,6 +46,10 @@ aws --endpoint-url ${LOCAL_KINESIS_ENDPOINT} \
     kinesis create-stream \
     --stream-name ${PREDICTIONS_STREAM_NAME} \
     --shard-count 1 || echo "Stream may already exist"
+aws --endpoint-url ${LOCAL_KINESIS_ENDPOINT} \
+    kinesis create-stream \
+    --stream-name ${INPUT_STREAM_NAME} \
+    --shard-count 1 || echo "Stream may already exist"
 sleep 5
 
 # Source conda and activate mlops environment (skip in CI)
@@ -88,5 +95,25 @@ if [ ${ERROR_CODE} != 0 ]; then
     exit ${ERROR_CODE}
 fi
 
+# Run the standalone consumer against the local streams and log any error codes
+echo "Running Kinesis consumer integration tests..."
+python test_consumer.py
+ERROR_CODE=$?
+if [ ${ERROR_CODE} != 0 ]; then
+    docker-compose logs
+    docker-compose down
+    exit ${ERROR_CODE}
+fi
+
+# Run the HTTP prediction server tests against its compose service and log any error codes
+echo "Running prediction server integration tests..."
+python test_server.py
+ERROR_CODE=$?
+if [ ${ERROR_CODE} != 0 ]; then
+    docker-compose logs
+    docker-compose down
+    exit ${ERROR_CODE}
+fi
+
 echo "All tests successful!"
 docker-compose down
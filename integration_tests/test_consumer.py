@@ -0,0 +1,111 @@
+# pylint: disable=broad-exception-caught, wrong-import-position
+
+import base64
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+
+import boto3
+from deepdiff import DeepDiff
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import model
+from kinesis_consumer import MODEL_ID, RUN_ID, CheckpointStore, KinesisConsumer
+
+kinesis_endpoint = os.getenv('KINESIS_ENDPOINT_URL', 'http://localhost:4566')
+kinesis_client = boto3.client('kinesis', endpoint_url=kinesis_endpoint)
+
+input_stream_name = os.getenv('INPUT_STREAM_NAME', 'ride-events')
+predictions_stream_name = os.getenv('PREDICTIONS_STREAM_NAME', 'ride-predictions')
+SHARD_ID = 'shardId-000000000000'
+RIDE_ID = 'consumer-123'
+
+
+def read_predictions():
+    shard_iterator = kinesis_client.get_shard_iterator(
+        StreamName=predictions_stream_name,
+        ShardId=SHARD_ID,
+        ShardIteratorType='TRIM_HORIZON',
+    )['ShardIterator']
+
+    predictions = []
+    while shard_iterator:
+        response = kinesis_client.get_records(ShardIterator=shard_iterator, Limit=100)
+        predictions.extend(json.loads(record['Data']) for record in response['Records'])
+        if not response['Records']:
+            return predictions
+        shard_iterator = response.get('NextShardIterator')
+    return predictions
+
+
+def wait_for_prediction(ride_id, timeout=60):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        for prediction in read_predictions():
+            if prediction['prediction']['ride_id'] == ride_id:
+                return prediction
+        time.sleep(1)
+    return None
+
+
+def test_consumer():
+    # Same ride as the Lambda test event, sent to the input stream under a new ride_id
+    test_dir = os.path.dirname(os.path.abspath(__file__))
+    with open(os.path.join(test_dir, 'input_event.json'), 'r', encoding='utf-8') as f_i:
+        input_event = json.load(f_i)
+    ride_event = json.loads(base64.b64decode(input_event['Records'][0]['kinesis']['data']))
+    ride_event['ride_id'] = RIDE_ID
+
+    kinesis_client.put_record(
+        StreamName=input_stream_name,
+        Data=json.dumps(ride_event).encode('utf-8'),
+        PartitionKey=RIDE_ID,
+    )
+
+    model_service = model.init(predictions_stream_name, RUN_ID, MODEL_ID, False)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        consumer = KinesisConsumer(
+            model_service,
+            kinesis_client,
+            input_stream_name,
+            CheckpointStore(os.path.join(tmp_dir, 'checkpoints.json')),
+            poll_interval=0.5,
+            starting_position='TRIM_HORIZON',
+        )
+        consumer_thread = threading.Thread(target=consumer.run, daemon=True)
+        consumer_thread.start()
+        try:
+            actual_record = wait_for_prediction(RIDE_ID)
+        finally:
+            consumer.stop()
+            consumer_thread.join(timeout=10)
+
+        checkpoint = consumer.checkpoints.get(SHARD_ID)
+
+    expected_record = {
+        "statusCode": 200,
+        "model": "ride_duration_prediction_test",
+        "version": RUN_ID,
+        "prediction": {"ride_id": RIDE_ID, "predicted_duration": 41.28146743774414},
+    }
+
+    assert actual_record is not None, "No prediction was published for the consumed ride"
+    diff = DeepDiff(actual_record, expected_record, significant_digits=1)
+    assert 'type_changes' not in diff
+    assert 'values_changed' not in diff
+    assert checkpoint is not None
+
+
+if __name__ == "__main__":
+    try:
+        test_consumer()
+        print("Consumer tests passed!")
+    except AssertionError as e:
+        print(f"Consumer tests failed assertion: {e}")
+        sys.exit(1)
+    except Exception as e:
+        print(f"An unexpected error occurred: {e}")
+        sys.exit(1)
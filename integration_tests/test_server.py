@@ -0,0 +1,81 @@
+# pylint: disable=broad-exception-caught
+
+import base64
+import json
+import os
+import sys
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+from deepdiff import DeepDiff
+
+SERVER_URL = os.getenv('PREDICTION_SERVER_URL', 'http://localhost:9998')
+RUN_ID = os.getenv('RUN_ID', '70123647ea1f49a2889fcff4d7032960')
+
+
+def request(path, body=None):
+    data = None if body is None else json.dumps(body).encode('utf-8')
+    http_request = urllib.request.Request(
+        SERVER_URL + path, data=data, headers={'Content-Type': 'application/json'}
+    )
+    try:
+        with urllib.request.urlopen(http_request, timeout=30) as response:
+            return response.status, json.loads(response.read())
+    except urllib.error.HTTPError as e:
+        return e.code, json.loads(e.read())
+
+
+def wait_until_ready(timeout=180):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            if request('/ready')[0] == 200:
+                return True
+        except (urllib.error.URLError, ConnectionError):
+            pass
+        time.sleep(2)
+    return False
+
+
+def test_server():
+    # Same ride as the Lambda test event, sent concurrently with a ride that cannot be scored
+    test_dir = os.path.dirname(os.path.abspath(__file__))
+    with open(os.path.join(test_dir, 'input_event.json'), 'r', encoding='utf-8') as f_i:
+        input_event = json.load(f_i)
+    ride_event = json.loads(base64.b64decode(input_event['Records'][0]['kinesis']['data']))
+    bad_event = {'ride': {**ride_event['ride'], 'PU_DO': {'x': 1}}, 'ride_id': 'bad'}
+
+    assert wait_until_ready(), "Prediction server did not become ready"
+    assert request('/health') == (200, {'status': 'ok'})
+
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        (status, actual_response), (bad_status, _) = executor.map(
+            lambda event: request('/predict', event), [ride_event, bad_event]
+        )
+
+    expected_response = {
+        "statusCode": 200,
+        "model": "ride_duration_prediction_test",
+        "version": RUN_ID,
+        "prediction": {"ride_id": 123, "predicted_duration": 41.28146743774414},
+    }
+
+    assert status == 200
+    diff = DeepDiff(actual_response, expected_response, significant_digits=1)
+    assert 'type_changes' not in diff
+    assert 'values_changed' not in diff
+    assert bad_status == 422
+
+
+if __name__ == "__main__":
+    try:
+        test_server()
+        print("Prediction server tests passed!")
+    except AssertionError as e:
+        print(f"Prediction server tests failed assertion: {e}")
+        sys.exit(1)
+    except Exception as e:
+        print(f"An unexpected error occurred: {e}")
+        sys.exit(1)
@@ -0,0 +1,278 @@
+import base64
+import json
+import os
+import signal
+import threading
+import traceback
+from pathlib import Path
+
+from botocore.exceptions import ClientError
+
+import model
+from artifact_cache import write_json_atomic
+
+INPUT_STREAM_NAME = os.getenv('INPUT_STREAM_NAME', 'ride-events')
+PREDICTIONS_STREAM_NAME = os.getenv('PREDICTIONS_STREAM_NAME', 'ride-predictions')
+RUN_ID = os.getenv('RUN_ID', '70123647ea1f49a2889fcff4d7032960')
+MODEL_ID = os.getenv('MODEL_ID', 'm-b312b4c1155a4197af44793c03b32ad4')
+TEST_RUN = os.getenv('TEST_RUN', 'False').lower() == 'true'
+
+# Records per GetRecords call (Kinesis allows up to 10000) and the wait between polls
+# once a shard is caught up; each shard allows 5 GetRecords calls per second
+CONSUMER_BATCH_SIZE = int(os.getenv('CONSUMER_BATCH_SIZE', '100'))
+CONSUMER_POLL_INTERVAL = float(os.getenv('CONSUMER_POLL_INTERVAL_SECONDS', '1.0'))
+CONSUMER_CHECKPOINT_PATH = os.getenv(
+    'CONSUMER_CHECKPOINT_PATH', '/tmp/ride-events-checkpoints.json'
+)
+# Where a shard without a checkpoint starts, LATEST like the Lambda event source mapping
+CONSUMER_STARTING_POSITION = os.getenv('CONSUMER_STARTING_POSITION', 'LATEST')
+# Times a reported record failure is retried before the batch is skipped, like the event
+# source mapping's maximum_retry_attempts
+CONSUMER_MAX_RECORD_RETRIES = int(os.getenv('CONSUMER_MAX_RECORD_RETRIES', '3'))
+
+# GetRecords errors that only need the consumer to slow down
+THROTTLING_ERRORS = ('ProvisionedThroughputExceededException', 'LimitExceededException')
+MAX_BACKOFF_SECONDS = 30.0
+
+
+def to_lambda_record(record):
+    # The record shape of a Lambda Kinesis event, so ModelService handles both the same way
+    return {
+        'eventSource': 'aws:kinesis',
+        'kinesis': {
+            'data': base64.b64encode(record['Data']).decode('ascii'),
+            'partitionKey': record['PartitionKey'],
+            'sequenceNumber': record['SequenceNumber'],
+        },
+    }
+
+
+class CheckpointStore:
+    """Last processed sequence number per shard, persisted to a JSON file.
+
+    Every update rewrites the file atomically, so a restarted consumer resumes right
+    after the last batch whose predictions were delivered.
+    """
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.lock = threading.Lock()
+        self.checkpoints = self.load()
+
+    def load(self):
+        try:
+            return json.loads(self.path.read_text(encoding='utf-8'))
+        except FileNotFoundError:
+            return {}
+
+    def get(self, shard_id):
+        with self.lock:
+            return self.checkpoints.get(shard_id)
+
+    def set(self, shard_id, sequence_number):
+        with self.lock:
+            self.checkpoints[shard_id] = sequence_number
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            write_json_atomic(self.path, self.checkpoints)
+
+
+class KinesisConsumer:  # pylint: disable=too-many-instance-attributes
+    """Polls every shard of a stream on its own thread and feeds ModelService.
+
+    Records are passed to ModelService.lambda_handler as Lambda-shaped events, so the
+    same decoding, prediction cache and callbacks are used. A shard is checkpointed
+    after each batch is handled; a batch that fails is read again from the last
+    checkpoint (at-least-once delivery). When the handler reports batchItemFailures,
+    the shard is checkpointed up to the first failed record and read again from it,
+    at most max_record_retries times, as Lambda does.
+    """
+
+    def __init__(
+        self,
+        model_service,
+        kinesis_client,
+        stream_name,
+        checkpoints,
+        batch_size=CONSUMER_BATCH_SIZE,
+        poll_interval=CONSUMER_POLL_INTERVAL,
+        starting_position=CONSUMER_STARTING_POSITION,
+        shard_refresh_interval=60.0,
+        max_record_retries=CONSUMER_MAX_RECORD_RETRIES,
+    ):
+        self.model_service = model_service
+        self.kinesis_client = kinesis_client
+        self.stream_name = stream_name
+        self.checkpoints = checkpoints
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self.starting_position = starting_position
+        self.shard_refresh_interval = shard_refresh_interval
+        self.max_record_retries = max_record_retries
+        # shard_id -> (first failed sequence number, times it was retried)
+        self.record_retries = {}
+        self.stop_event = threading.Event()
+        # ModelService, its callbacks and the prediction cache are not thread-safe
+        self.service_lock = threading.Lock()
+        self.workers = {}
+        self.closed_shards = set()
+
+    def list_shard_ids(self):
+        shard_ids = []
+        kwargs = {'StreamName': self.stream_name}
+        while True:
+            response = self.kinesis_client.list_shards(**kwargs)
+            shard_ids.extend(shard['ShardId'] for shard in response['Shards'])
+            if not response.get('NextToken'):
+                return shard_ids
+            kwargs = {'NextToken': response['NextToken']}
+
+    def shard_iterator(self, shard_id, retry_from=None):
+        checkpoint = self.checkpoints.get(shard_id)
+        if retry_from is not None:
+            position = {
+                'ShardIteratorType': 'AT_SEQUENCE_NUMBER',
+                'StartingSequenceNumber': retry_from,
+            }
+        elif checkpoint is not None:
+            position = {
+                'ShardIteratorType': 'AFTER_SEQUENCE_NUMBER',
+                'StartingSequenceNumber': checkpoint,
+            }
+        else:
+            position = {'ShardIteratorType': self.starting_position}
+
+        response = self.kinesis_client.get_shard_iterator(
+            StreamName=self.stream_name, ShardId=shard_id, **position
+        )
+        return response['ShardIterator']
+
+    def process_records(self, shard_id, records):
+        """Returns the sequence number to read the shard again from, None once the batch is done"""
+        event = {'Records': [to_lambda_record(record) for record in records]}
+        with self.service_lock:
+            output = self.model_service.lambda_handler(event)
+
+        failures = (output or {}).get('batchItemFailures', [])
+        failed = {failure['itemIdentifier'] for failure in failures}
+        first_failed = next(
+            (i for i, record in enumerate(records) if record['SequenceNumber'] in failed), None
+        )
+        if first_failed is not None:
+            retry_from = records[first_failed]['SequenceNumber']
+            previous, retries = self.record_retries.get(shard_id, (None, 0))
+            retries = retries + 1 if previous == retry_from else 1
+            if retries <= self.max_record_retries:
+                self.record_retries[shard_id] = (retry_from, retries)
+                if first_failed > 0:
+                    self.checkpoints.set(shard_id, records[first_failed - 1]['SequenceNumber'])
+                return retry_from
+            print(
+                f"Skipping {len(failed)} failed records from {shard_id} "
+                f"after {self.max_record_retries} retries"
+            )
+
+        self.record_retries.pop(shard_id, None)
+        self.checkpoints.set(shard_id, records[-1]['SequenceNumber'])
+        return None
+
+    def get_records(self, shard_id, iterator, backoff):
+        """Returns (response, backoff); response is None when the call should be retried."""
+        try:
+            response = self.kinesis_client.get_records(
+                ShardIterator=iterator, Limit=self.batch_size
+            )
+            return response, self.poll_interval
+        except ClientError as e:
+            code = e.response['Error']['Code']
+            if code not in THROTTLING_ERRORS:
+                raise
+            print(f"Throttled reading {shard_id}, backing off for {backoff:.1f}s")
+            self.stop_event.wait(backoff)
+            return None, min(backoff * 2, MAX_BACKOFF_SECONDS)
+
+    def consume_shard(self, shard_id):
+        iterator = self.shard_iterator(shard_id)
+        backoff = self.poll_interval
+
+        while iterator is not None and not self.stop_event.is_set():
+            try:
+                response, backoff = self.get_records(shard_id, iterator, backoff)
+            except ClientError as e:
+                if e.response['Error']['Code'] != 'ExpiredIteratorException':
+                    raise
+                iterator = self.shard_iterator(shard_id)
+                continue
+            if response is None:
+                continue
+
+            records = response['Records']
+            if records:
+                try:
+                    retry_from = self.process_records(shard_id, records)
+                except Exception as e:  # pylint: disable=broad-exception-caught
+                    print(f"Failed to process {len(records)} records from {shard_id}: {e}")
+                    traceback.print_exc()
+                    self.stop_event.wait(self.poll_interval)
+                    iterator = self.shard_iterator(shard_id)
+                    continue
+                if retry_from is not None:
+                    self.stop_event.wait(self.poll_interval)
+                    iterator = self.shard_iterator(shard_id, retry_from)
+                    continue
+
+            iterator = response.get('NextShardIterator')
+            if not records or response.get('MillisBehindLatest', 0) == 0:
+                self.stop_event.wait(self.poll_interval)
+
+        if iterator is None:
+            # The shard was closed by a reshard; its children are picked up by the refresh
+            self.closed_shards.add(shard_id)
+            print(f"Shard {shard_id} is closed")
+
+    def start_workers(self):
+        # One worker per open shard; workers that died are restarted on the next refresh
+        for shard_id in self.list_shard_ids():
+            worker = self.workers.get(shard_id)
+            if shard_id in self.closed_shards or (worker is not None and worker.is_alive()):
+                continue
+
+            worker = threading.Thread(
+                target=self.consume_shard, args=(shard_id,), name=f'consumer-{shard_id}'
+            )
+            worker.daemon = True
+            self.workers[shard_id] = worker
+            worker.start()
+
+    def run(self):
+        print(f"Consuming {self.stream_name} (batch size {self.batch_size})")
+        while not self.stop_event.is_set():
+            self.start_workers()
+            self.stop_event.wait(self.shard_refresh_interval)
+
+        for worker in self.workers.values():
+            worker.join()
+
+    def stop(self, *_):
+        self.stop_event.set()
+
+
+def main():
+    # Loaded once for the lifetime of the process instead of once per cold start
+    model_service = model.init(PREDICTIONS_STREAM_NAME, RUN_ID, MODEL_ID, TEST_RUN)
+    consumer = KinesisConsumer(
+        model_service,
+        model.create_kinesis_client(),
+        INPUT_STREAM_NAME,
+        CheckpointStore(CONSUMER_CHECKPOINT_PATH),
+    )
+    signal.signal(signal.SIGTERM, consumer.stop)
+    signal.signal(signal.SIGINT, consumer.stop)
+    consumer.run()
+
+    # Archive whatever predictions are still buffered before exiting
+    if model_service.archive is not None:
+        model_service.archive.flush(force=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,14 +1,104 @@
 import base64
+import functools
+import importlib
 import json
 import os
 import pickle
+import sys
+import tempfile
+import time
 import traceback
+from contextlib import contextmanager
 
-import boto3
-import mlflow
+from artifact_cache import ArtifactCache
+from callback_dispatcher import CallbackDispatcher
+from handler_metrics import HandlerMetrics, NullMetrics
+from model_registry import ModelRegistry, ModelVersion
+from prediction_cache import PredictionCache
+from record_decoder import batch_item_failures, decode_records
+
+# Cold-start breakdown in seconds, filled in as the serving path imports and loads things
+startup_timings = {}
+_module_import_start = time.perf_counter()
 
 s3_bucket = os.getenv('MODEL_S3_BUCKET', 'mlops-learning-madamski')
 
+# 'booster' serves the raw XGBoost booster directly, 'pyfunc' goes through the mlflow wrapper
+model_backend = os.getenv('MODEL_BACKEND', 'booster')
+
+# 'compiled' encodes features with feature_encoder.FeatureEncoder, 'dict_vectorizer' with the
+# pickled sklearn DictVectorizer
+feature_encoder_mode = os.getenv('FEATURE_ENCODER', 'compiled')
+
+# 'bundle' loads the booster and compiled encoder from the memory-mapped serving bundle (see
+# serving_bundle.py) when the run has one, 'separate' always loads the individual artifacts
+model_format = os.getenv('MODEL_FORMAT', 'bundle')
+
+# Local artifact cache; set ARTIFACT_CACHE_DIR to an empty string to always download from S3
+artifact_cache_dir = os.getenv('ARTIFACT_CACHE_DIR', '/tmp/model-artifacts')
+artifact_cache_max_bytes = int(os.getenv('ARTIFACT_CACHE_MAX_BYTES', str(256 * 1024 * 1024)))
+# Cache hits check file sizes; 'true' also re-hashes every file, at a cost proportional to its size
+artifact_cache_verify = os.getenv('ARTIFACT_CACHE_VERIFY', 'false').lower() == 'true'
+
+# Artifacts baked into the image at build time (see bake_artifacts.py), preferred over any download
+embedded_artifacts_dir = os.getenv('EMBEDDED_ARTIFACTS_DIR', '/opt/model-artifacts')
+
+# Deliver prediction events on a background thread through a bounded queue
+async_callback_delivery = os.getenv('ASYNC_CALLBACKS', 'true').lower() == 'true'
+callback_queue_max_size = int(os.getenv('CALLBACK_QUEUE_SIZE', '1000'))
+
+# Memoize predictions for repeated rides; a size of 0 disables the cache
+prediction_cache_size = int(os.getenv('PREDICTION_CACHE_SIZE', '0'))
+prediction_cache_ttl = float(os.getenv('PREDICTION_CACHE_TTL_SECONDS', '3600'))
+
+# Optional routing config (local path or s3:// URI) for hot reloads and traffic splits,
+# re-read at most every MODEL_ROUTING_REFRESH_SECONDS (see model_registry.ModelRegistry)
+model_routing_config = os.getenv('MODEL_ROUTING_CONFIG', '')
+model_routing_refresh_seconds = float(os.getenv('MODEL_ROUTING_REFRESH_SECONDS', '60'))
+
+# Optional Parquet archive of predictions and their ride features (local path or s3:// URI),
+# partitioned by date and run_id and written once PREDICTION_ARCHIVE_MAX_ROWS rows are buffered
+# or the oldest is PREDICTION_ARCHIVE_MAX_SECONDS old (see prediction_archive.PredictionArchive)
+prediction_archive_location = os.getenv('PREDICTION_ARCHIVE_LOCATION', '')
+prediction_archive_max_rows = int(os.getenv('PREDICTION_ARCHIVE_MAX_ROWS', '50000'))
+prediction_archive_max_seconds = float(os.getenv('PREDICTION_ARCHIVE_MAX_SECONDS', '300'))
+
+# Compare served rides and predictions with the run's training reference profile (see
+# drift_monitoring.py), emitting a drift line every DRIFT_REPORT_SECONDS
+drift_monitoring_enabled = os.getenv('DRIFT_MONITORING', 'true').lower() == 'true'
+drift_report_seconds = float(os.getenv('DRIFT_REPORT_SECONDS', '300'))
+
+# Per-stage timings and counts emitted as a CloudWatch EMF line per invocation; 'false' swaps
+# in a no-op recorder
+handler_metrics_enabled = os.getenv('HANDLER_METRICS', 'true').lower() == 'true'
+metrics_namespace = os.getenv('METRICS_NAMESPACE', 'RideDurationPrediction')
+
+# Errors that only invalidate a single record rather than the whole batch; TypeError covers
+# valid JSON with a non-scalar feature value, which the encoders reject
+RECORD_ERRORS = (json.JSONDecodeError, KeyError, ValueError, TypeError)
+
+
+@contextmanager
+def timed(stage):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        startup_timings[stage] = startup_timings.get(stage, 0.0) + time.perf_counter() - start
+
+
+def lazy_import(module_name):
+    # mlflow, xgboost and boto3 are only imported once an artifact or client is actually needed,
+    # so they stay off the cold-start path whenever they are not used
+    if module_name in sys.modules:
+        return sys.modules[module_name]
+    with timed(f'import_{module_name}'):
+        return importlib.import_module(module_name)
+
+
+def log_startup_timings(**context):
+    print(json.dumps({'startup_timings': startup_timings, **context}))
+
 
 def get_model_location(run_id, model_id):
     model_location = f's3://{s3_bucket}/1/models/{model_id}/artifacts'
@@ -16,14 +106,181 @@ def get_model_location(run_id, model_id):
     return model_location, preprocessor_location
 
 
-def load_model(run_id, model_id):
+def get_booster_location(run_id):
+    return f's3://{s3_bucket}/1/{run_id}/artifacts/booster/{run_id}.json'
+
+
+def get_bundle_location(run_id):
+    return f's3://{s3_bucket}/1/{run_id}/artifacts/serving_bundle/serving.bundle'
+
+
+def get_reference_profile_location(run_id):
+    return f's3://{s3_bucket}/1/{run_id}/artifacts/monitoring/reference_profile.json'
+
+
+class BoosterModel:
+
+    def __init__(self, booster):
+        self.booster = booster
+
+    def predict(self, features):
+        # inplace_predict works on the CSR matrix directly, without building a DMatrix
+        return self.booster.inplace_predict(features)
+
+
+def get_artifact_cache():
+    if not artifact_cache_dir:
+        return None
+    return ArtifactCache(
+        artifact_cache_dir, artifact_cache_max_bytes, verify_reads=artifact_cache_verify
+    )
+
+
+def get_embedded_artifact(run_id, model_id, name):
+    if not embedded_artifacts_dir or not os.path.isdir(embedded_artifacts_dir):
+        return None
+    embedded = ArtifactCache(embedded_artifacts_dir, max_bytes=0, read_only=True)
+    return embedded.get(run_id, model_id, name)
+
+
+def embedded_artifact_missing(run_id, model_id, name):
+    if not embedded_artifacts_dir or not os.path.isdir(embedded_artifacts_dir):
+        return False
+    embedded = ArtifactCache(embedded_artifacts_dir, max_bytes=0, read_only=True)
+    return embedded.is_missing(run_id, model_id, name)
+
+
+def get_local_artifact(run_id, model_id, name):
+    embedded_path = get_embedded_artifact(run_id, model_id, name)
+    if embedded_path is not None:
+        print(f"Loading {name} for run {run_id} from artifacts embedded in the image")
+        return embedded_path
+
+    cache = get_artifact_cache()
+    if cache is not None:
+        cached_path = cache.get(run_id, model_id, name)
+        if cached_path is not None:
+            print(f"Loading {name} for run {run_id} from local artifact cache")
+            return cached_path
+
+    return None
+
+
+def download_artifact(run_id, model_id, name, location, validate=None):
+    # validate(local_path) checks a fresh download before it is cached and raises to reject it;
+    # cached and embedded artifacts were checked when they were stored
+    local_path = get_local_artifact(run_id, model_id, name)
+    if local_path is not None:
+        return local_path
+
+    mlflow = lazy_import('mlflow')
+    local_path = mlflow.artifacts.download_artifacts(location)
+    if validate is not None:
+        validate(local_path)
+
+    cache = get_artifact_cache()
+    if cache is not None:
+        return cache.put(run_id, model_id, name, local_path)
+    return local_path
+
+
+def load_booster(run_id, model_id):
+    # Runs baked without a native booster serve the pyfunc model, don't look for one remotely
+    if embedded_artifact_missing(run_id, model_id, 'booster'):
+        return None
+    xgb = lazy_import('xgboost')
+
+    local_path_to_booster = download_artifact(
+        run_id, model_id, 'booster', get_booster_location(run_id)
+    )
+    booster = xgb.Booster()
+    booster.load_model(local_path_to_booster)
+    return BoosterModel(booster)
+
+
+def load_bundle(run_id, model_id):
+    if embedded_artifact_missing(run_id, model_id, 'serving_bundle'):
+        return None
+    xgb = lazy_import('xgboost')
+    serving_bundle = lazy_import('serving_bundle')
+
+    # Section checksums are verified once, on download, so a truncated or corrupt bundle
+    # never enters the artifact cache and cache hits skip re-hashing the whole file
+    local_path_to_bundle = download_artifact(
+        run_id,
+        model_id,
+        'serving_bundle',
+        get_bundle_location(run_id),
+        validate=serving_bundle.ServingBundle,
+    )
+    bundle = serving_bundle.ServingBundle(local_path_to_bundle, verify=False)
+    booster = xgb.Booster()
+    booster.load_model(bundle.booster_buffer())
+    return BoosterModel(booster), bundle.encoder()
+
+
+def load_serving_model(run_id, model_id, model_location, backend):
+    if backend == 'booster':
+        try:
+            booster = load_booster(run_id, model_id)
+            if booster is not None:
+                return booster
+            print(f"Run {run_id} was baked without a native booster, loading pyfunc model")
+        except Exception as e:  # pylint: disable=broad-exception-caught
+            print(f"Native booster unavailable, falling back to pyfunc model: {e}")
+
+    local_path_to_model = download_artifact(run_id, model_id, 'pyfunc_model', model_location)
+    mlflow = lazy_import('mlflow')
+    return mlflow.pyfunc.load_model(local_path_to_model)
+
+
+def load_preprocessor(run_id, model_id, preprocessor_location, encoder_mode):
+    if encoder_mode == 'compiled':
+        # A previously compiled encoder skips unpickling the DictVectorizer (and importing sklearn)
+        local_path_to_encoder = get_local_artifact(run_id, model_id, 'feature_encoder')
+        if local_path_to_encoder is not None:
+            return lazy_import('feature_encoder').FeatureEncoder.load(local_path_to_encoder)
+
+    local_path_to_preproc = download_artifact(
+        run_id, model_id, 'preprocessor', preprocessor_location
+    )
+    with open(local_path_to_preproc, 'rb') as f:
+        preprocessor = pickle.load(f)
+
+    if encoder_mode != 'compiled':
+        return preprocessor
+
+    encoder = lazy_import('feature_encoder').FeatureEncoder.from_dict_vectorizer(preprocessor)
+    cache = get_artifact_cache()
+    if cache is not None:
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            encoder_path = os.path.join(tmp_dir, 'feature_encoder.npz')
+            encoder.save(encoder_path)
+            cache.put(run_id, model_id, 'feature_encoder', encoder_path)
+    return encoder
+
+
+def load_model(run_id, model_id, backend=None, encoder_mode=None):
     model_location, preprocessor_location = get_model_location(run_id, model_id)
+    backend = backend or model_backend
+    encoder_mode = encoder_mode or feature_encoder_mode
+
+    if model_format == 'bundle' and backend == 'booster' and encoder_mode == 'compiled':
+        try:
+            with timed('load_bundle'):
+                bundle = load_bundle(run_id, model_id)
+            if bundle is not None:
+                return bundle
+        except Exception as e:  # pylint: disable=broad-exception-caught
+            print(f"Serving bundle unavailable, loading separate artifacts: {e}")
 
     try:
-        model = mlflow.pyfunc.load_model(model_location)
-        local_path_to_preproc = mlflow.artifacts.download_artifacts(preprocessor_location)
-        with open(local_path_to_preproc, 'rb') as f:
-            preprocessor = pickle.load(f)
+        with timed('load_model'):
+            model = load_serving_model(run_id, model_id, model_location, backend)
+
+        with timed('load_preprocessor'):
+            preprocessor = load_preprocessor(run_id, model_id, preprocessor_location, encoder_mode)
+
         return model, preprocessor
     except Exception as e:
         print(f"Error loading model: {e}")
@@ -31,110 +288,541 @@ def load_model(run_id, model_id):
         raise
 
 
+def load_drift_monitor(run_id, model_id):
+    # Runs trained before reference profiles existed are served without monitoring
+    if not drift_monitoring_enabled:
+        return None
+    # Baking records runs without a profile, so a baked image never looks for one remotely
+    if embedded_artifact_missing(run_id, model_id, 'reference_profile'):
+        print(f"Drift monitoring disabled, run {run_id} was baked without a reference profile")
+        return None
+
+    drift_monitoring = lazy_import('drift_monitoring')
+    try:
+        with timed('load_reference_profile'):
+            local_path_to_profile = download_artifact(
+                run_id, model_id, 'reference_profile', get_reference_profile_location(run_id)
+            )
+            reference = drift_monitoring.Profile.load(local_path_to_profile)
+    except Exception as e:  # pylint: disable=broad-exception-caught
+        print(f"Drift monitoring disabled, no reference profile for run {run_id}: {e}")
+        return None
+    return drift_monitoring.DriftMonitor(reference, run_id, report_interval=drift_report_seconds)
+
+
 def base64_decode(encoded_data):
     decoded_data = base64.b64decode(encoded_data).decode('utf-8')
     return json.loads(decoded_data)
 
 
 def create_kinesis_client():
+    boto3 = lazy_import('boto3')
     endpoint_url = os.getenv('KINESIS_ENDPOINT_URL')
     kinesis_client = boto3.client('kinesis', endpoint_url=endpoint_url)
     return kinesis_client
 
 
+def read_routing_config(location):
+    if location.startswith('s3://'):
+        bucket, key = location[len('s3://') :].split('/', 1)
+        s3_client = lazy_import('boto3').client('s3')
+        try:
+            response = s3_client.get_object(Bucket=bucket, Key=key)
+        except s3_client.exceptions.NoSuchKey:
+            return None
+        return json.loads(response['Body'].read())
+
+    try:
+        with open(location, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
 class ModelService:
 
-    def __init__(self, model, preprocessor, run_id, model_id, test_run, callbacks=None):
-        self.model = model
-        self.preprocessor = preprocessor
-        self.run_id = run_id
-        self.model_id = model_id
+    def __init__(
+        self,
+        model,
+        preprocessor,
+        run_id,
+        model_id,
+        test_run,
+        callbacks=None,
+        flush_callbacks=None,
+        async_callbacks=False,
+        callback_queue_size=1000,
+        prediction_cache=None,
+        registry=None,
+        metrics=None,
+        archive=None,
+        monitor=None,
+    ):
+        # Every prediction is made by one of the registry's resident versions; without a
+        # registry, the given model is the only one
+        self.registry = registry or ModelRegistry(
+            ModelVersion(model, preprocessor, run_id, model_id, monitor)
+        )
         self.test_run = test_run
         self.callbacks = callbacks or []
-
-    def process_features(self, ride):
-        processed_features = self.preprocessor.transform(ride)
+        # Flush callbacks run once at the end of every invocation so buffered sinks send their data
+        self.callback_dispatcher = CallbackDispatcher(
+            self.callbacks,
+            flush_callbacks,
+            asynchronous=async_callbacks,
+            max_queue_size=callback_queue_size,
+        )
+        self.prediction_cache = prediction_cache
+        self.metrics = metrics or NullMetrics()
+        # Records every delivered prediction with its ride features; flushed as a flush callback
+        self.archive = archive
+
+    @property
+    def model(self):
+        return self.registry.primary.model
+
+    @property
+    def preprocessor(self):
+        return self.registry.primary.preprocessor
+
+    @property
+    def run_id(self):
+        return self.registry.primary.run_id
+
+    @property
+    def model_id(self):
+        return self.registry.primary.model_id
+
+    def process_features(self, ride, version=None):
+        processed_features = (version or self.registry.primary).preprocessor.transform(ride)
         return processed_features
 
-    def predict(self, features):
-        pred = self.model.predict(features)
+    def predict(self, features, version=None):
+        pred = (version or self.registry.primary).model.predict(features)
         return float(pred[0])
 
-    def lambda_handler(self, event):
+    def predict_batch(self, features, version=None):
+        preds = (version or self.registry.primary).model.predict(features)
+        return [float(pred) for pred in preds]
 
-        predictions = []
+    def handle_record_error(self, error):
+        print(f"Error processing record: {error}")
+        traceback.print_exception(error)
+
+        # Re-raise exceptions in test mode for proper test behavior
+        if self.test_run:
+            raise error
+
+    def decode_records(self, records):
+        with self.metrics.stage('decode'):
+            rides, failures = decode_records(records, RECORD_ERRORS)
+        self.metrics.count('records', len(records))
+        self.metrics.count('decode_errors', len(failures))
+
+        for _, error in failures:
+            self.handle_record_error(error)
 
-        for record in event['Records']:
+        return rides, {index for index, _ in failures}
+
+    def prediction_cache_key(self, ride, version=None):
+        # Canonical, hashable form of the fields the version's encoder reads, scoped to the
+        # model version, so payload fields it ignores don't make every ride a distinct key.
+        # Preprocessors without a field list (DictVectorizer) are keyed on the whole ride.
+        # Rides with unhashable values (e.g. lists) are never cached.
+        version = version or self.registry.primary
+        fields = getattr(version.preprocessor, 'fields', None)
+        try:
+            if fields is None:
+                features = tuple(sorted(ride.items()))
+            else:
+                features = tuple((field, ride[field]) for field in fields if field in ride.keys())
+            hash(features)
+        except (AttributeError, TypeError):
+            return None
+        return (*version.key, features)
+
+    def predict_routed(self, rides):
+        """Returns (versions, predictions): the version that served each ride and its prediction"""
+        self.registry.refresh()
+        # One routing snapshot per batch, so a concurrent swap never splits a batch inconsistently
+        routing = self.registry.routing
+
+        versions = [routing.route(ride_id) for ride_id, _ in rides]
+        predictions = [None] * len(rides)
+        for version in dict.fromkeys(versions):
+            indices = [i for i, routed in enumerate(versions) if routed is version]
+            served = self.predict_version([rides[i] for i in indices], version)
+            for i, prediction in zip(indices, served):
+                predictions[i] = prediction
+
+        if routing.shadow is not None and rides:
+            self.predict_shadow(routing.shadow, rides, predictions)
+
+        return versions, predictions
+
+    def predict_rides(self, rides):
+        return self.predict_routed(rides)[1]
+
+    def predict_shadow(self, shadow, rides, predictions):
+        # Shadow predictions are only compared with the served ones, never returned
+        try:
+            with self.metrics.stage('shadow'), self.metrics.suspended():
+                shadow_predictions = self.predict_version(rides, shadow)
+        except Exception as e:  # pylint: disable=broad-exception-caught
+            print(f"Shadow model {shadow.run_id} failed: {e}")
+            return
+
+        diffs = [
+            abs(served - shadowed)
+            for served, shadowed in zip(predictions, shadow_predictions)
+            if served is not None and shadowed is not None
+        ]
+        shadow_stats = {
+            'version': shadow.run_id,
+            'rides': len(diffs),
+            'mean_abs_diff': sum(diffs) / len(diffs) if diffs else None,
+            'max_abs_diff': max(diffs, default=None),
+        }
+        print(json.dumps({'shadow': shadow_stats}))
+
+    def predict_version(self, rides, version):
+        if self.prediction_cache is None:
+            return self.predict_uncached(rides, version)
+
+        keys = [self.prediction_cache_key(ride_data, version) for _, ride_data in rides]
+        predictions = [self.prediction_cache.get(key) if key is not None else None for key in keys]
+
+        # Only rides missing from the cache go through the encoder and the model
+        missed = [i for i, prediction in enumerate(predictions) if prediction is None]
+        computed = self.predict_uncached([rides[i] for i in missed], version)
+
+        for i, prediction in zip(missed, computed):
+            predictions[i] = prediction
+            if prediction is not None and keys[i] is not None:
+                self.prediction_cache.put(keys[i], prediction)
+
+        return predictions
+
+    def predict_uncached(self, rides, version=None):
+        if not rides:
+            return []
+
+        try:
+            with self.metrics.stage('encode'):
+                features = self.process_features([ride_data for _, ride_data in rides], version)
+            with self.metrics.stage('predict'):
+                return self.predict_batch(features, version)
+        except RECORD_ERRORS as e:
+            if self.test_run:
+                raise
+            self.metrics.count('batch_fallbacks')
+            print(f"Batch prediction failed, falling back to per-record prediction: {e}")
+
+        # Isolate the bad record(s): failed rides get a prediction of None
+        predictions = []
+        for _, ride_data in rides:
             try:
-                encoded_data = record['kinesis']['data']
-                ride_event = base64_decode(encoded_data)
+                with self.metrics.stage('encode'):
+                    features = self.process_features(ride_data, version)
+                with self.metrics.stage('predict'):
+                    predictions.append(self.predict(features, version))
+            except RECORD_ERRORS as e:
+                self.metrics.count('prediction_errors')
+                self.handle_record_error(e)
+                predictions.append(None)
+
+        return predictions
+
+    def prediction_event(self, ride_id, prediction, version=None):
+        return {
+            'statusCode': 200,
+            'model': 'ride_duration_prediction_test',
+            'version': (version or self.registry.primary).run_id,
+            'prediction': {
+                'ride_id': ride_id,
+                'predicted_duration': prediction,
+            },
+        }
 
-                ride_data = ride_event['ride']
-                ride_id = ride_event['ride_id']
+    def lambda_handler(self, event):
+        with self.metrics.stage('total'):
+            output = self.handle_event(event)
+        self.metrics.flush(version=self.run_id)
+        return output
+
+    def monitor_predictions(self, decoded, versions, ride_predictions, held_back):
+        # Each version's delivered rides and predictions go to its own monitor; held back
+        # records are retried later and would otherwise be counted again on the retry
+        monitored = {}
+        for (index, _, ride_data), version, prediction in zip(decoded, versions, ride_predictions):
+            if index not in held_back and version.monitor is not None:
+                monitored.setdefault(version, []).append((ride_data, prediction))
+        for version, rows in monitored.items():
+            rides, predictions = zip(*rows)
+            version.monitor.update(rides, predictions)
+
+    def deliver_predictions(self, decoded, versions, ride_predictions, held_back):
+        predictions = []
+        callback_errors = sum(self.callback_dispatcher.error_counts.values())
 
-                features = self.process_features(ride_data)
-                prediction = self.predict(features)
+        with self.metrics.stage('callbacks'):
+            for (index, ride_id, ride_data), version, prediction in zip(
+                decoded, versions, ride_predictions
+            ):
+                if index in held_back:
+                    continue
 
-                prediction_event = {
-                    'statusCode': 200,
-                    'model': 'ride_duration_prediction_test',
-                    'version': self.run_id,
-                    'prediction': {
-                        'ride_id': ride_id,
-                        'predicted_duration': prediction,
-                    },
-                }
+                prediction_event = self.prediction_event(ride_id, prediction, version)
 
-                for callback in self.callbacks:
-                    callback(prediction_event)
+                self.callback_dispatcher.submit(prediction_event)
+                if self.archive is not None:
+                    self.archive.add(prediction_event, ride_data)
 
                 predictions.append(prediction_event)
 
-            except (json.JSONDecodeError, KeyError, ValueError) as e:
-                print(f"Error processing record: {e}")
-                traceback.print_exc()
+            self.callback_dispatcher.drain()
 
-                # Re-raise exceptions in test mode for proper test behavior
-                if self.test_run:
-                    raise
+        self.metrics.count('predictions', len(predictions))
+        self.metrics.count(
+            'callback_errors', sum(self.callback_dispatcher.error_counts.values()) - callback_errors
+        )
+        return predictions
 
-        output = {'predictions': predictions}
+    def handle_event(self, event):
+        records = event['Records']
+        decoded, failed = self.decode_records(records)
+        versions, ride_predictions = self.predict_routed(
+            [(ride_id, ride_data) for _, ride_id, ride_data in decoded]
+        )
+
+        failed.update(
+            index
+            for (index, _, _), prediction in zip(decoded, ride_predictions)
+            if prediction is None
+        )
+        # Only failed records (and the ones queued behind them on the same partition key)
+        # are reported, so Lambda checkpoints everything before the first failure
+        held_back, failures = batch_item_failures(records, failed)
+        self.metrics.count('batch_item_failures', len(failures))
+
+        if any(version.monitor is not None for version in self.registry.routing.versions):
+            with self.metrics.stage('monitor'):
+                self.monitor_predictions(decoded, versions, ride_predictions, held_back)
+
+        predictions = self.deliver_predictions(decoded, versions, ride_predictions, held_back)
+
+        if self.prediction_cache is not None:
+            print(json.dumps({'prediction_cache': self.prediction_cache.stats()}))
+
+        output = {'predictions': predictions, 'batchItemFailures': failures}
 
         return output
 
 
+class KinesisDeliveryError(Exception):
+    def __init__(self, message, entries):
+        super().__init__(message)
+        # The PutRecords entries Kinesis has not accepted; they stay buffered for the next flush
+        self.entries = entries
+
+
+# PutRecords errors on the whole request that are worth retrying: throttling and server-side
+# failures; connection errors and timeouts (botocore ConnectionError/HTTPClientError) are too
+RETRIABLE_KINESIS_ERRORS = (
+    'ProvisionedThroughputExceededException',
+    'LimitExceededException',
+    'ThrottlingException',
+    'KMSThrottlingException',
+    'InternalFailure',
+    'ServiceUnavailable',
+)
+
+
+def is_retriable_kinesis_error(error):
+    exceptions = lazy_import('botocore.exceptions')
+    if isinstance(error, exceptions.ClientError):
+        return error.response.get('Error', {}).get('Code') in RETRIABLE_KINESIS_ERRORS
+    return isinstance(error, (exceptions.ConnectionError, exceptions.HTTPClientError))
+
+
 class KinesisCallback:
 
-    def __init__(self, kinesis_client, prediction_stream_name):
+    # PutRecords limits: 500 records and 5 MB (data plus partition keys) per request
+    max_batch_records = 500
+    max_batch_bytes = 5 * 1024 * 1024
+
+    def __init__(self, kinesis_client, prediction_stream_name, max_retries=3, retry_backoff=0.1):
         self.prediction_stream_name = prediction_stream_name
         self.kinesis_client = kinesis_client
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+        self.buffer = []
+        self.buffer_bytes = 0
+
+    @staticmethod
+    def entry_bytes(entry):
+        return len(entry['Data']) + len(entry['PartitionKey'].encode('utf-8'))
 
     def put_record(self, prediction_event):
+        # Buffers the event; records are only sent once a batch is full or on flush()
+        ride_id = prediction_event['prediction']['ride_id']
+        entry = {
+            'Data': json.dumps(prediction_event).encode('utf-8'),
+            'PartitionKey': str(ride_id),
+        }
+
+        entry_bytes = self.entry_bytes(entry)
         try:
-            ride_id = prediction_event['prediction']['ride_id']
-            self.kinesis_client.put_record(
-                StreamName=self.prediction_stream_name,
-                Data=json.dumps(prediction_event),
-                PartitionKey=str(ride_id),
-            )
-        except (KeyError, ValueError, ConnectionError) as e:
-            print(f"Failed to send to Kinesis: {e}")
-            # In integration tests, this is expected and OK
+            if self.buffer and self.buffer_bytes + entry_bytes > self.max_batch_bytes:
+                self.flush()
+        finally:
+            self.buffer.append(entry)
+            self.buffer_bytes += entry_bytes
+
+        if len(self.buffer) >= self.max_batch_records:
+            self.flush()
+
+    def batches(self, entries):
+        # A buffer that kept undelivered entries can exceed one request, so it is split again
+        batch, batch_bytes = [], 0
+        for entry in entries:
+            entry_bytes = self.entry_bytes(entry)
+            if batch and (
+                len(batch) >= self.max_batch_records
+                or batch_bytes + entry_bytes > self.max_batch_bytes
+            ):
+                yield batch
+                batch, batch_bytes = [], 0
+            batch.append(entry)
+            batch_bytes += entry_bytes
+        if batch:
+            yield batch
+
+    def flush(self):
+        batches = list(self.batches(self.buffer))
+        for i, batch in enumerate(batches):
+            try:
+                self.put_records(batch)
+            except KinesisDeliveryError as e:
+                # Entries leave the buffer only once Kinesis accepted them, so whatever is still
+                # undelivered is sent again on the next flush instead of being dropped
+                e.entries = e.entries + [entry for rest in batches[i + 1 :] for entry in rest]
+                self.buffer = list(e.entries)
+                self.buffer_bytes = sum(self.entry_bytes(entry) for entry in self.buffer)
+                raise
+
+        self.buffer = []
+        self.buffer_bytes = 0
+
+    def put_records(self, entries):
+        error = None
+        for attempt in range(self.max_retries + 1):
+            if attempt > 0:
+                time.sleep(self.retry_backoff * 2 ** (attempt - 1))
+
+            try:
+                response = self.kinesis_client.put_records(
+                    StreamName=self.prediction_stream_name,
+                    Records=entries,
+                )
+            except Exception as e:  # pylint: disable=broad-exception-caught
+                if not is_retriable_kinesis_error(e):
+                    raise KinesisDeliveryError(
+                        f"Failed to send {len(entries)} records to Kinesis: {e}", entries
+                    ) from e
+                # The whole request failed (throttled, timed out, unreachable), so all is retried
+                error = e
+                continue
+
+            # Only the entries that failed (e.g. throttled shards) are retried
+            error = None
+            entries = [
+                entry
+                for entry, result in zip(entries, response['Records'])
+                if 'ErrorCode' in result
+            ]
+            if not entries:
+                return
+
+        raise KinesisDeliveryError(
+            f"Failed to send {len(entries)} records to Kinesis after {self.max_retries} retries",
+            entries,
+        ) from error
+
+
+def create_prediction_archive():
+    s3_client = None
+    if prediction_archive_location.startswith('s3://'):
+        s3_client = lazy_import('boto3').client('s3')
+    return lazy_import('prediction_archive').PredictionArchive(
+        prediction_archive_location,
+        s3_client,
+        max_rows=prediction_archive_max_rows,
+        max_age=prediction_archive_max_seconds,
+    )
 
 
 def init(prediction_stream_name: str, run_id: str, model_id: str, test_run: bool):
 
     callbacks = []
+    flush_callbacks = []
 
     if not test_run:
-        kinesis_client = create_kinesis_client()
+        with timed('create_kinesis_client'):
+            kinesis_client = create_kinesis_client()
         kinesis_callback = KinesisCallback(kinesis_client, prediction_stream_name)
         callbacks.append(kinesis_callback.put_record)
+        flush_callbacks.append(kinesis_callback.flush)
+
+    archive = create_prediction_archive() if prediction_archive_location else None
+    if archive is not None:
+        flush_callbacks.append(archive.flush)
 
     if test_run:
         model, preprocessor = None, None
     else:
         model, preprocessor = load_model(run_id, model_id)
 
-    model_service = ModelService(model, preprocessor, run_id, model_id, test_run, callbacks)
+    # The routing config, when there is one, decides which versions serve from the start
+    config_reader = None
+    if model_routing_config:
+        config_reader = functools.partial(read_routing_config, model_routing_config)
+    registry = ModelRegistry(
+        ModelVersion(
+            model,
+            preprocessor,
+            run_id,
+            model_id,
+            None if test_run else load_drift_monitor(run_id, model_id),
+        ),
+        loader=load_model,
+        monitor_loader=load_drift_monitor,
+        config_reader=config_reader,
+        refresh_interval=model_routing_refresh_seconds,
+    )
+    with timed('load_routed_models'):
+        registry.refresh(block=True)
+
+    prediction_cache = None
+    if prediction_cache_size > 0:
+        prediction_cache = PredictionCache(prediction_cache_size, prediction_cache_ttl)
+
+    model_service = ModelService(
+        model,
+        preprocessor,
+        run_id,
+        model_id,
+        test_run,
+        callbacks,
+        flush_callbacks,
+        async_callbacks=async_callback_delivery,
+        callback_queue_size=callback_queue_max_size,
+        prediction_cache=prediction_cache,
+        registry=registry,
+        metrics=HandlerMetrics(metrics_namespace) if handler_metrics_enabled else None,
+        archive=archive,
+    )
     return model_service
+
+
+startup_timings['import_model'] = time.perf_counter() - _module_import_start
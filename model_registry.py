@@ -0,0 +1,205 @@
+import bisect
+import itertools
+import threading
+import time
+import traceback
+import zlib
+from concurrent import futures
+
+
+class ModelVersion:
+    """A loaded model, its preprocessor and drift monitor, identified by (run_id, model_id)"""
+
+    def __init__(self, model, preprocessor, run_id, model_id, monitor=None):
+        self.model = model
+        self.preprocessor = preprocessor
+        self.run_id = run_id
+        self.model_id = model_id
+        # Drift monitor comparing the rides this version serves with its training reference
+        self.monitor = monitor
+
+    @property
+    def key(self):
+        return (self.run_id, self.model_id)
+
+
+class Routing:
+    """Immutable traffic split between resident versions plus an optional shadow version.
+
+    Rides are assigned by a stable hash of their ride_id, so a ride keeps going to the
+    same version while the weights stay the same (and mostly when a canary is ramped up).
+    """
+
+    def __init__(self, targets, shadow=None):
+        weights = [weight for _, weight in targets]
+        if not targets or any(weight < 0 for weight in weights) or sum(weights) <= 0:
+            raise ValueError(f"Invalid traffic weights: {weights}")
+
+        total = sum(weights)
+        self.targets = tuple((version, weight / total) for version, weight in targets)
+        self.thresholds = list(itertools.accumulate(weight for _, weight in self.targets))
+        self.shadow = shadow
+
+    @property
+    def primary(self):
+        return max(self.targets, key=lambda target: target[1])[0]
+
+    @property
+    def versions(self):
+        versions = [version for version, _ in self.targets]
+        if self.shadow is not None:
+            versions.append(self.shadow)
+        return versions
+
+    def route(self, ride_id):
+        if len(self.targets) == 1:
+            return self.targets[0][0]
+        point = zlib.crc32(str(ride_id).encode('utf-8')) / 2**32
+        index = min(bisect.bisect_right(self.thresholds, point), len(self.targets) - 1)
+        return self.targets[index][0]
+
+    def describe(self):
+        return {
+            'targets': [
+                {'run_id': version.run_id, 'model_id': version.model_id, 'weight': weight}
+                for version, weight in self.targets
+            ],
+            'shadow': self.shadow.run_id if self.shadow is not None else None,
+        }
+
+
+class ModelRegistry:  # pylint: disable=too-many-instance-attributes
+    """Resident model versions and the routing used to pick one per ride.
+
+    New versions are loaded on a background thread by loader(run_id, model_id), which
+    returns (model, preprocessor), and the routing is swapped in one assignment once
+    they are ready, so in-flight batches finish on the versions they started with.
+    monitor_loader(run_id, model_id), when given, returns each new version's drift
+    monitor (or None), so monitoring follows the versions across swaps.
+
+    With a config_reader, refresh() re-reads the routing config at most every
+    refresh_interval seconds. The config looks like
+    {"versions": [{"run_id": ..., "model_id": ..., "weight": 0.9}, ...],
+     "shadow": {"run_id": ..., "model_id": ...}}.
+    Versions that are no longer routed are dropped after each swap.
+    """
+
+    def __init__(
+        self,
+        initial_version,
+        loader=None,
+        monitor_loader=None,
+        config_reader=None,
+        refresh_interval=60.0,
+        clock=time.monotonic,
+    ):
+        self.loader = loader
+        self.monitor_loader = monitor_loader
+        self.config_reader = config_reader
+        self.refresh_interval = refresh_interval
+        self.clock = clock
+        self.versions = {initial_version.key: initial_version}
+        self.routing = Routing([(initial_version, 1.0)])
+        self.lock = threading.Lock()
+        self.executor = futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix='model-loader')
+        self.last_refresh = None
+        self.config = None
+        self.pending = None
+
+    @property
+    def primary(self):
+        return self.routing.primary
+
+    def load(self, run_id, model_id):
+        with self.lock:
+            version = self.versions.get((run_id, model_id))
+        if version is not None:
+            return version
+
+        print(f"Loading model version {run_id} ({model_id})")
+        model, preprocessor = self.loader(run_id, model_id)
+        monitor = self.monitor_loader(run_id, model_id) if self.monitor_loader else None
+        version = ModelVersion(model, preprocessor, run_id, model_id, monitor)
+        with self.lock:
+            return self.versions.setdefault(version.key, version)
+
+    def set_routing(self, weights, shadow=None):
+        """Route traffic by weights, a list of ((run_id, model_id), weight) of loaded versions"""
+        with self.lock:
+            try:
+                targets = [(self.versions[key], weight) for key, weight in weights]
+                shadow_version = self.versions[shadow] if shadow is not None else None
+            except KeyError as e:
+                raise ValueError(f"Model version {e.args[0]} is not loaded") from e
+
+            self.routing = Routing(targets, shadow_version)
+            routed = {version.key for version in self.routing.versions}
+            self.versions = {key: v for key, v in self.versions.items() if key in routed}
+
+        print(f"Model routing updated: {self.routing.describe()}")
+        return self.routing
+
+    def apply(self, weights, shadow=None):
+        keys = [key for key, _ in weights] + ([shadow] if shadow is not None else [])
+        for run_id, model_id in keys:
+            self.load(run_id, model_id)
+        return self.set_routing(weights, shadow)
+
+    def apply_in_background(self, weights, shadow=None):
+        """Load any missing versions off the request path, then swap the routing"""
+        future = self.executor.submit(self.apply, weights, shadow)
+        future.add_done_callback(report_failed_swap)
+        return future
+
+    def reload(self, run_id, model_id, wait=False):
+        """Send all traffic to (run_id, model_id) once it is loaded"""
+        future = self.apply_in_background([((run_id, model_id), 1.0)])
+        return future.result() if wait else future
+
+    def refresh(self, block=False):
+        if self.config_reader is None:
+            return
+        now = self.clock()
+        if self.last_refresh is not None and now - self.last_refresh < self.refresh_interval:
+            return
+        self.last_refresh = now
+
+        try:
+            config = self.config_reader()
+            routing = parse_routing_config(config) if config is not None else None
+        except Exception as e:  # pylint: disable=broad-exception-caught
+            print(f"Failed to read the model routing config: {e}")
+            return
+        if self.pending is not None:
+            if not self.pending.done():
+                return
+            if self.pending.exception() is not None:
+                # Retry a config whose versions failed to load
+                self.config = None
+        if config is None or config == self.config:
+            return
+
+        self.config = config
+        self.pending = self.apply_in_background(*routing)
+        if block:
+            # Failures are reported by the callback; the current routing keeps serving
+            futures.wait([self.pending])
+
+
+def parse_routing_config(config):
+    weights = [
+        ((entry['run_id'], entry['model_id']), float(entry.get('weight', 1.0)))
+        for entry in config['versions']
+    ]
+    shadow = config.get('shadow')
+    if shadow is not None:
+        shadow = (shadow['run_id'], shadow['model_id'])
+    return weights, shadow
+
+
+def report_failed_swap(future):
+    # The current routing stays in place when a new version fails to load
+    error = future.exception()
+    if error is not None:
+        print(f"Failed to switch model versions: {error}")
+        traceback.print_exception(error)
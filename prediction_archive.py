@@ -0,0 +1,148 @@
+import json
+import os
+import tempfile
+import threading
+import time
+import uuid
+from pathlib import Path
+
+import pyarrow as pa
+from pyarrow import parquet as pq
+
+# Columns written for every prediction; ride features with the same name are not archived
+PREDICTION_COLUMNS = ('ride_id', 'predicted_duration', 'predicted_at')
+
+
+def feature_column(values):
+    try:
+        return pa.array(values)
+    except (pa.ArrowInvalid, pa.ArrowTypeError):
+        # Values of mixed types (e.g. a location ID sent as int and as str) are kept as JSON
+        return pa.array(
+            [None if value is None else json.dumps(value) for value in values], type=pa.string()
+        )
+
+
+def predictions_table(rows):
+    """Arrow table of (ride_id, prediction, run_id, timestamp, ride) rows, one column per feature"""
+    columns = {
+        'ride_id': pa.array(
+            [None if row[0] is None else str(row[0]) for row in rows], type=pa.string()
+        ),
+        'predicted_duration': pa.array([row[1] for row in rows], type=pa.float64()),
+        'predicted_at': pa.array(
+            [int(row[3] * 1000) for row in rows], type=pa.timestamp('ms', tz='UTC')
+        ),
+    }
+    feature_names = dict.fromkeys(name for row in rows for name in row[4])
+    for name in feature_names:
+        if name not in PREDICTION_COLUMNS:
+            columns[name] = feature_column([row[4].get(name) for row in rows])
+    return pa.table(columns)
+
+
+class PredictionArchive:  # pylint: disable=too-many-instance-attributes
+    """Buffers prediction events with their ride features and writes them as Parquet.
+
+    Rows are written under <location>/date=YYYY-MM-DD/run_id=<run_id>/ (a local directory
+    or an s3:// URI), one compressed file per partition and flush. flush() only writes once
+    the buffer holds max_rows rows or its oldest row is max_age seconds old, so it can run
+    after every invocation; flush(force=True) writes whatever is buffered. Rows still
+    buffered when the process exits are lost, the archive is not a delivery guarantee.
+    """
+
+    def __init__(
+        self,
+        location,
+        s3_client=None,
+        max_rows=50000,
+        max_age=300.0,
+        compression='zstd',
+        clock=time.time,
+    ):
+        self.s3_client = s3_client
+        if location.startswith('s3://'):
+            self.bucket, _, self.prefix = location[len('s3://') :].partition('/')
+        else:
+            self.bucket, self.prefix = None, location
+        self.prefix = self.prefix.rstrip('/')
+        self.max_rows = max_rows
+        self.max_buffered_rows = 4 * max_rows
+        self.max_age = max_age
+        self.compression = compression
+        self.clock = clock
+        # add() runs on the handler thread, flush() on the callback dispatcher's worker
+        self.lock = threading.Lock()
+        self.rows = []
+        self.oldest = None
+
+    def add(self, prediction_event, ride):
+        prediction = prediction_event['prediction']
+        row = (
+            prediction['ride_id'],
+            prediction['predicted_duration'],
+            prediction_event['version'],
+            self.clock(),
+            ride,
+        )
+        with self.lock:
+            if not self.rows:
+                self.oldest = row[3]
+            self.rows.append(row)
+
+    def flush(self, force=False):
+        """Writes the buffered rows if a threshold was reached; returns the written keys"""
+        with self.lock:
+            if not self.rows:
+                return []
+            due = len(self.rows) >= self.max_rows or self.clock() - self.oldest >= self.max_age
+            if not (force or due):
+                return []
+            rows, self.rows = self.rows, []
+
+        partitions = {}
+        for row in rows:
+            date = time.strftime('%Y-%m-%d', time.gmtime(row[3]))
+            partitions.setdefault((date, row[2]), []).append(row)
+
+        keys = []
+        partitions = list(partitions.items())
+        for i, ((date, run_id), partition_rows) in enumerate(partitions):
+            key = f'date={date}/run_id={run_id}/part-{int(rows[0][3])}-{uuid.uuid4().hex}.parquet'
+            if self.prefix:
+                key = f'{self.prefix}/{key}'
+            try:
+                self.write(key, predictions_table(partition_rows))
+            except Exception:
+                self.requeue([row for _, unwritten in partitions[i:] for row in unwritten])
+                raise
+            keys.append(key)
+        return keys
+
+    def requeue(self, rows):
+        # Unwritten rows are retried on the next flush; while writes keep failing the
+        # buffer is capped at max_buffered_rows by dropping the oldest rows
+        with self.lock:
+            self.rows = sorted(rows + self.rows, key=lambda row: row[3])
+            dropped = len(self.rows) - self.max_buffered_rows
+            if dropped > 0:
+                del self.rows[:dropped]
+                print(f"Prediction archive buffer is full, dropped {dropped} rows")
+            self.oldest = self.rows[0][3]
+
+    def write(self, key, table):
+        sink = pa.BufferOutputStream()
+        pq.write_table(table, sink, compression=self.compression)
+        data = sink.getvalue().to_pybytes()
+
+        if self.bucket is not None:
+            self.s3_client.put_object(Bucket=self.bucket, Key=key, Body=data)
+            return
+
+        # Written next to the final path and renamed, so readers never see a partial file
+        path = Path(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=path.parent, prefix='.tmp-')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
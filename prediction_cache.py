@@ -0,0 +1,60 @@
+import time
+from collections import Counter, OrderedDict
+
+
+class PredictionCache:
+    """Bounded LRU cache of predictions with an optional time-to-live.
+
+    Keys are built by ModelService from the model version and the ride fields its
+    encoder reads, so payload fields the model ignores still share an entry. Hits, misses, LRU evictions and TTL expirations are counted so the cache
+    can be sized from the logged stats.
+    """
+
+    def __init__(self, max_size, ttl_seconds=None, clock=time.monotonic):
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self.clock = clock
+        self.entries = OrderedDict()
+        # hits, misses, evictions and expirations
+        self.counts = Counter()
+
+    def get(self, key):
+        entry = self.entries.get(key)
+        if entry is None:
+            self.counts['misses'] += 1
+            return None
+
+        prediction, expires_at = entry
+        if expires_at is not None and self.clock() >= expires_at:
+            del self.entries[key]
+            self.counts['expirations'] += 1
+            self.counts['misses'] += 1
+            return None
+
+        self.entries.move_to_end(key)
+        self.counts['hits'] += 1
+        return prediction
+
+    def put(self, key, prediction):
+        expires_at = None if not self.ttl_seconds else self.clock() + self.ttl_seconds
+        self.entries[key] = (prediction, expires_at)
+        self.entries.move_to_end(key)
+
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+            self.counts['evictions'] += 1
+
+    def clear(self):
+        self.entries.clear()
+
+    def stats(self):
+        hits, misses = self.counts['hits'], self.counts['misses']
+        return {
+            'size': len(self.entries),
+            'max_size': self.max_size,
+            'hits': hits,
+            'misses': misses,
+            'evictions': self.counts['evictions'],
+            'expirations': self.counts['expirations'],
+            'hit_rate': hits / (hits + misses) if hits + misses else 0.0,
+        }
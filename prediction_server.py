@@ -0,0 +1,217 @@
+import asyncio
+import os
+import traceback
+from collections.abc import Mapping
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+
+import uvicorn
+from fastapi import Body, FastAPI
+from fastapi.responses import JSONResponse
+
+import model
+
+PREDICTIONS_STREAM_NAME = os.getenv('PREDICTIONS_STREAM_NAME', 'ride-predictions')
+RUN_ID = os.getenv('RUN_ID', '70123647ea1f49a2889fcff4d7032960')
+MODEL_ID = os.getenv('MODEL_ID', 'm-b312b4c1155a4197af44793c03b32ad4')
+TEST_RUN = os.getenv('TEST_RUN', 'False').lower() == 'true'
+
+SERVER_HOST = os.getenv('SERVER_HOST', '0.0.0.0')
+SERVER_PORT = int(os.getenv('SERVER_PORT', '9999'))
+# Requests arriving within MAX_BATCH_WAIT_MS of the first one share an encode + predict call
+MAX_BATCH_SIZE = int(os.getenv('MAX_BATCH_SIZE', '64'))
+MAX_BATCH_WAIT_MS = float(os.getenv('MAX_BATCH_WAIT_MS', '2'))
+
+
+class MicroBatcher:  # pylint: disable=too-many-instance-attributes
+    """Groups concurrent requests into a single call of predict_batch(items).
+
+    A batch is closed once it holds max_batch_size items or max_wait seconds after its
+    first item arrived. predict_batch runs on one executor thread, so the event loop
+    keeps accepting requests (which form the next batch) while a batch is predicted.
+    If it raises, the batch is re-run one item at a time, so an error only reaches the
+    requests that cause it.
+    """
+
+    def __init__(
+        self, predict_batch, max_batch_size=MAX_BATCH_SIZE, max_wait=MAX_BATCH_WAIT_MS / 1000
+    ):
+        self.predict_batch = predict_batch
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.queue = None
+        self.task = None
+        self.executor = None
+        self.batches = 0
+        self.requests = 0
+        self.fallbacks = 0
+
+    async def start(self):
+        self.queue = asyncio.Queue()
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='predict')
+        self.task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        self.task.cancel()
+        try:
+            await self.task
+        except asyncio.CancelledError:
+            pass
+        self.executor.shutdown(wait=True)
+
+    async def submit(self, item):
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((item, future))
+        return await future
+
+    async def next_batch(self):
+        loop = asyncio.get_running_loop()
+        batch = [await self.queue.get()]
+        deadline = loop.time() + self.max_wait
+
+        while len(batch) < self.max_batch_size:
+            if not self.queue.empty():
+                batch.append(self.queue.get_nowait())
+                continue
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+
+        return batch
+
+    def predict_isolated(self, items):
+        try:
+            return self.predict_batch(items)
+        except Exception as e:  # pylint: disable=broad-exception-caught
+            if len(items) == 1:
+                return [e]
+            self.fallbacks += 1
+            print(f"Batch prediction failed, falling back to per-request prediction: {e}")
+
+        results = []
+        for item in items:
+            try:
+                results.extend(self.predict_batch([item]))
+            except Exception as e:  # pylint: disable=broad-exception-caught
+                results.append(e)
+        return results
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = await self.next_batch()
+            items = [item for item, _ in batch]
+            self.batches += 1
+            self.requests += len(batch)
+
+            results = await loop.run_in_executor(self.executor, self.predict_isolated, items)
+
+            for (_, future), result in zip(batch, results):
+                # The request may have been cancelled (client went away) in the meantime
+                if future.done():
+                    continue
+                if isinstance(result, Exception):
+                    future.set_exception(result)
+                else:
+                    future.set_result(result)
+
+    def stats(self):
+        return {
+            'batches': self.batches,
+            'requests': self.requests,
+            'fallbacks': self.fallbacks,
+            'mean_batch_size': self.requests / self.batches if self.batches else 0.0,
+        }
+
+
+def load_model_service():
+    return model.init(PREDICTIONS_STREAM_NAME, RUN_ID, MODEL_ID, TEST_RUN)
+
+
+def create_app(load_service=load_model_service, **batcher_options):
+    """Build the FastAPI app; the model is loaded in the background after startup.
+
+    GET /health fails only if the model could not be loaded, GET /ready succeeds once
+    it is loaded, and POST /predict takes a ride event ({"ride": {...}, "ride_id": ...})
+    and returns the same prediction event the Lambda publishes.
+    """
+    state = {'service': None, 'error': None}
+
+    def predict_batch(rides):
+        # Predictions are answered synchronously, not published to the callbacks
+        service = state['service']
+        with service.metrics.stage('total'):
+            versions, predictions = service.predict_routed(rides)
+        service.metrics.count('records', len(rides))
+        service.metrics.count('predictions', sum(p is not None for p in predictions))
+        service.metrics.flush(version=service.run_id)
+        return [
+            (
+                service.prediction_event(ride_id, prediction, version)
+                if prediction is not None
+                else None
+            )
+            for (ride_id, _), version, prediction in zip(rides, versions, predictions)
+        ]
+
+    batcher = MicroBatcher(predict_batch, **batcher_options)
+
+    async def load():
+        try:
+            state['service'] = await asyncio.to_thread(load_service)
+        except Exception as e:  # pylint: disable=broad-exception-caught
+            traceback.print_exc()
+            state['error'] = e
+
+    @asynccontextmanager
+    async def lifespan(_):
+        await batcher.start()
+        loading = asyncio.create_task(load())
+        yield
+        loading.cancel()
+        await batcher.stop()
+
+    app = FastAPI(title='ride-duration-prediction', lifespan=lifespan)
+    app.state.batcher = batcher
+
+    @app.get('/health')
+    async def health():
+        if state['error'] is not None:
+            return JSONResponse({'status': 'failed', 'error': str(state['error'])}, 503)
+        return {'status': 'ok'}
+
+    @app.get('/ready')
+    async def ready():
+        if state['service'] is None:
+            return JSONResponse({'status': 'loading'}, 503)
+        service = state['service']
+        return {
+            'status': 'ready',
+            'version': service.run_id,
+            'routing': service.registry.routing.describe(),
+            **batcher.stats(),
+        }
+
+    @app.post('/predict')
+    async def predict(ride_event: dict = Body(...)):
+        if state['service'] is None:
+            return JSONResponse({'error': 'Model is not loaded yet'}, 503)
+
+        ride = ride_event.get('ride')
+        if not isinstance(ride, Mapping):
+            return JSONResponse({'error': 'Request must have a "ride" object'}, 400)
+
+        prediction_event = await batcher.submit((ride_event.get('ride_id'), ride))
+        if prediction_event is None:
+            return JSONResponse({'error': 'Ride could not be scored'}, 422)
+        return prediction_event
+
+    return app
+
+
+if __name__ == "__main__":
+    uvicorn.run(create_app(), host=SERVER_HOST, port=SERVER_PORT)
@@ -0,0 +1,75 @@
+import binascii
+import json
+from collections.abc import Mapping
+
+# Use orjson when it is installed: it parses the decoded bytes directly and is several
+# times faster than the stdlib. Its JSONDecodeError subclasses json.JSONDecodeError.
+try:
+    import orjson
+
+    json_loads = orjson.loads  # pylint: disable=no-member
+    JSON_BACKEND = 'orjson'
+except ImportError:
+    # json.loads also accepts bytes, which avoids an explicit .decode('utf-8') copy
+    json_loads = json.loads
+    JSON_BACKEND = 'json'
+
+
+def decode_ride_event(encoded_data):
+    ride_event = json_loads(binascii.a2b_base64(encoded_data))
+
+    if not isinstance(ride_event, Mapping):
+        raise ValueError(f"Ride event must be a JSON object, got {type(ride_event).__name__}")
+
+    ride_data = ride_event['ride']
+    ride_id = ride_event['ride_id']
+
+    if not isinstance(ride_data, Mapping):
+        raise ValueError(f"Ride must be a JSON object, got {type(ride_data).__name__}")
+
+    return ride_id, ride_data
+
+
+def decode_records(records, errors=(json.JSONDecodeError, KeyError, ValueError)):
+    """Decode and validate a whole list of Kinesis records in a single pass.
+
+    Returns (rides, failures): rides is a list of (index, ride_id, ride_data) and
+    failures a list of (index, exception) for the records that could not be decoded,
+    so one bad record never fails the whole batch.
+    """
+    rides = []
+    failures = []
+
+    for index, record in enumerate(records):
+        try:
+            ride_id, ride_data = decode_ride_event(record['kinesis']['data'])
+            rides.append((index, ride_id, ride_data))
+        except errors as e:
+            failures.append((index, e))
+
+    return rides, failures
+
+
+def batch_item_failures(records, failed):
+    """Lambda batchItemFailures for the records at the `failed` indices.
+
+    Every later record with the same partition key as a failed one is reported (and
+    should be held back) too, so the retry Lambda makes from the lowest failed sequence
+    number delivers each key in its original order. Returns (held_back, failures): the indices of
+    every reported record and the batchItemFailures entries in record order. Records
+    without a partition key carry no ordering and only hold back themselves.
+    """
+    held_back = set()
+    failed_keys = set()
+    for index, record in enumerate(records):
+        key = record.get('kinesis', {}).get('partitionKey')
+        if index in failed or key in failed_keys:
+            held_back.add(index)
+            if key is not None:
+                failed_keys.add(key)
+
+    failures = [
+        {'itemIdentifier': records[index].get('kinesis', {}).get('sequenceNumber')}
+        for index in sorted(held_back)
+    ]
+    return held_back, failures
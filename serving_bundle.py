@@ -0,0 +1,151 @@
+import hashlib
+import json
+import mmap
+import struct
+import time
+
+import numpy as np
+
+from feature_encoder import FeatureEncoder, SortedLookup
+
+BUNDLE_FILENAME = 'serving.bundle'
+BUNDLE_MAGIC = b'RDSB'
+BUNDLE_FORMAT_VERSION = 1
+
+# Magic, format version and header length, followed by the JSON header
+PREAMBLE = struct.Struct('<4sHI')
+# Sections start on aligned offsets so numpy views of the mapped file are aligned
+ALIGNMENT = 64
+
+
+class BundleError(Exception):
+    pass
+
+
+def aligned(offset):
+    return -(-offset // ALIGNMENT) * ALIGNMENT
+
+
+def encoder_sections(encoder):
+    # Each categorical field becomes a sorted array of UTF-8 keys and their columns
+    sections = {}
+    for field, lookup in encoder.categorical.items():
+        items = sorted((value.encode('utf-8'), column) for value, column in lookup.items())
+        keys = np.array([key for key, _ in items], dtype=np.bytes_)
+        sections[f'categorical/{field}/keys'] = keys
+        sections[f'categorical/{field}/columns'] = np.array(
+            [column for _, column in items], dtype=np.int32
+        )
+    return sections
+
+
+def write_bundle(path, booster, encoder, metadata=None):
+    """Write the booster (UBJSON) and the encoder vocabulary (flat arrays) to one file.
+
+    The layout is a fixed preamble, a JSON header with the metadata and the offset,
+    length, dtype, shape and sha256 of every section, then the aligned sections.
+    Nothing in it is pickled.
+    """
+    arrays = encoder_sections(encoder)
+    payloads = {name: array.tobytes() for name, array in arrays.items()}
+    payloads['booster'] = bytes(booster.save_raw(raw_format='ubj'))
+
+    sections = {}
+    offset = 0
+    for name, payload in payloads.items():
+        sections[name] = {
+            'offset': offset,
+            'length': len(payload),
+            'sha256': hashlib.sha256(payload).hexdigest(),
+        }
+        if name in arrays:
+            sections[name].update(
+                {'dtype': arrays[name].dtype.str, 'shape': list(arrays[name].shape)}
+            )
+        offset = aligned(offset + len(payload))
+
+    header = {
+        'format_version': BUNDLE_FORMAT_VERSION,
+        'created_at': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        'encoder': {
+            'categorical_fields': list(encoder.categorical),
+            'numerical': encoder.numerical,
+            'n_features': encoder.n_features,
+            'dtype': np.dtype(encoder.dtype).name,
+        },
+        'metadata': metadata or {},
+        'sections': sections,
+    }
+    header_bytes = json.dumps(header).encode('utf-8')
+    data_start = aligned(PREAMBLE.size + len(header_bytes))
+
+    with open(path, 'wb') as f:
+        f.write(PREAMBLE.pack(BUNDLE_MAGIC, BUNDLE_FORMAT_VERSION, len(header_bytes)))
+        f.write(header_bytes)
+        for name, payload in payloads.items():
+            f.seek(data_start + sections[name]['offset'])
+            f.write(payload)
+    return path
+
+
+class ServingBundle:
+    """A serving bundle mapped read-only into memory.
+
+    The encoder's vocabulary arrays are views of the mapping, so pages are only read
+    when lookups touch them and are shared between processes serving the same file.
+    """
+
+    def __init__(self, path, verify=True):
+        with open(path, 'rb') as f:
+            self.buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        if len(self.buffer) < PREAMBLE.size:
+            raise BundleError(f"{path} is too short to be a serving bundle")
+        magic, version, header_length = PREAMBLE.unpack_from(self.buffer)
+        if magic != BUNDLE_MAGIC:
+            raise BundleError(f"{path} is not a serving bundle")
+        if version > BUNDLE_FORMAT_VERSION:
+            raise BundleError(
+                f"{path} has format version {version}, "
+                f"this code reads up to {BUNDLE_FORMAT_VERSION}"
+            )
+
+        header_end = PREAMBLE.size + header_length
+        self.header = json.loads(self.buffer[PREAMBLE.size : header_end])
+        self.data_start = aligned(header_end)
+        self.metadata = self.header['metadata']
+
+        if verify:
+            self.verify()
+
+    def section(self, name):
+        section = self.header['sections'][name]
+        start = self.data_start + section['offset']
+        return memoryview(self.buffer)[start : start + section['length']]
+
+    def verify(self):
+        for name, section in self.header['sections'].items():
+            if hashlib.sha256(self.section(name)).hexdigest() != section['sha256']:
+                raise BundleError(f"Checksum mismatch in serving bundle section {name}")
+
+    def array(self, name):
+        section = self.header['sections'][name]
+        return np.frombuffer(self.section(name), dtype=np.dtype(section['dtype'])).reshape(
+            section['shape']
+        )
+
+    def encoder(self):
+        spec = self.header['encoder']
+        categorical = {
+            field: SortedLookup(
+                self.array(f'categorical/{field}/keys'),
+                self.array(f'categorical/{field}/columns'),
+            )
+            for field in spec['categorical_fields']
+        }
+        dtype = np.dtype(spec['dtype']).type
+        return FeatureEncoder(categorical, spec['numerical'], spec['n_features'], dtype)
+
+    def booster_buffer(self):
+        # XGBoost parses the model into its own structures, so this is the one copy made
+        return bytearray(self.section('booster'))
@@ -0,0 +1,120 @@
+# pylint: disable=invalid-name
+
+import numpy as np
+import xgboost as xgb
+from pyarrow import feather
+from sklearn.feature_extraction import DictVectorizer
+
+from feature_encoder import FeatureEncoder
+from training_performance import PhaseTimer, training_params, uses_quantile_dmatrix
+
+categorical_features = ['PU_DO']
+numerical_features = ['trip_distance']
+target = 'duration'
+
+# Rows per encoded chunk: bounds the size of each CSR batch handed to XGBoost
+DEFAULT_CHUNK_ROWS = 250_000
+
+
+def build_vocabulary(paths, categorical=None, numerical=None):
+    """Collect the DictVectorizer feature names of the cached months in one scan.
+
+    Only the feature columns are read, memory-mapped and one record batch at a time,
+    so the vocabulary can be fixed before any month is encoded.
+    """
+    categorical = categorical_features if categorical is None else categorical
+    numerical = numerical_features if numerical is None else numerical
+    feature_names = set()
+
+    for path in paths:
+        table = feather.read_table(path, columns=categorical + numerical, memory_map=True)
+        if table.num_rows == 0:
+            continue
+
+        for field in categorical:
+            for chunk in table.column(field).chunks:
+                # The Arrow dictionary can hold unused categories, only keep values that occur
+                values = chunk.unique().dictionary_decode().drop_null().to_pylist()
+                feature_names.update(f'{field}={value}' for value in values)
+        feature_names.update(numerical)
+
+    return feature_names
+
+
+def dict_vectorizer_from_feature_names(feature_names):
+    # Same fitted state as DictVectorizer.fit() on the rows the feature names came from
+    dv = DictVectorizer(sparse=True)
+    dv.feature_names_ = sorted(feature_names)
+    dv.vocabulary_ = {name: column for column, name in enumerate(dv.feature_names_)}
+    return dv
+
+
+def fit_encoder(paths):
+    dv = dict_vectorizer_from_feature_names(build_vocabulary(paths))
+    return dv, FeatureEncoder.from_dict_vectorizer(dv)
+
+
+def iter_chunks(paths, encoder, chunk_rows=DEFAULT_CHUNK_ROWS, timer=None):
+    """Yield (X, y) per chunk of the cached months, X encoded straight to CSR.
+
+    Reading and encoding are timed as the 'load' and 'encode' phases of timer.
+    """
+    timer = timer if timer is not None else PhaseTimer()
+    columns = list(dict.fromkeys([*encoder.fields, target]))
+
+    for path in paths:
+        table = feather.read_table(path, columns=columns, memory_map=True)
+        for batch in table.to_batches(max_chunksize=chunk_rows):
+            if batch.num_rows == 0:
+                continue
+            with timer.phase('load'):
+                df = batch.to_pandas()
+            with timer.phase('encode'):
+                X = encoder.transform_frame(df)
+            yield X, df[target].to_numpy(dtype=np.float64)
+
+
+class ChunkIter(xgb.DataIter):
+    """Feed XGBoost one encoded chunk at a time through its external-memory interface.
+
+    make_chunks returns a fresh iterator of (X, y) and is called again on every
+    reset(), so no more than one chunk is held in memory while the DMatrix pages
+    are built under cache_prefix.
+    """
+
+    def __init__(self, make_chunks, cache_prefix):
+        self.make_chunks = make_chunks
+        self.chunks = None
+        super().__init__(cache_prefix=cache_prefix)
+
+    def next(self, input_data):
+        if self.chunks is None:
+            self.chunks = self.make_chunks()
+
+        chunk = next(self.chunks, None)
+        if chunk is None:
+            return False
+
+        X, y = chunk
+        input_data(data=X, label=y)
+        return True
+
+    def reset(self):
+        self.chunks = None
+
+
+def build_dmatrix(make_chunks, cache_prefix, params=None, quantile=True):
+    """Stream the chunks into an external-memory DMatrix.
+
+    With quantile=True and the 'hist' tree method the chunks are quantized once while
+    streaming. Evaluation sets should pass quantile=False: predicting on a quantile
+    DMatrix every boosting round is an order of magnitude slower than on raw pages.
+    """
+    params = training_params() if params is None else params
+    batch_iter = ChunkIter(make_chunks, cache_prefix)
+
+    if quantile and uses_quantile_dmatrix(params):
+        return xgb.ExtMemQuantileDMatrix(
+            batch_iter, max_bin=params.get('max_bin'), nthread=params.get('nthread')
+        )
+    return xgb.DMatrix(batch_iter, nthread=params.get('nthread'))
@@ -0,0 +1,133 @@
+import os
+import pickle
+import threading
+from pathlib import Path
+from unittest.mock import patch
+
+import artifact_cache
+import model
+from artifact_cache import ArtifactCache
+
+
+def create_artifact(tmp_path, name="preprocessor.b", content=b"artifact-bytes"):
+    """Create a downloaded artifact file to be cached"""
+    path = tmp_path / "downloads" / name
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_bytes(content)
+    return path
+
+
+def test_put_then_get_returns_cached_copy(tmp_path):
+    """Test that a cached artifact is returned from the cache directory"""
+    cache = ArtifactCache(tmp_path / "cache", max_bytes=1024)
+    source = create_artifact(tmp_path)
+
+    cached_path = cache.put("run", "model", "preprocessor", source)
+
+    assert cached_path.startswith(str(tmp_path / "cache"))
+    assert cache.get("run", "model", "preprocessor") == cached_path
+    assert Path(cached_path).read_bytes() == b"artifact-bytes"
+    assert cache.get("run", "other-model", "preprocessor") is None
+
+
+def test_get_caches_directories(tmp_path):
+    """Test that directory artifacts such as an mlflow model are cached file by file"""
+    cache = ArtifactCache(tmp_path / "cache", max_bytes=1024)
+    source_dir = tmp_path / "downloads" / "artifacts"
+    (source_dir / "nested").mkdir(parents=True)
+    (source_dir / "MLmodel").write_text("flavors: {}")
+    (source_dir / "nested" / "model.xgb").write_bytes(b"booster")
+
+    cached_dir = cache.put("run", "model", "pyfunc_model", source_dir)
+
+    assert cache.get("run", "model", "pyfunc_model") == cached_dir
+    assert (Path(cached_dir) / "nested" / "model.xgb").read_bytes() == b"booster"
+
+
+def test_corrupted_artifact_is_discarded(tmp_path):
+    """Test that an artifact failing its checksum is treated as a cache miss"""
+    cache = ArtifactCache(tmp_path / "cache", max_bytes=1024)
+    cached_path = cache.put("run", "model", "preprocessor", create_artifact(tmp_path))
+
+    with open(cached_path, 'wb') as f:
+        f.write(b"truncated")
+
+    assert cache.get("run", "model", "preprocessor") is None
+    assert not os.path.exists(cached_path)
+
+
+def test_cache_hits_check_sizes_and_hash_only_when_verifying(tmp_path):
+    """Test that reads skip re-hashing unless verify_reads is set, which catches same-size edits"""
+    cache = ArtifactCache(tmp_path / "cache", max_bytes=1024)
+    cached_path = cache.put("run", "model", "preprocessor", create_artifact(tmp_path))
+    with open(cached_path, 'wb') as f:
+        f.write(b"ARTIFACT-BYTES")
+
+    with patch.object(artifact_cache, 'file_digest', side_effect=AssertionError) as digest:
+        assert cache.get("run", "model", "preprocessor") == cached_path
+    digest.assert_not_called()
+
+    verifying = ArtifactCache(tmp_path / "cache", max_bytes=1024, verify_reads=True)
+    assert verifying.get("run", "model", "preprocessor") is None
+
+
+def test_put_replaces_artifact_without_readers_seeing_a_miss(tmp_path):
+    """Test that concurrent gets always find a complete version while it is being replaced"""
+    cache = ArtifactCache(tmp_path / "cache", max_bytes=10**6)
+    sources = [create_artifact(tmp_path, name=f"v{i}.b", content=b"x" * (i + 1)) for i in range(20)]
+    cache.put("run", "model", "preprocessor", sources[0])
+    misses = []
+
+    def read():
+        for _ in range(200):
+            if cache.get("run", "model", "preprocessor") is None:
+                misses.append(1)
+
+    readers = [threading.Thread(target=read) for _ in range(4)]
+    for reader in readers:
+        reader.start()
+    for source in sources[1:]:
+        cache.put("run", "model", "preprocessor", source)
+    for reader in readers:
+        reader.join()
+
+    assert not misses
+    cached_path = cache.get("run", "model", "preprocessor")
+    assert Path(cached_path).read_bytes() == b"x" * 20
+    versions = [p for p in cache.entry_dir("run", "model").iterdir() if p.is_dir()]
+    assert len(versions) == 1
+
+
+def test_least_recently_used_entries_are_evicted(tmp_path):
+    """Test that the cache stays under max_bytes by evicting the oldest entries"""
+    cache = ArtifactCache(tmp_path / "cache", max_bytes=250)
+    source = create_artifact(tmp_path, content=b"x" * 100)
+
+    cache.put("run-1", "model", "preprocessor", source)
+    cache.put("run-2", "model", "preprocessor", source)
+    os.utime(cache.entry_dir("run-1", "model") / "manifest.json", (0, 0))
+    cache.put("run-3", "model", "preprocessor", source)
+
+    assert cache.get("run-1", "model", "preprocessor") is None
+    assert cache.get("run-2", "model", "preprocessor") is not None
+    assert cache.get("run-3", "model", "preprocessor") is not None
+
+
+def test_load_model_skips_s3_on_cache_hit(tmp_path):
+    """Test that a second load_model call is served entirely from the local cache"""
+    preprocessor_path = create_artifact(tmp_path, content=pickle.dumps({"vocabulary": 1}))
+    booster_path = create_artifact(tmp_path, name="run.json", content=b"{}")
+    downloads = {
+        model.get_booster_location("run"): str(booster_path),
+        model.get_model_location("run", "model")[1]: str(preprocessor_path),
+    }
+
+    with (
+        patch.object(model, 'artifact_cache_dir', str(tmp_path / "cache")),
+        patch('mlflow.artifacts.download_artifacts', side_effect=downloads.get) as download,
+        patch('xgboost.Booster'),
+    ):
+        model.load_model("run", "model", backend='booster', encoder_mode='dict_vectorizer')
+        model.load_model("run", "model", backend='booster', encoder_mode='dict_vectorizer')
+
+    assert download.call_count == 2
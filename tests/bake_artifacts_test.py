@@ -0,0 +1,130 @@
+import pickle
+from unittest.mock import patch
+
+import pytest
+import xgboost as xgb
+from scipy import sparse
+from sklearn.feature_extraction import DictVectorizer
+
+import bake_artifacts
+import model
+from drift_monitoring import Profile
+from feature_encoder import FeatureEncoder, SortedLookup
+
+
+def create_downloads(tmp_path):
+    """Save a small booster and preprocessor the way train_model does"""
+    features = sparse.csr_matrix([[1.0, 2.5], [0.0, 10.0], [1.0, 7.0]])
+    booster = xgb.train({'max_depth': 2}, xgb.DMatrix(features, label=[5.0, 30.0, 20.0]), 3)
+    booster.save_model(tmp_path / "run.json")
+    dv = DictVectorizer()
+    dv.fit([{'PU_DO': '43_151', 'trip_distance': 1.0}])
+    (tmp_path / "preprocessor.b").write_bytes(pickle.dumps(dv))
+    Profile().save(tmp_path / "reference_profile.json")
+
+    downloads = {
+        model.get_booster_location("run"): str(tmp_path / "run.json"),
+        model.get_model_location("run", "model")[1]: str(tmp_path / "preprocessor.b"),
+        model.get_reference_profile_location("run"): str(tmp_path / "reference_profile.json"),
+    }
+    return features, booster, downloads
+
+
+def test_bake_embeds_booster_as_ubjson(tmp_path):
+    """Test that baking stores the booster in UBJSON alongside the preprocessor"""
+    _, _, downloads = create_downloads(tmp_path)
+
+    with patch('mlflow.artifacts.download_artifacts', side_effect=downloads.get):
+        bake_artifacts.bake("run", "model", output_dir=tmp_path / "embedded")
+
+    with patch.object(model, 'embedded_artifacts_dir', str(tmp_path / "embedded")):
+        assert model.get_embedded_artifact("run", "model", "booster").endswith("run.ubj")
+        assert model.get_embedded_artifact("run", "model", "preprocessor") is not None
+        assert model.get_embedded_artifact("run", "model", "feature_encoder") is not None
+        assert model.get_embedded_artifact("run", "model", "serving_bundle") is not None
+        assert model.get_embedded_artifact("run", "model", "reference_profile") is not None
+        assert model.get_embedded_artifact("other-run", "model", "preprocessor") is None
+
+
+def test_load_model_prefers_embedded_artifacts(tmp_path):
+    """Test that embedded artifacts are loaded without touching S3"""
+    features, booster, downloads = create_downloads(tmp_path)
+    with patch('mlflow.artifacts.download_artifacts', side_effect=downloads.get):
+        bake_artifacts.bake("run", "model", output_dir=tmp_path / "embedded")
+
+    with (
+        patch.object(model, 'embedded_artifacts_dir', str(tmp_path / "embedded")),
+        patch.object(model, 'artifact_cache_dir', ''),
+        patch('mlflow.artifacts.download_artifacts', side_effect=OSError("no S3")) as download,
+    ):
+        loaded_model, preprocessor = model.load_model("run", "model", backend='booster')
+
+    download.assert_not_called()
+    assert isinstance(preprocessor, FeatureEncoder)
+    assert isinstance(preprocessor.categorical['PU_DO'], SortedLookup)
+    assert preprocessor.n_features == 2
+    assert loaded_model.predict(features).tolist() == pytest.approx(
+        booster.predict(xgb.DMatrix(features)).tolist()
+    )
+
+
+def test_baked_run_without_reference_profile_skips_remote_lookup(tmp_path):
+    """Test that a profile missing at bake time is recorded and never fetched at startup"""
+    _, _, downloads = create_downloads(tmp_path)
+    del downloads[model.get_reference_profile_location("run")]
+    with patch('mlflow.artifacts.download_artifacts', side_effect=downloads.get):
+        bake_artifacts.bake("run", "model", output_dir=tmp_path / "embedded")
+
+    with (
+        patch.object(model, 'embedded_artifacts_dir', str(tmp_path / "embedded")),
+        patch.object(model, 'artifact_cache_dir', ''),
+        patch('mlflow.artifacts.download_artifacts', side_effect=OSError("no S3")) as download,
+    ):
+        assert model.load_drift_monitor("run", "model") is None
+        assert model.load_drift_monitor("other-run", "model") is None
+
+    assert download.call_count == 1
+    assert download.call_args[0][0] == model.get_reference_profile_location("other-run")
+
+
+def test_baked_pyfunc_only_run_skips_remote_booster_and_bundle_lookups(tmp_path):
+    """Test that a run baked without a native booster loads its pyfunc model with no downloads"""
+    _, _, downloads = create_downloads(tmp_path)
+    del downloads[model.get_booster_location("run")]
+    pyfunc_dir = tmp_path / "pyfunc"
+    pyfunc_dir.mkdir()
+    (pyfunc_dir / "MLmodel").write_text("flavors: {}")
+    downloads[model.get_model_location("run", "model")[0]] = str(pyfunc_dir)
+    with patch('mlflow.artifacts.download_artifacts', side_effect=downloads.get):
+        bake_artifacts.bake("run", "model", output_dir=tmp_path / "embedded")
+
+    with (
+        patch.object(model, 'embedded_artifacts_dir', str(tmp_path / "embedded")),
+        patch.object(model, 'artifact_cache_dir', ''),
+        patch('mlflow.artifacts.download_artifacts', side_effect=OSError("no S3")) as download,
+        patch('mlflow.pyfunc.load_model', return_value='pyfunc model') as load_pyfunc,
+    ):
+        assert model.load_booster("run", "model") is None
+        assert model.load_bundle("run", "model") is None
+        loaded_model, preprocessor = model.load_model("run", "model", backend='booster')
+
+    download.assert_not_called()
+    assert loaded_model == 'pyfunc model'
+    assert load_pyfunc.call_args[0][0].startswith(str(tmp_path / "embedded"))
+    assert isinstance(preprocessor, FeatureEncoder)
+
+
+def test_load_model_without_bundle_uses_separate_artifacts(tmp_path):
+    """Test that MODEL_FORMAT=separate skips the serving bundle"""
+    _, _, downloads = create_downloads(tmp_path)
+    with patch('mlflow.artifacts.download_artifacts', side_effect=downloads.get):
+        bake_artifacts.bake("run", "model", output_dir=tmp_path / "embedded")
+
+    with (
+        patch.object(model, 'embedded_artifacts_dir', str(tmp_path / "embedded")),
+        patch.object(model, 'artifact_cache_dir', ''),
+        patch.object(model, 'model_format', 'separate'),
+    ):
+        _, preprocessor = model.load_model("run", "model", backend='booster')
+
+    assert isinstance(preprocessor.categorical['PU_DO'], dict)
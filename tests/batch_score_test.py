@@ -0,0 +1,85 @@
+from unittest.mock import patch
+
+import numpy as np
+import pandas as pd
+import pytest
+import xgboost as xgb
+from pyarrow import parquet as pq
+from sklearn.feature_extraction import DictVectorizer
+
+import batch_score
+import model
+from artifact_cache import ArtifactCache
+from feature_encoder import FeatureEncoder
+from tests.trip_features_test import create_raw_trips
+from trip_features import prepare_trips
+
+RUN_ID = 'batch-run'
+MODEL_ID = 'm-batch'
+
+
+def ride_dicts(df):
+    pu_do = df['PULocationID'].astype(str) + '_' + df['DOLocationID'].astype(str)
+    return pd.DataFrame({'PU_DO': pu_do, 'trip_distance': df['trip_distance']}).to_dict(
+        orient='records'
+    )
+
+
+@pytest.fixture(name="embedded_model")
+def fixture_embedded_model(tmp_path):
+    """Train a small booster and embed it with its encoder the way bake_artifacts does"""
+    trips = prepare_trips(create_raw_trips(count=3000, seed=1))
+    dv = DictVectorizer(sparse=True)
+    features = dv.fit_transform(ride_dicts(trips))
+    booster = xgb.train({'max_depth': 4}, xgb.DMatrix(features, label=trips['duration']), 10)
+
+    booster.save_model(tmp_path / 'booster.ubj')
+    FeatureEncoder.from_dict_vectorizer(dv).save(tmp_path / 'feature_encoder.npz')
+    embedded = ArtifactCache(tmp_path / 'embedded', max_bytes=float('inf'))
+    embedded.put(RUN_ID, MODEL_ID, 'booster', tmp_path / 'booster.ubj')
+    embedded.put(RUN_ID, MODEL_ID, 'feature_encoder', tmp_path / 'feature_encoder.npz')
+
+    with (
+        patch.object(model, 'embedded_artifacts_dir', str(tmp_path / 'embedded')),
+        patch.object(model, 'artifact_cache_dir', ''),
+    ):
+        yield booster, dv
+
+
+@pytest.mark.parametrize("n_workers", [1, 2])
+def test_run_scores_every_row_in_order(tmp_path, embedded_model, n_workers):
+    """Test that batch scoring matches the model on every raw row, in input order"""
+    booster, dv = embedded_model
+    raw = create_raw_trips(count=2500, seed=2).reset_index(drop=True)
+    raw.to_parquet(tmp_path / 'rides.parquet', row_group_size=1000)
+    output_path = tmp_path / 'predictions.parquet'
+
+    n_rows = batch_score.run(
+        tmp_path / 'rides.parquet',
+        output_path,
+        run_id=RUN_ID,
+        model_id=MODEL_ID,
+        n_workers=n_workers,
+        batch_rows=700,
+    )
+
+    scored = pq.read_table(output_path).to_pandas()
+    expected = booster.inplace_predict(dv.transform(ride_dicts(raw)))
+    assert n_rows == len(raw)
+    assert list(scored.columns) == [*raw.columns, 'predicted_duration', 'model_version']
+    pd.testing.assert_series_equal(scored['trip_distance'], raw['trip_distance'])
+    np.testing.assert_allclose(scored['predicted_duration'], expected, rtol=1e-6)
+    assert set(scored['model_version']) == {RUN_ID}
+
+
+def test_predict_frame_uses_existing_pu_do(embedded_model):
+    """Test that an input that already has PU_DO is scored without the location IDs"""
+    booster, dv = embedded_model
+    batch_score.init_worker(RUN_ID, MODEL_ID)
+    rides = [{'PU_DO': '43_151', 'trip_distance': 18.4}, {'PU_DO': '1_2', 'trip_distance': 3.0}]
+
+    predictions = batch_score.predict_frame(
+        batch_score.worker_state['model'], batch_score.worker_state['encoder'], pd.DataFrame(rides)
+    )
+
+    np.testing.assert_allclose(predictions, booster.inplace_predict(dv.transform(rides)))
@@ -0,0 +1,166 @@
+import base64
+import json
+
+import numpy as np
+import pytest
+
+from drift_monitoring import DriftMonitor, Profile, QuantileSketch, compare, numeric_values
+from model_registry import ModelRegistry, ModelVersion
+from tests.model_test import (
+    FakeClock,
+    create_kinesis_batch_event,
+    create_mock_model,
+    create_mock_preprocessor,
+    create_model_service,
+    create_sample_ride_event,
+)
+
+
+def create_profile(values, column='trip_distance'):
+    profile = Profile(columns=[column])
+    profile.update({column: values})
+    return profile
+
+
+def test_sketch_quantiles_are_within_bucket_error():
+    """Test that sketch quantiles stay within the bucket growth of the exact percentiles"""
+    values = np.random.default_rng(1).lognormal(1.0, 0.8, size=100_000)
+    sketch = QuantileSketch()
+    for chunk in np.array_split(values, 10):
+        sketch.update(chunk)
+
+    quantiles = sketch.quantiles()
+
+    assert sketch.count == len(values)
+    for name, q in [('p5', 5), ('p50', 50), ('p95', 95)]:
+        assert quantiles[name] == pytest.approx(np.percentile(values, q), rel=0.02)
+
+
+def test_sketch_keeps_out_of_range_values_in_edge_buckets():
+    """Test that zero, negative and huge values land in the edge buckets and nan is skipped"""
+    sketch = QuantileSketch()
+    sketch.update([0.0, -3.0, np.nan, 1e9])
+
+    assert sketch.count == 3
+    assert sketch.counts[0] == 2
+    assert sketch.counts[-1] == 1
+
+
+def test_compare_scores_shifted_distribution():
+    """Test that PSI and KS stay near zero for a new sample and grow for a shifted one"""
+    rng = np.random.default_rng(2)
+    reference = create_profile(rng.lognormal(1.0, 0.8, size=50_000))
+    same = create_profile(rng.lognormal(1.0, 0.8, size=5_000))
+    shifted = create_profile(rng.lognormal(1.3, 0.8, size=5_000))
+
+    stable = compare(reference, same)['trip_distance']
+    drifted = compare(reference, shifted)['trip_distance']
+
+    assert stable['count'] == 5_000
+    assert stable['psi'] < 0.02
+    assert stable['ks'] < 0.05
+    assert drifted['psi'] > 0.1
+    assert drifted['ks'] > 0.1
+    assert drifted['quantiles']['p50'] > drifted['reference_quantiles']['p50']
+
+
+def test_compare_skips_columns_without_observations():
+    """Test that columns missing from either profile are left out of the comparison"""
+    reference = create_profile([1.0, 2.0, 3.0])
+
+    assert not compare(reference, Profile(columns=['trip_distance']))
+    assert not compare(reference, create_profile([1.0], column='predicted_duration'))
+
+
+def test_profile_round_trip(tmp_path):
+    """Test that a saved and loaded profile has identical sketches"""
+    profile = Profile()
+    profile.update({'trip_distance': [1.0, 2.5, 40.0], 'predicted_duration': [5.0, 12.0, 60.0]})
+    path = tmp_path / "reference_profile.json"
+    profile.save(path)
+
+    loaded = Profile.load(path)
+
+    assert loaded.to_dict() == profile.to_dict()
+    assert compare(profile, loaded)['trip_distance']['psi'] == 0.0
+
+
+def test_profile_from_newer_format_is_rejected(tmp_path):
+    """Test that a profile written by a newer format version is refused"""
+    path = tmp_path / "reference_profile.json"
+    path.write_text(json.dumps({'format_version': 99, 'columns': {}}))
+
+    with pytest.raises(ValueError, match='version 99'):
+        Profile.load(path)
+
+
+def test_numeric_values_ignores_invalid_features():
+    """Test that None, strings and bools become nan instead of numbers"""
+    values = numeric_values([1.5, None, '3', True, 2])
+
+    np.testing.assert_array_equal(values, [1.5, np.nan, np.nan, np.nan, 2.0])
+
+
+def test_monitor_reports_once_per_interval():
+    """Test that drift is emitted when the window has run for report_interval, then reset"""
+    reference = Profile()
+    reference.update({'trip_distance': [1.0, 2.0, 3.0], 'predicted_duration': [5.0, 8.0, 11.0]})
+    clock, lines = FakeClock(), []
+    monitor = DriftMonitor(reference, 'run-1', report_interval=60.0, clock=clock, emit=lines.append)
+
+    monitor.update([{'trip_distance': 2.0}, {}], [8.0, None])
+    clock.now = 61.0
+    monitor.update([{'trip_distance': 3.0}], [11.0])
+
+    assert len(lines) == 1
+    drift = json.loads(lines[0])['drift']
+    assert drift['version'] == 'run-1'
+    assert drift['window_seconds'] == 61.0
+    assert drift['columns']['trip_distance']['count'] == 2
+    assert drift['columns']['predicted_duration']['count'] == 2
+    assert monitor.live.sketches['trip_distance'].count == 0
+
+
+def test_model_service_monitors_each_version_across_swaps():
+    """Test that rides go to the monitor of the version serving them, also after a hot swap"""
+    reference = create_profile([10.0, 18.4, 25.0])
+    monitors = {
+        run_id: DriftMonitor(reference, run_id, report_interval=float('inf'))
+        for run_id in ('old', 'new')
+    }
+    registry = ModelRegistry(
+        ModelVersion(
+            create_mock_model(), create_mock_preprocessor(), 'old', 'model', monitors['old']
+        ),
+        loader=lambda run_id, model_id: (create_mock_model(), create_mock_preprocessor()),
+        monitor_loader=lambda run_id, model_id: monitors[run_id],
+    )
+    model_service = create_model_service(registry=registry)
+    event = create_kinesis_batch_event([create_sample_ride_event(f"ride_{i}") for i in range(3)])
+
+    model_service.lambda_handler(event)
+    registry.reload('new', 'model', wait=True)
+    model_service.lambda_handler(event)
+    model_service.lambda_handler(event)
+
+    assert monitors['old'].live.sketches['trip_distance'].count == 3
+    assert monitors['new'].live.sketches['trip_distance'].count == 6
+
+
+def test_model_service_monitors_only_delivered_records():
+    """Test that failed and held back records are left out until they are delivered"""
+    monitor = DriftMonitor(create_profile([10.0, 18.4, 25.0]), 'run', report_interval=float('inf'))
+    registry = ModelRegistry(
+        ModelVersion(create_mock_model(), create_mock_preprocessor(), 'run', 'model', monitor)
+    )
+    model_service = create_model_service(registry=registry)
+    model_service.test_run = False
+    event = create_kinesis_batch_event([create_sample_ride_event(f"ride_{i}") for i in range(4)])
+    event['Records'][1]['kinesis']['data'] = base64.b64encode(b"not json").decode()
+    for i, (record, key) in enumerate(zip(event['Records'], ['a', 'b', 'a', 'b'])):
+        record['kinesis'].update({'partitionKey': key, 'sequenceNumber': f'{i:03d}'})
+
+    result = model_service.lambda_handler(event)
+
+    assert len(result['predictions']) == 2
+    assert monitor.live.sketches['trip_distance'].count == 2
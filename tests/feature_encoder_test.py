@@ -0,0 +1,126 @@
+import random
+
+import numpy as np
+import pytest
+from sklearn.feature_extraction import DictVectorizer
+
+from feature_encoder import FeatureEncoder
+
+
+def create_training_rides(count=2000, seed=42):
+    """Create rides shaped like the create_X input in duration_prediction"""
+    rng = random.Random(seed)
+    return [
+        {
+            'PU_DO': f"{rng.randint(1, 265)}_{rng.randint(1, 265)}",
+            'trip_distance': round(rng.uniform(0, 40), 2),
+        }
+        for _ in range(count)
+    ]
+
+
+@pytest.fixture(name="dv", scope="module")
+def fixture_dv():
+    dv = DictVectorizer(sparse=True)
+    dv.fit(create_training_rides())
+    return dv
+
+
+def assert_same_matrix(actual, expected):
+    """Assert two CSR matrices are identical down to their underlying arrays"""
+    assert actual.shape == expected.shape
+    assert actual.dtype == expected.dtype
+    assert actual.indptr.tolist() == expected.indptr.tolist()
+    assert actual.indices.tolist() == expected.indices.tolist()
+    np.testing.assert_array_equal(actual.data, expected.data)
+
+
+def test_parity_on_training_shaped_batch(dv):
+    """Test that a batch of regular rides encodes exactly like DictVectorizer"""
+    encoder = FeatureEncoder.from_dict_vectorizer(dv)
+    rides = create_training_rides(count=500, seed=7)
+
+    assert encoder.n_features == len(dv.vocabulary_)
+    assert_same_matrix(encoder.transform(rides), dv.transform(rides))
+
+
+def test_parity_on_single_ride(dv):
+    """Test that a single ride dict encodes to the same one-row matrix"""
+    encoder = FeatureEncoder.from_dict_vectorizer(dv)
+    ride = create_training_rides(count=1)[0]
+
+    assert_same_matrix(encoder.transform(ride), dv.transform(ride))
+
+
+@pytest.mark.parametrize(
+    "rides",
+    [
+        [{'PU_DO': 'unknown_pair', 'trip_distance': 3.2}],
+        [{'trip_distance': 7}, {'PU_DO': create_training_rides(count=1)[0]['PU_DO']}],
+        [{'PULocationID': 20, 'DOLocationID': 24, 'trip_distance': 20}],
+        [{'PU_DO': 43151, 'trip_distance': None}],
+        [{'PU_DO': None, 'trip_distance': True}, {}],
+        [{'PU_DO': [create_training_rides(count=1)[0]['PU_DO'], 'unknown'], 'trip_distance': 1}],
+        [{'PU_DO': '1_1', 'trip_distance': np.float32(2.5)}, {'trip_distance': 'a string'}],
+        [{'trip_distance': -5.0, 'extra': 'ignored'}, {'trip_distance': 0}],
+    ],
+)
+def test_parity_on_edge_cases(dv, rides):
+    """Test unknown, missing, None, numeric-as-category and iterable values"""
+    encoder = FeatureEncoder.from_dict_vectorizer(dv)
+
+    assert_same_matrix(encoder.transform(rides), dv.transform(rides))
+
+
+def test_errors_match_dict_vectorizer(dv):
+    """Test that invalid input raises the same exception types as DictVectorizer"""
+    encoder = FeatureEncoder.from_dict_vectorizer(dv)
+
+    for rides, error in [
+        ([], ValueError),
+        ([{'PU_DO': {'nested': 'dict'}}], TypeError),
+        ([{'PU_DO': ['1_1', 3]}], TypeError),
+    ]:
+        with pytest.raises(error):
+            dv.transform(rides)
+        with pytest.raises(error):
+            encoder.transform(rides)
+
+
+def test_unknown_fields_are_skipped_without_validation(dv):
+    """Test that invalid values in unknown fields are ignored, where DictVectorizer raises"""
+    encoder = FeatureEncoder.from_dict_vectorizer(dv)
+    rides = [
+        {'trip_distance': 2.0, 'extra': {'nested': 'dict'}},
+        {'trip_distance': 3.0, 'extra': ['1_1', 3]},
+    ]
+
+    for ride in rides:
+        with pytest.raises(TypeError):
+            dv.transform([ride])
+    assert_same_matrix(
+        encoder.transform(rides),
+        dv.transform([{'trip_distance': ride['trip_distance']} for ride in rides]),
+    )
+
+
+def test_parity_for_unsorted_vectorizer():
+    """Test parity when the vectorizer was fitted with sort=False"""
+    dv = DictVectorizer(sparse=True, sort=False)
+    dv.fit(create_training_rides(count=300))
+    encoder = FeatureEncoder.from_dict_vectorizer(dv)
+    rides = create_training_rides(count=300, seed=3)
+
+    assert_same_matrix(encoder.transform(rides), dv.transform(rides))
+
+
+def test_save_and_load_round_trip(dv, tmp_path):
+    """Test that the exported flat arrays reload into an equivalent encoder"""
+    encoder = FeatureEncoder.from_dict_vectorizer(dv)
+    encoder.save(tmp_path / "encoder.npz")
+    loaded = FeatureEncoder.load(tmp_path / "encoder.npz")
+    rides = create_training_rides(count=200, seed=11)
+
+    assert loaded.categorical == encoder.categorical
+    assert loaded.numerical == encoder.numerical
+    assert_same_matrix(loaded.transform(rides), dv.transform(rides))
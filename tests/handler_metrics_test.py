@@ -0,0 +1,114 @@
+import json
+import random
+
+import pytest
+
+from handler_metrics import HANDLER_COUNTS, HANDLER_STAGES, HandlerMetrics, LatencyHistogram
+from tests.model_test import (
+    FakeClock,
+    create_kinesis_batch_event,
+    create_model_service,
+    create_sample_ride_event,
+)
+
+
+def create_metrics(**kwargs):
+    lines = []
+    metrics = HandlerMetrics(emit=lambda line: lines.append(json.loads(line)), **kwargs)
+    return metrics, lines
+
+
+def test_histogram_percentiles_are_within_bucket_error():
+    """Test that percentiles of a known distribution are within the bucket growth"""
+    rng = random.Random(0)
+    values = sorted(rng.lognormvariate(-5, 1) for _ in range(10000))
+    histogram = LatencyHistogram()
+    for value in values:
+        histogram.record(value)
+
+    percentiles = histogram.percentiles((50, 95, 99))
+
+    for q in (50, 95, 99):
+        exact = values[int(q / 100 * len(values)) - 1]
+        assert percentiles[q] == pytest.approx(exact, rel=0.1)
+    assert histogram.percentiles((100,))[100] == values[-1]
+
+
+def test_flush_emits_an_emf_line_and_resets():
+    """Test that a flush emits one EMF line with every metric declared, then starts over"""
+    metrics, lines = create_metrics(clock=FakeClock(tick=0.001), summary_interval=0)
+
+    with metrics.stage('decode'):
+        pass
+    with metrics.stage('predict'):
+        pass
+    with metrics.stage('predict'):
+        pass
+    metrics.count('records', 3)
+    metrics.flush(version='run-1')
+    metrics.flush(version='run-1')
+
+    assert len(lines) == 2
+    first, second = lines[0], lines[1]
+    declared = [m['Name'] for m in first['_aws']['CloudWatchMetrics'][0]['Metrics']]
+    assert declared == [f'{stage}_ms' for stage in HANDLER_STAGES] + list(HANDLER_COUNTS)
+    assert first['_aws']['CloudWatchMetrics'][0]['Dimensions'] == [['Service']]
+    assert first['decode_ms'] == pytest.approx(1.0)
+    assert first['predict_ms'] == pytest.approx(2.0)
+    assert first['records'] == 3
+    assert first['version'] == 'run-1'
+    assert first['latency_percentiles_ms']['predict']['p99'] == pytest.approx(2.0, rel=0.1)
+    assert second['predict_ms'] == 0.0
+    assert second['records'] == 0
+
+
+def test_percentiles_are_only_summarized_every_interval():
+    metrics, lines = create_metrics(summary_interval=60)
+
+    metrics.flush()
+    metrics.flush()
+
+    assert 'latency_percentiles_ms' in lines[0]
+    assert 'latency_percentiles_ms' not in lines[1]
+
+
+def test_suspended_stages_and_counts_are_not_recorded():
+    metrics, lines = create_metrics(clock=FakeClock(tick=0.001))
+
+    with metrics.stage('shadow'), metrics.suspended():
+        with metrics.stage('predict'):
+            pass
+        metrics.count('prediction_errors')
+    metrics.flush()
+
+    assert lines[0]['shadow_ms'] > 0
+    assert lines[0]['predict_ms'] == 0.0
+    assert lines[0]['prediction_errors'] == 0
+
+
+def test_lambda_handler_reports_stages_and_record_counts():
+    """Test that an invocation reports its stage timings, batch size and record errors"""
+    metrics, lines = create_metrics()
+    model_service = create_model_service(metrics=metrics)
+    model_service.test_run = False
+    event = create_kinesis_batch_event([create_sample_ride_event(ride_id=i) for i in range(3)])
+    event['Records'].append({'kinesis': {'data': 'not base64 json'}})
+
+    model_service.lambda_handler(event)
+
+    assert len(lines) == 1
+    line = lines[0]
+    assert (line['records'], line['predictions'], line['decode_errors']) == (4, 3, 1)
+    for stage in ('decode', 'encode', 'predict', 'callbacks', 'total'):
+        assert line[f'{stage}_ms'] > 0
+    assert line['total_ms'] >= line['decode_ms'] + line['predict_ms']
+    assert line['version'] == 'test-run-id'
+
+
+def test_metrics_are_disabled_by_default(capsys):
+    """Test that a ModelService without metrics emits nothing"""
+    model_service = create_model_service()
+
+    model_service.lambda_handler(create_kinesis_batch_event([create_sample_ride_event()]))
+
+    assert '_aws' not in capsys.readouterr().out
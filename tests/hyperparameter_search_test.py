@@ -0,0 +1,87 @@
+import mlflow
+import numpy as np
+import pytest
+import xgboost as xgb
+
+import hyperparameter_search
+from hyperparameter_search import (
+    MedianPruning,
+    median_curve,
+    sample_params,
+    search_space,
+)
+from tests.streaming_training_test import write_cached_months
+
+
+def test_sample_params_stays_within_search_space():
+    """Test that every sampled value falls inside its range and is reproducible by seed"""
+    samples = [sample_params(np.random.default_rng(seed)) for seed in range(50)]
+
+    for params in samples:
+        for name, (kind, low, high) in search_space.items():
+            assert low <= params[name] <= high
+            assert isinstance(params[name], int if kind == 'int' else float)
+    assert sample_params(np.random.default_rng(7)) == sample_params(np.random.default_rng(7))
+
+
+def test_sample_params_rejects_unknown_kind():
+    """Test that a typo in the search space is reported"""
+    with pytest.raises(ValueError, match="normal"):
+        sample_params(np.random.default_rng(0), {'max_depth': ('normal', 1, 2)})
+
+
+def test_median_curve_uses_trials_that_reached_each_round():
+    """Test that shorter (pruned or early-stopped) curves only count where they exist"""
+    assert median_curve([]) == []
+    assert median_curve([[3.0, 2.0, 1.0], [5.0, 4.0], [4.0]]) == [4.0, 3.0, 1.0]
+
+
+def test_median_pruning_stops_trials_worse_than_reference():
+    """Test that a trial is stopped at the first post-warmup round above the median"""
+    rng = np.random.default_rng(0)
+    dtrain = xgb.DMatrix(rng.random((200, 3)), label=rng.random(200))
+    pruning = MedianPruning(reference=[0.0] * 20, warmup_rounds=3)
+    evals_result = {}
+
+    xgb.train(
+        {'max_depth': 2},
+        dtrain,
+        num_boost_round=20,
+        evals=[(dtrain, 'validation')],
+        evals_result=evals_result,
+        callbacks=[pruning],
+        verbose_eval=False,
+    )
+
+    assert pruning.pruned_at == 3
+    assert len(evals_result['validation']['rmse']) == 4
+
+
+def test_run_logs_trials_as_nested_runs(tmp_path):
+    """Test the search end to end on a process pool with a local MLflow store"""
+    paths = write_cached_months(tmp_path, count=2)
+    mlflow.set_tracking_uri(f'file:{tmp_path / "mlruns"}')
+    mlflow.set_experiment('nyc-taxi-experiment')
+
+    try:
+        results = hyperparameter_search.run(
+            train_paths=paths[:1],
+            val_paths=paths[1:],
+            n_trials=6,
+            n_workers=2,
+            num_boost_round=10,
+            warmup_rounds=2,
+        )
+        runs = mlflow.search_runs(experiment_names=['nyc-taxi-experiment'])
+    finally:
+        mlflow.set_tracking_uri(None)
+
+    assert [result['rmse'] for result in results] == sorted(result['rmse'] for result in results)
+    assert sorted(result['trial'] for result in results) == list(range(6))
+
+    parent = runs[runs['tags.mlflow.runName'] == 'hyperparameter-search']
+    trials = runs[runs['tags.mlflow.parentRunId'].notna()]
+    assert len(parent) == 1
+    assert len(trials) == 6
+    assert set(trials['tags.mlflow.parentRunId']) == set(parent['run_id'])
+    assert parent['metrics.rmse'].iloc[0] == results[0]['rmse']
@@ -0,0 +1,213 @@
+import json
+from unittest.mock import MagicMock
+
+from botocore.exceptions import ClientError
+
+from kinesis_consumer import CheckpointStore, KinesisConsumer, to_lambda_record
+from record_decoder import decode_records
+from tests.model_test import create_model_service, create_sample_ride_event
+
+
+class FakeKinesis:
+    """In-memory stand-in for the shard APIs; a shard is closed once fully read"""
+
+    def __init__(self, shards):
+        self.shards = shards
+        self.iterator_requests = []
+        self.errors = []
+
+    def list_shards(self, **_):
+        return {'Shards': [{'ShardId': shard_id} for shard_id in self.shards]}
+
+    def get_shard_iterator(self, **kwargs):
+        shard_id = kwargs['ShardId']
+        iterator_type = kwargs['ShardIteratorType']
+        self.iterator_requests.append((shard_id, iterator_type))
+
+        sequence_numbers = [record['SequenceNumber'] for record in self.shards[shard_id]]
+        if iterator_type == 'AFTER_SEQUENCE_NUMBER':
+            position = sequence_numbers.index(kwargs['StartingSequenceNumber']) + 1
+        elif iterator_type == 'AT_SEQUENCE_NUMBER':
+            position = sequence_numbers.index(kwargs['StartingSequenceNumber'])
+        elif iterator_type == 'LATEST':
+            position = len(sequence_numbers)
+        else:
+            position = 0
+        return {'ShardIterator': f'{shard_id}:{position}'}
+
+    def get_records(self, **kwargs):
+        if self.errors:
+            raise self.errors.pop(0)
+
+        shard_id, position = kwargs['ShardIterator'].rsplit(':', 1)
+        position = int(position)
+        records = self.shards[shard_id][position : position + kwargs['Limit']]
+        next_position = position + len(records)
+        closed = next_position >= len(self.shards[shard_id])
+
+        return {
+            'Records': records,
+            'NextShardIterator': None if closed else f'{shard_id}:{next_position}',
+            'MillisBehindLatest': 0 if closed else 1000,
+        }
+
+
+def create_records(count, shard='0'):
+    return [
+        {
+            'Data': json.dumps(create_sample_ride_event(ride_id=f'ride-{shard}-{i}')).encode(),
+            'PartitionKey': f'ride-{shard}-{i}',
+            'SequenceNumber': f'{shard}{i:05d}',
+        }
+        for i in range(count)
+    ]
+
+
+def client_error(code):
+    return ClientError({'Error': {'Code': code, 'Message': code}}, 'GetRecords')
+
+
+def create_consumer(tmp_path, kinesis, model_service=None, **kwargs):
+    received = []
+    if model_service is None:
+        model_service = create_model_service(callbacks=[received.append])
+    consumer = KinesisConsumer(
+        model_service,
+        kinesis,
+        'ride-events',
+        CheckpointStore(tmp_path / 'checkpoints.json'),
+        batch_size=2,
+        poll_interval=0,
+        starting_position='TRIM_HORIZON',
+        **kwargs,
+    )
+    return consumer, received
+
+
+def test_to_lambda_record_decodes_like_a_lambda_event():
+    """Test that polled records go through the same decoder as Lambda events"""
+    record = create_records(1)[0]
+
+    rides, failures = decode_records([to_lambda_record(record)])
+
+    assert not failures
+    assert rides == [(0, 'ride-0-0', create_sample_ride_event()['ride'])]
+
+
+def test_consume_shard_predicts_and_checkpoints_every_batch(tmp_path):
+    """Test that every record reaches the callbacks and the shard is checkpointed"""
+    kinesis = FakeKinesis({'shard-0': create_records(5)})
+    consumer, received = create_consumer(tmp_path, kinesis)
+
+    consumer.consume_shard('shard-0')
+
+    assert [event['prediction']['ride_id'] for event in received] == [
+        f'ride-0-{i}' for i in range(5)
+    ]
+    assert CheckpointStore(tmp_path / 'checkpoints.json').get('shard-0') == '000004'
+    assert consumer.closed_shards == {'shard-0'}
+
+
+def test_consume_shard_resumes_after_checkpoint(tmp_path):
+    """Test that a restarted consumer skips the records it already handled"""
+    kinesis = FakeKinesis({'shard-0': create_records(5)})
+    CheckpointStore(tmp_path / 'checkpoints.json').set('shard-0', '000002')
+    consumer, received = create_consumer(tmp_path, kinesis)
+
+    consumer.consume_shard('shard-0')
+
+    assert kinesis.iterator_requests == [('shard-0', 'AFTER_SEQUENCE_NUMBER')]
+    assert [event['prediction']['ride_id'] for event in received] == ['ride-0-3', 'ride-0-4']
+
+
+def test_failed_batch_is_read_again_from_checkpoint(tmp_path):
+    """Test that a batch whose handling fails is not checkpointed and is retried"""
+    kinesis = FakeKinesis({'shard-0': create_records(3)})
+    model_service = MagicMock()
+    model_service.lambda_handler.side_effect = [RuntimeError("delivery failed"), None, None]
+    consumer, _ = create_consumer(tmp_path, kinesis, model_service=model_service)
+
+    consumer.consume_shard('shard-0')
+
+    batches = [
+        [record['kinesis']['sequenceNumber'] for record in call.args[0]['Records']]
+        for call in model_service.lambda_handler.call_args_list
+    ]
+    assert batches == [['000000', '000001'], ['000000', '000001'], ['000002']]
+    assert consumer.checkpoints.get('shard-0') == '000002'
+
+
+def failing_handler(failures_per_call):
+    """lambda_handler stand-in reporting the given sequence numbers as failed, call by call"""
+    model_service = MagicMock()
+    model_service.lambda_handler.side_effect = [
+        {'predictions': [], 'batchItemFailures': [{'itemIdentifier': s} for s in failures]}
+        for failures in failures_per_call
+    ]
+    return model_service
+
+
+def handled_batches(model_service):
+    return [
+        [record['kinesis']['sequenceNumber'] for record in call.args[0]['Records']]
+        for call in model_service.lambda_handler.call_args_list
+    ]
+
+
+def test_reported_failures_are_read_again_from_the_first_failed_record(tmp_path):
+    """Test that the shard is checkpointed up to the first failure and re-read from it"""
+    kinesis = FakeKinesis({'shard-0': create_records(3)})
+    model_service = failing_handler([['000001'], [], []])
+    consumer, _ = create_consumer(tmp_path, kinesis, model_service=model_service)
+
+    consumer.consume_shard('shard-0')
+
+    assert handled_batches(model_service) == [['000000', '000001'], ['000001', '000002']]
+    assert consumer.checkpoints.get('shard-0') == '000002'
+
+
+def test_reported_failures_are_skipped_after_max_retries(tmp_path):
+    kinesis = FakeKinesis({'shard-0': create_records(3)})
+    model_service = failing_handler([['000000']] * 3 + [[]])
+    consumer, _ = create_consumer(
+        tmp_path, kinesis, model_service=model_service, max_record_retries=2
+    )
+
+    consumer.consume_shard('shard-0')
+
+    assert handled_batches(model_service) == [['000000', '000001']] * 3 + [['000002']]
+    assert consumer.checkpoints.get('shard-0') == '000002'
+
+
+def test_consume_shard_recovers_from_throttling_and_expired_iterators(tmp_path):
+    """Test that throttling is retried and an expired iterator is requested again"""
+    kinesis = FakeKinesis({'shard-0': create_records(3)})
+    kinesis.errors = [
+        client_error('ProvisionedThroughputExceededException'),
+        client_error('ExpiredIteratorException'),
+    ]
+    consumer, received = create_consumer(tmp_path, kinesis)
+
+    consumer.consume_shard('shard-0')
+
+    assert len(received) == 3
+    assert len(kinesis.iterator_requests) == 2
+
+
+def test_start_workers_runs_one_worker_per_shard(tmp_path):
+    """Test that each shard gets its own worker and closed shards are not restarted"""
+    kinesis = FakeKinesis({'shard-0': create_records(3, '0'), 'shard-1': create_records(4, '1')})
+    consumer, received = create_consumer(tmp_path, kinesis)
+
+    consumer.start_workers()
+    for worker in consumer.workers.values():
+        worker.join(timeout=5)
+    workers = dict(consumer.workers)
+    consumer.start_workers()
+
+    assert sorted(event['prediction']['ride_id'] for event in received) == sorted(
+        [f'ride-0-{i}' for i in range(3)] + [f'ride-1-{i}' for i in range(4)]
+    )
+    assert consumer.closed_shards == {'shard-0', 'shard-1'}
+    assert consumer.workers == workers
+    assert consumer.checkpoints.get('shard-1') == '100003'
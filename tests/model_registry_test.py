@@ -0,0 +1,187 @@
+import json
+import threading
+
+import pytest
+
+import model
+from model_registry import ModelRegistry, ModelVersion, Routing
+from tests.model_test import (
+    FakeClock,
+    create_kinesis_batch_event,
+    create_mock_model,
+    create_mock_preprocessor,
+    create_sample_ride_event,
+)
+
+
+def create_version(run_id, return_value=15.5):
+    return ModelVersion(
+        create_mock_model(return_value), create_mock_preprocessor(), run_id, f'm-{run_id}'
+    )
+
+
+def version_loader(return_values, loaded=None):
+    """Loader returning a mock model that predicts return_values[run_id]"""
+
+    def loader(run_id, _):
+        if loaded is not None:
+            loaded.append(run_id)
+        return create_mock_model(return_values[run_id]), create_mock_preprocessor()
+
+    return loader
+
+
+def create_service(registry):
+    return model.ModelService(None, None, None, None, True, registry=registry)
+
+
+def test_routing_splits_traffic_by_weight_and_ride_id():
+    """Test that rides are split by weight and always go to the same version"""
+    stable, canary = create_version('stable'), create_version('canary')
+    routing = Routing([(stable, 9), (canary, 1)])
+
+    routed = [routing.route(f'ride-{i}') for i in range(10000)]
+
+    assert routing.primary is stable
+    assert 0.08 < routed.count(canary) / len(routed) < 0.12
+    assert [routing.route(f'ride-{i}') for i in range(100)] == routed[:100]
+
+
+@pytest.mark.parametrize("weights", [[], [-1, 2], [0, 0]])
+def test_routing_rejects_invalid_weights(weights):
+    versions = [create_version(f'run-{i}') for i in range(len(weights))]
+    with pytest.raises(ValueError):
+        Routing(list(zip(versions, weights)))
+
+
+def test_set_routing_requires_loaded_versions():
+    registry = ModelRegistry(create_version('stable'))
+
+    with pytest.raises(ValueError, match='not loaded'):
+        registry.set_routing([(('other', 'm-other'), 1.0)])
+
+    assert registry.primary.run_id == 'stable'
+
+
+def test_reload_swaps_model_without_interrupting_predictions():
+    """Test that the old version keeps serving while the new one loads in the background"""
+    release = threading.Event()
+    loader = version_loader({'new': 30.0})
+
+    def slow_loader(run_id, model_id):
+        release.wait(timeout=5)
+        return loader(run_id, model_id)
+
+    registry = ModelRegistry(create_version('old', 10.0), loader=slow_loader)
+    service = create_service(registry)
+    event = create_kinesis_batch_event([create_sample_ride_event(ride_id=i) for i in range(3)])
+
+    future = registry.reload('new', 'm-new')
+    during = service.lambda_handler(event)['predictions']
+    release.set()
+    future.result(timeout=5)
+    after = service.lambda_handler(event)['predictions']
+
+    assert {(p['version'], p['prediction']['predicted_duration']) for p in during} == {
+        ('old', 10.0)
+    }
+    assert {(p['version'], p['prediction']['predicted_duration']) for p in after} == {('new', 30.0)}
+    assert list(registry.versions) == [('new', 'm-new')]
+
+
+def test_canary_events_carry_the_version_that_served_them():
+    """Test that each prediction event reports the version that produced it"""
+    registry = ModelRegistry(
+        create_version('stable', 10.0), loader=version_loader({'canary': 20.0})
+    )
+    registry.apply([(('stable', 'm-stable'), 0.5), (('canary', 'm-canary'), 0.5)])
+    service = create_service(registry)
+    event = create_kinesis_batch_event([create_sample_ride_event(ride_id=i) for i in range(200)])
+
+    predictions = service.lambda_handler(event)['predictions']
+
+    served = {(p['version'], p['prediction']['predicted_duration']) for p in predictions}
+    assert served == {('stable', 10.0), ('canary', 20.0)}
+    for prediction in predictions:
+        ride_id = prediction['prediction']['ride_id']
+        assert prediction['version'] == registry.routing.route(ride_id).run_id
+
+
+def test_shadow_version_is_compared_but_never_served(capsys):
+    """Test that a shadow version predicts every ride without affecting the response"""
+    registry = ModelRegistry(create_version('stable', 10.0), loader=version_loader({'next': 12.5}))
+    registry.apply([(('stable', 'm-stable'), 1.0)], shadow=('next', 'm-next'))
+    service = create_service(registry)
+
+    versions, predictions = service.predict_routed(
+        [(i, create_sample_ride_event()['ride']) for i in range(4)]
+    )
+
+    assert [version.run_id for version in versions] == ['stable'] * 4
+    assert predictions == [10.0] * 4
+    shadow_line = [line for line in capsys.readouterr().out.splitlines() if '"shadow"' in line]
+    assert json.loads(shadow_line[0])['shadow'] == {
+        'version': 'next',
+        'rides': 4,
+        'mean_abs_diff': 2.5,
+        'max_abs_diff': 2.5,
+    }
+
+
+def test_refresh_follows_the_routing_config(tmp_path):
+    """Test that config changes are picked up once per refresh interval"""
+    config_path = tmp_path / 'routing.json'
+    clock = FakeClock()
+    loaded = []
+    registry = ModelRegistry(
+        create_version('v1'),
+        loader=version_loader({'v2': 2.0, 'v3': 3.0}, loaded),
+        config_reader=lambda: model.read_routing_config(str(config_path)),
+        refresh_interval=60,
+        clock=clock,
+    )
+
+    registry.refresh(block=True)
+    assert registry.primary.run_id == 'v1'
+
+    config_path.write_text(json.dumps({'versions': [{'run_id': 'v2', 'model_id': 'm-v2'}]}))
+    clock.now = 30
+    registry.refresh(block=True)
+    assert registry.primary.run_id == 'v1'
+
+    clock.now = 60
+    registry.refresh(block=True)
+    assert registry.primary.run_id == 'v2'
+
+    clock.now = 120
+    registry.refresh(block=True)
+    assert loaded == ['v2']
+
+
+def test_failed_load_keeps_current_routing_and_is_retried(tmp_path):
+    config_path = tmp_path / 'routing.json'
+    config_path.write_text(json.dumps({'versions': [{'run_id': 'v2', 'model_id': 'm-v2'}]}))
+    clock = FakeClock()
+    attempts = []
+
+    def flaky_loader(run_id, model_id):
+        attempts.append(run_id)
+        if len(attempts) == 1:
+            raise RuntimeError("artifact not found")
+        return version_loader({'v2': 2.0})(run_id, model_id)
+
+    registry = ModelRegistry(
+        create_version('v1'),
+        loader=flaky_loader,
+        config_reader=lambda: model.read_routing_config(str(config_path)),
+        refresh_interval=60,
+        clock=clock,
+    )
+
+    registry.refresh(block=True)
+    assert registry.primary.run_id == 'v1'
+
+    clock.now = 60
+    registry.refresh(block=True)
+    assert registry.primary.run_id == 'v2'
+    assert attempts == ['v2', 'v2']
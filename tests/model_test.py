@@ -1,34 +1,66 @@
 import base64
 import json
 import os
+import pickle
+import subprocess
+import sys
+import threading
+import time
 from unittest.mock import MagicMock, patch
 
 import pytest
+import xgboost as xgb
+from botocore.exceptions import ClientError, EndpointConnectionError
 from scipy import sparse
+from sklearn.feature_extraction import DictVectorizer
 
 import model
+from callback_dispatcher import CallbackDispatcher
+from feature_encoder import FeatureEncoder
+
+
+class FakeClock:
+    """Clock returning now, advanced by tick on every reading when tick is set"""
+
+    def __init__(self, now=0.0, tick=0.0):
+        self.now = now
+        self.tick = tick
+
+    def __call__(self):
+        self.now += self.tick
+        return self.now
 
 
 # Factory functions for test setup
 def create_mock_model(return_value=15.5):
-    """Create a mock model with configurable return value"""
+    """Create a mock model returning one prediction per feature row"""
     mock = MagicMock()
-    mock.predict.return_value = [return_value]
+    mock.predict.side_effect = lambda features: [return_value] * features.shape[0]
     return mock
 
 
 def create_mock_preprocessor(feature_count=100):
-    """Create a mock preprocessor with configurable feature count"""
+    """Create a mock preprocessor returning one feature row per ride"""
     mock = MagicMock()
-    mock.transform.return_value = sparse.csr_matrix([[1, 0, 1] + [0] * feature_count])
+    row = [1, 0, 1] + [0] * feature_count
+
+    def transform(rides):
+        n_rows = 1 if isinstance(rides, dict) else len(rides)
+        return sparse.csr_matrix([row] * n_rows)
+
+    mock.transform.side_effect = transform
     return mock
 
 
-def create_model_service(mock_model=None, preprocessor=None, run_id="test-run-id"):
+def create_model_service(
+    mock_model=None, preprocessor=None, run_id="test-run-id", **service_kwargs
+):
     """Create a ModelService with sensible defaults for testing"""
     mock_model = mock_model or create_mock_model()
     mock_preprocessor = preprocessor or create_mock_preprocessor()
-    return model.ModelService(mock_model, mock_preprocessor, run_id, "test-model-id", True)
+    return model.ModelService(
+        mock_model, mock_preprocessor, run_id, "test-model-id", True, **service_kwargs
+    )
 
 
 def create_kinesis_event(ride_event):
@@ -37,6 +69,12 @@ def create_kinesis_event(ride_event):
     return {'Records': [{'kinesis': {'data': encoded_data}}]}
 
 
+def create_kinesis_batch_event(ride_events):
+    """Create a Kinesis event with one record per ride event dictionary"""
+    records = [create_kinesis_event(ride_event)['Records'][0] for ride_event in ride_events]
+    return {'Records': records}
+
+
 def create_sample_ride_data():
     """Create standard ride data for testing"""
     return {"PU_DO": "43_151", "trip_distance": 18.4}
@@ -193,6 +231,7 @@ def test_lambda_handler_missing_ride_fields():
 def test_process_features_negative_trip_distance():
     """Test process_features with negative trip distance"""
     negative_preprocessor = create_mock_preprocessor()
+    negative_preprocessor.transform.side_effect = None
     negative_preprocessor.transform.return_value = sparse.csr_matrix([[1, 0, -1] + [0] * 100])
 
     model_service = create_model_service(mock_model=None, preprocessor=negative_preprocessor)
@@ -252,3 +291,434 @@ def test_base64_decode_with_ride_event():
     assert 'ride_id' in decoded
     assert decoded['ride']['PU_DO'] == "43_151"
     assert decoded['ride']['trip_distance'] == 18.4
+
+
+def test_lambda_handler_batches_transform_and_predict():
+    """Test that a multi-record event is encoded and predicted in a single call each"""
+    mock_model = create_mock_model()
+    preprocessor = create_mock_preprocessor()
+    model_service = create_model_service(mock_model=mock_model, preprocessor=preprocessor)
+    event = create_kinesis_batch_event([create_sample_ride_event(f"ride_{i}") for i in range(5)])
+
+    result = model_service.lambda_handler(event)
+
+    assert preprocessor.transform.call_count == 1
+    assert mock_model.predict.call_count == 1
+    assert len(preprocessor.transform.call_args[0][0]) == 5
+    ride_ids = [p['prediction']['ride_id'] for p in result['predictions']]
+    assert ride_ids == [f"ride_{i}" for i in range(5)]
+
+
+def test_lambda_handler_batch_fans_out_to_callbacks():
+    """Test that every prediction in a batch is passed to the callbacks in order"""
+    callback = MagicMock()
+    model_service = create_model_service(callbacks=[callback])
+    event = create_kinesis_batch_event([create_sample_ride_event(f"ride_{i}") for i in range(3)])
+
+    result = model_service.lambda_handler(event)
+
+    assert callback.call_count == 3
+    assert [c[0][0] for c in callback.call_args_list] == result['predictions']
+
+
+def test_lambda_handler_batch_isolates_bad_records():
+    """Test that outside test mode a bad record is dropped and the rest still predicted"""
+    model_service = create_model_service()
+    model_service.test_run = False
+
+    event = create_kinesis_batch_event([create_sample_ride_event(f"ride_{i}") for i in range(3)])
+    event['Records'].insert(1, {'kinesis': {'data': base64.b64encode(b"not json").decode()}})
+    event['Records'].append(create_kinesis_event({"ride_id": "missing_ride"})['Records'][0])
+
+    result = model_service.lambda_handler(event)
+
+    ride_ids = [p['prediction']['ride_id'] for p in result['predictions']]
+    assert ride_ids == ["ride_0", "ride_1", "ride_2"]
+
+
+def test_lambda_handler_batch_falls_back_to_per_record_prediction():
+    """Test that a failing batch transform is retried record by record"""
+    preprocessor = create_mock_preprocessor()
+    row_transform = preprocessor.transform.side_effect
+
+    def transform(rides):
+        rides_list = [rides] if isinstance(rides, dict) else rides
+        if any(ride['trip_distance'] < 0 for ride in rides_list):
+            raise ValueError("negative trip distance")
+        return row_transform(rides)
+
+    preprocessor.transform.side_effect = transform
+    model_service = create_model_service(preprocessor=preprocessor)
+    model_service.test_run = False
+
+    ride_events = [create_sample_ride_event(f"ride_{i}") for i in range(3)]
+    ride_events[1]['ride']['trip_distance'] = -1.0
+    result = model_service.lambda_handler(create_kinesis_batch_event(ride_events))
+
+    ride_ids = [p['prediction']['ride_id'] for p in result['predictions']]
+    assert ride_ids == ["ride_0", "ride_2"]
+
+
+def test_lambda_handler_reports_failed_records_in_partition_key_order():
+    """Test that failed records and the later records of their keys are reported for retry"""
+    callback = MagicMock()
+    model_service = create_model_service(callbacks=[callback])
+    model_service.test_run = False
+    ride_events = [create_sample_ride_event(f"ride_{i}") for i in range(5)]
+    event = create_kinesis_batch_event(ride_events)
+    event['Records'][1]['kinesis']['data'] = base64.b64encode(b"not json").decode()
+    for i, (record, key) in enumerate(zip(event['Records'], ['a', 'b', 'a', 'b', 'c'])):
+        record['kinesis'].update({'partitionKey': key, 'sequenceNumber': f'{i:03d}'})
+
+    result = model_service.lambda_handler(event)
+
+    assert result['batchItemFailures'] == [{'itemIdentifier': '001'}, {'itemIdentifier': '003'}]
+    delivered = [c[0][0]['prediction']['ride_id'] for c in callback.call_args_list]
+    assert delivered == ["ride_0", "ride_2", "ride_4"]
+    assert [p['prediction']['ride_id'] for p in result['predictions']] == delivered
+
+
+def test_lambda_handler_reports_records_with_non_scalar_features():
+    """Test that a ride with a non-scalar feature only fails its own record and key"""
+    dv = DictVectorizer()
+    dv.fit([create_sample_ride_data()])
+    model_service = model.ModelService(
+        create_mock_model(), FeatureEncoder.from_dict_vectorizer(dv), "run", "model", False
+    )
+    ride_events = [create_sample_ride_event(f"ride_{i}") for i in range(4)]
+    ride_events[1]['ride']['PU_DO'] = {'x': 1}
+    event = create_kinesis_batch_event(ride_events)
+    for i, (record, key) in enumerate(zip(event['Records'], ['a', 'b', 'a', 'b'])):
+        record['kinesis'].update({'partitionKey': key, 'sequenceNumber': f'{i:03d}'})
+
+    result = model_service.lambda_handler(event)
+
+    assert result['batchItemFailures'] == [{'itemIdentifier': '001'}, {'itemIdentifier': '003'}]
+    assert [p['prediction']['ride_id'] for p in result['predictions']] == ["ride_0", "ride_2"]
+
+
+def test_booster_model_matches_dmatrix_predictions():
+    """Test that the native booster fast path matches predictions through a DMatrix"""
+    features = sparse.csr_matrix(
+        [[1.0, 0.0, 2.5], [0.0, 1.0, 10.0], [1.0, 0.0, 7.0], [0.0, 1.0, 1.0]]
+    )
+    labels = [5.0, 30.0, 20.0, 4.0]
+    booster = xgb.train({'max_depth': 2}, xgb.DMatrix(features, label=labels), num_boost_round=5)
+
+    booster_model = model.BoosterModel(booster)
+    model_service = model.ModelService(booster_model, None, "run", "model", True)
+
+    expected = booster.predict(xgb.DMatrix(features))
+    assert model_service.predict_batch(features) == pytest.approx(expected.tolist())
+    assert model_service.predict(features[1]) == pytest.approx(float(expected[1]))
+
+
+def test_load_model_falls_back_to_pyfunc_without_booster(tmp_path):
+    """Test that load_model uses the mlflow pyfunc model when the booster artifact is missing"""
+    preprocessor_path = tmp_path / "preprocessor.b"
+    preprocessor_path.write_bytes(pickle.dumps({"vocabulary": 1}))
+
+    def download_artifacts(location):
+        if location == model.get_booster_location("run"):
+            raise OSError("booster artifact not found")
+        return str(preprocessor_path)
+
+    with (
+        patch.object(model, 'artifact_cache_dir', ''),
+        patch('mlflow.artifacts.download_artifacts', download_artifacts),
+        patch('mlflow.pyfunc.load_model', return_value="pyfunc-model") as load_pyfunc,
+    ):
+        loaded_model, preprocessor = model.load_model(
+            "run", "model", backend='booster', encoder_mode='dict_vectorizer'
+        )
+
+    load_pyfunc.assert_called_once()
+    assert loaded_model == "pyfunc-model"
+    assert preprocessor == {"vocabulary": 1}
+
+
+def test_serving_import_graph_is_slim():
+    """Test that importing the serving path in test mode does not pull in heavy dependencies"""
+    project_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    script = (
+        "import sys, lambda_function, model; "
+        "heavy = [m for m in ('mlflow', 'boto3', 'xgboost', 'sklearn') if m in sys.modules]; "
+        "assert not heavy, heavy; "
+        "assert {'import_model', 'init'} <= set(model.startup_timings)"
+    )
+
+    result = subprocess.run(
+        [sys.executable, "-c", script],
+        cwd=project_dir,
+        env={**os.environ, 'TEST_RUN': 'true'},
+        capture_output=True,
+        text=True,
+        check=False,
+    )
+
+    assert result.returncode == 0, result.stderr
+    assert '"startup_timings"' in result.stdout
+
+
+def test_lazy_import_records_import_time():
+    """Test that lazy_import times first imports only"""
+    model.startup_timings.pop('import_colorsys', None)
+    sys.modules.pop('colorsys', None)
+
+    first = model.lazy_import('colorsys')
+    recorded = model.startup_timings['import_colorsys']
+    second = model.lazy_import('colorsys')
+
+    assert first is second
+    assert model.startup_timings['import_colorsys'] == recorded
+
+
+def create_kinesis_callback(kinesis_client=None):
+    """Create a KinesisCallback around a mock client without retry delays"""
+    kinesis_client = kinesis_client or MagicMock()
+    if kinesis_client.put_records.side_effect is None:
+        kinesis_client.put_records.side_effect = lambda StreamName, Records: {
+            'FailedRecordCount': 0,
+            'Records': [{'SequenceNumber': '1'} for _ in Records],
+        }
+    return model.KinesisCallback(kinesis_client, 'ride-predictions', retry_backoff=0)
+
+
+def create_prediction_event(ride_id):
+    """Create a prediction event as produced by ModelService"""
+    model_service = create_model_service()
+    return model_service.prediction_event(ride_id, 15.5)
+
+
+def test_kinesis_callback_batches_put_records():
+    """Test that prediction events are sent in PutRecords batches of at most 500"""
+    kinesis_callback = create_kinesis_callback()
+
+    for i in range(1200):
+        kinesis_callback.put_record(create_prediction_event(i))
+    kinesis_callback.flush()
+
+    calls = kinesis_callback.kinesis_client.put_records.call_args_list
+    assert [len(c.kwargs['Records']) for c in calls] == [500, 500, 200]
+    assert calls[0].kwargs['Records'][0]['PartitionKey'] == '0'
+    assert json.loads(calls[0].kwargs['Records'][0]['Data']) == create_prediction_event(0)
+    kinesis_callback.kinesis_client.put_record.assert_not_called()
+
+
+def test_kinesis_callback_respects_request_size_limit():
+    """Test that a batch is flushed before it would exceed the 5 MB request limit"""
+    kinesis_callback = create_kinesis_callback()
+    kinesis_callback.max_batch_bytes = 1000
+
+    for i in range(10):
+        kinesis_callback.put_record(create_prediction_event(f"ride_{i:03d}"))
+    kinesis_callback.flush()
+
+    for c in kinesis_callback.kinesis_client.put_records.call_args_list:
+        batch_bytes = sum(len(r['Data']) + len(r['PartitionKey']) for r in c.kwargs['Records'])
+        assert batch_bytes <= 1000
+    sent = sum(
+        len(c.kwargs['Records']) for c in kinesis_callback.kinesis_client.put_records.call_args_list
+    )
+    assert sent == 10
+
+
+def test_kinesis_callback_retries_only_failed_records():
+    """Test that partially failed PutRecords calls retry just the failed entries"""
+    responses = [
+        {
+            'FailedRecordCount': 2,
+            'Records': [
+                {'SequenceNumber': '1'},
+                {'ErrorCode': 'ProvisionedThroughputExceededException'},
+                {'SequenceNumber': '3'},
+                {'ErrorCode': 'InternalFailure'},
+            ],
+        },
+        {'FailedRecordCount': 0, 'Records': [{'SequenceNumber': '2'}, {'SequenceNumber': '4'}]},
+    ]
+    kinesis_client = MagicMock()
+    kinesis_client.put_records.side_effect = responses
+    kinesis_callback = create_kinesis_callback(kinesis_client)
+
+    for i in range(4):
+        kinesis_callback.put_record(create_prediction_event(i))
+    kinesis_callback.flush()
+
+    calls = kinesis_client.put_records.call_args_list
+    assert len(calls) == 2
+    assert [r['PartitionKey'] for r in calls[1].kwargs['Records']] == ['1', '3']
+
+
+def put_records_error(code):
+    """Create the ClientError PutRecords raises when the whole request fails"""
+    return ClientError({'Error': {'Code': code, 'Message': code}}, 'PutRecords')
+
+
+def test_kinesis_callback_retries_requests_that_raise():
+    """Test that throttled or unreachable PutRecords requests are retried as a whole"""
+    kinesis_client = MagicMock()
+    kinesis_client.put_records.side_effect = [
+        put_records_error('ProvisionedThroughputExceededException'),
+        EndpointConnectionError(endpoint_url='http://kinesis'),
+        {'FailedRecordCount': 0, 'Records': [{'SequenceNumber': '1'}, {'SequenceNumber': '2'}]},
+    ]
+    kinesis_callback = create_kinesis_callback(kinesis_client)
+
+    for i in range(2):
+        kinesis_callback.put_record(create_prediction_event(i))
+    kinesis_callback.flush()
+
+    assert kinesis_client.put_records.call_count == 3
+    assert not kinesis_callback.buffer
+
+
+def test_kinesis_callback_keeps_undelivered_records_for_the_next_flush():
+    """Test that records still failing after the retries stay buffered and are sent next time"""
+    kinesis_client = MagicMock()
+    kinesis_client.put_records.side_effect = EndpointConnectionError(endpoint_url='http://kinesis')
+    kinesis_callback = create_kinesis_callback(kinesis_client)
+    for i in range(3):
+        kinesis_callback.put_record(create_prediction_event(i))
+
+    with pytest.raises(model.KinesisDeliveryError) as error:
+        kinesis_callback.flush()
+
+    assert kinesis_client.put_records.call_count == kinesis_callback.max_retries + 1
+    assert [entry['PartitionKey'] for entry in error.value.entries] == ['0', '1', '2']
+    assert kinesis_callback.buffer == error.value.entries
+
+    kinesis_client.put_records.side_effect = lambda StreamName, Records: {
+        'FailedRecordCount': 0,
+        'Records': [{'SequenceNumber': '1'} for _ in Records],
+    }
+    kinesis_callback.flush()
+
+    assert [r['PartitionKey'] for r in kinesis_client.put_records.call_args.kwargs['Records']] == [
+        '0',
+        '1',
+        '2',
+    ]
+    assert not kinesis_callback.buffer
+    assert kinesis_callback.buffer_bytes == 0
+
+
+def test_kinesis_callback_does_not_retry_permanent_errors():
+    """Test that a request rejected for good fails at once and keeps its records buffered"""
+    kinesis_client = MagicMock()
+    kinesis_client.put_records.side_effect = put_records_error('ResourceNotFoundException')
+    kinesis_callback = create_kinesis_callback(kinesis_client)
+    kinesis_callback.put_record(create_prediction_event(0))
+
+    with pytest.raises(model.KinesisDeliveryError, match='ResourceNotFoundException'):
+        kinesis_callback.flush()
+
+    assert kinesis_client.put_records.call_count == 1
+    assert len(kinesis_callback.buffer) == 1
+
+
+def test_lambda_handler_flushes_sinks_once_per_invocation():
+    """Test that buffered predictions are flushed at the end of lambda_handler"""
+    kinesis_callback = create_kinesis_callback()
+    model_service = create_model_service(
+        callbacks=[kinesis_callback.put_record], flush_callbacks=[kinesis_callback.flush]
+    )
+    event = create_kinesis_batch_event([create_sample_ride_event(f"ride_{i}") for i in range(3)])
+
+    model_service.lambda_handler(event)
+
+    kinesis_callback.kinesis_client.put_records.assert_called_once()
+    assert not kinesis_callback.buffer
+
+
+def test_async_callbacks_are_drained_before_handler_returns():
+    """Test that asynchronous delivery has finished and flushed when lambda_handler returns"""
+    delivered = []
+
+    def slow_callback(prediction_event):
+        time.sleep(0.01)
+        delivered.append(prediction_event['prediction']['ride_id'])
+
+    flush = MagicMock(side_effect=lambda: delivered.append('flushed'))
+    model_service = create_model_service(
+        callbacks=[slow_callback],
+        flush_callbacks=[flush],
+        async_callbacks=True,
+        callback_queue_size=2,
+    )
+    event = create_kinesis_batch_event([create_sample_ride_event(f"ride_{i}") for i in range(5)])
+
+    model_service.lambda_handler(event)
+
+    assert delivered == [f"ride_{i}" for i in range(5)] + ['flushed']
+
+
+def test_async_callbacks_apply_backpressure():
+    """Test that submit blocks once the bounded queue is full"""
+    release = threading.Event()
+    dispatcher = CallbackDispatcher([lambda _: release.wait()], asynchronous=True, max_queue_size=1)
+
+    dispatcher.submit({})  # picked up by the worker, which blocks in the callback
+    dispatcher.submit({})  # fills the queue
+    blocked = threading.Thread(target=dispatcher.submit, args=({},))
+    blocked.start()
+    blocked.join(timeout=0.1)
+    assert blocked.is_alive()
+
+    release.set()
+    blocked.join(timeout=1)
+    assert not blocked.is_alive()
+    dispatcher.drain()
+
+
+def test_callback_errors_are_counted_per_callback():
+    """Test that failing callbacks are counted without stopping the other callbacks"""
+
+    def failing_callback(prediction_event):
+        raise KeyError(prediction_event['prediction']['ride_id'])
+
+    for async_callbacks in (False, True):
+        kinesis_client = MagicMock()
+        kinesis_client.put_records.side_effect = ConnectionError("stream unavailable")
+        kinesis_callback = create_kinesis_callback(kinesis_client)
+        other_callback = MagicMock()
+        model_service = create_model_service(
+            callbacks=[failing_callback, kinesis_callback.put_record, other_callback],
+            flush_callbacks=[kinesis_callback.flush],
+            async_callbacks=async_callbacks,
+        )
+        event = create_kinesis_batch_event(
+            [create_sample_ride_event(f"ride_{i}") for i in range(2)]
+        )
+
+        result = model_service.lambda_handler(event)
+
+        assert len(result['predictions']) == 2
+        assert other_callback.call_count == 2
+        assert model_service.callback_dispatcher.error_counts == {
+            'test_callback_errors_are_counted_per_callback.<locals>.failing_callback': 2,
+            'KinesisCallback.flush': 1,
+        }
+
+
+def test_load_model_compiles_and_caches_feature_encoder(tmp_path):
+    """Test that the DictVectorizer is compiled once and later loads skip unpickling it"""
+    dv = DictVectorizer()
+    dv.fit([create_sample_ride_data(), {"PU_DO": "1_2", "trip_distance": 3.0}])
+    preprocessor_path = tmp_path / "preprocessor.b"
+    preprocessor_path.write_bytes(pickle.dumps(dv))
+
+    with (
+        patch.object(model, 'artifact_cache_dir', str(tmp_path / "cache")),
+        patch.object(model, 'embedded_artifacts_dir', ''),
+        patch('mlflow.artifacts.download_artifacts', return_value=str(preprocessor_path)),
+        patch('mlflow.pyfunc.load_model'),
+    ):
+        _, preprocessor = model.load_model("run", "model", backend='pyfunc')
+        with patch('pickle.load', side_effect=AssertionError("unpickled")):
+            _, cached_preprocessor = model.load_model("run", "model", backend='pyfunc')
+
+    ride = create_sample_ride_data()
+    assert isinstance(preprocessor, FeatureEncoder)
+    assert isinstance(cached_preprocessor, FeatureEncoder)
+    assert (cached_preprocessor.transform(ride) != dv.transform(ride)).nnz == 0
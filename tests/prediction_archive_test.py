@@ -0,0 +1,125 @@
+import io
+
+import pytest
+from pyarrow import dataset as ds
+from pyarrow import parquet as pq
+
+from prediction_archive import PredictionArchive
+from tests.model_test import (
+    FakeClock,
+    create_kinesis_batch_event,
+    create_model_service,
+    create_sample_ride_event,
+)
+
+# 2025-01-01T23:59:00Z
+MIDNIGHT = 1735775940.0
+
+
+class FakeS3:
+    def __init__(self, fail=0):
+        self.objects = {}
+        self.fail = fail
+
+    def put_object(self, Bucket, Key, Body):  # pylint: disable=invalid-name
+        if self.fail:
+            self.fail -= 1
+            raise OSError("S3 unavailable")
+        self.objects[(Bucket, Key)] = Body
+
+
+def prediction_event(ride_id, prediction=10.0, version='run-1'):
+    return {
+        'version': version,
+        'prediction': {'ride_id': ride_id, 'predicted_duration': prediction},
+    }
+
+
+def test_flush_waits_for_the_row_or_age_threshold(tmp_path):
+    """Test that nothing is written until max_rows rows or max_age seconds are reached"""
+    clock = FakeClock(MIDNIGHT)
+    archive = PredictionArchive(str(tmp_path), max_rows=3, max_age=60, clock=clock)
+
+    archive.add(prediction_event(1), {'trip_distance': 1.0})
+    archive.add(prediction_event(2), {'trip_distance': 2.0})
+    assert not archive.flush()
+
+    archive.add(prediction_event(3), {'trip_distance': 3.0})
+    assert len(archive.flush()) == 1
+
+    archive.add(prediction_event(4), {'trip_distance': 4.0})
+    clock.now += 59
+    assert not archive.flush()
+    clock.now += 1
+    assert len(archive.flush()) == 1
+    assert not archive.flush(force=True)
+
+
+def test_rows_are_partitioned_by_date_and_run_id(tmp_path):
+    """Test that one file per date and run_id is written with the ride features as columns"""
+    clock = FakeClock(MIDNIGHT)
+    archive = PredictionArchive(str(tmp_path / 'predictions'), clock=clock)
+    archive.add(prediction_event('a', 11.0), {'PU_DO': '43_151', 'trip_distance': 18.4})
+    archive.add(prediction_event('b', 12.0, 'run-2'), {'PU_DO': '1_1', 'trip_distance': 2.0})
+    clock.now += 120
+    archive.add(prediction_event(3, 13.0), {'PULocationID': 20, 'trip_distance': 5.0})
+
+    keys = archive.flush(force=True)
+
+    assert sorted(key.split('/part-')[0] for key in keys) == [
+        f'{tmp_path}/predictions/date=2025-01-01/run_id=run-1',
+        f'{tmp_path}/predictions/date=2025-01-01/run_id=run-2',
+        f'{tmp_path}/predictions/date=2025-01-02/run_id=run-1',
+    ]
+    table = ds.dataset(tmp_path / 'predictions', partitioning='hive').to_table()
+    rows = sorted(table.to_pylist(), key=lambda row: row['ride_id'])
+    assert [(row['ride_id'], row['predicted_duration'], row['run_id']) for row in rows] == [
+        ('3', 13.0, 'run-1'),
+        ('a', 11.0, 'run-1'),
+        ('b', 12.0, 'run-2'),
+    ]
+    assert [row['PU_DO'] for row in rows] == [None, '43_151', '1_1']
+    (next_day,) = [pq.read_table(key).to_pylist() for key in keys if 'date=2025-01-02' in key]
+    assert next_day[0]['PULocationID'] == 20
+    assert next_day[0]['predicted_at'].timestamp() == MIDNIGHT + 120
+
+
+def test_mixed_feature_types_are_kept_as_json(tmp_path):
+    archive = PredictionArchive(str(tmp_path))
+    archive.add(prediction_event(1), {'PULocationID': 20})
+    archive.add(prediction_event(2), {'PULocationID': '20'})
+
+    keys = archive.flush(force=True)
+
+    assert pq.read_table(keys[0]).column('PULocationID').to_pylist() == ['20', '"20"']
+
+
+def test_failed_writes_are_retried_on_the_next_flush():
+    """Test that rows survive a failed S3 write and are uploaded by the next flush"""
+    s3 = FakeS3(fail=1)
+    archive = PredictionArchive('s3://bucket/predictions/', s3, clock=FakeClock(MIDNIGHT))
+    archive.add(prediction_event(1), {'trip_distance': 1.0})
+
+    with pytest.raises(OSError):
+        archive.flush(force=True)
+    key = archive.flush(force=True)[0]
+
+    assert key.startswith('predictions/date=2025-01-01/run_id=run-1/part-')
+    body = s3.objects[('bucket', key)]
+    assert pq.read_table(io.BytesIO(body)).column('ride_id').to_pylist() == ['1']
+
+
+def test_lambda_handler_archives_delivered_predictions(tmp_path):
+    """Test that each delivered prediction is archived with its ride at the end of the batch"""
+    archive = PredictionArchive(str(tmp_path), max_rows=2)
+    model_service = create_model_service(archive=archive, flush_callbacks=[archive.flush])
+    model_service.test_run = False
+    event = create_kinesis_batch_event([create_sample_ride_event(f'ride_{i}') for i in range(2)])
+    event['Records'].append({'kinesis': {'data': 'not base64 json'}})
+
+    model_service.lambda_handler(event)
+
+    table = ds.dataset(tmp_path, partitioning='hive').to_table()
+    assert sorted(table.column('ride_id').to_pylist()) == ['ride_0', 'ride_1']
+    assert table.column('trip_distance').to_pylist() == [18.4, 18.4]
+    assert set(table.column('run_id').to_pylist()) == {'test-run-id'}
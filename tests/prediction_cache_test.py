@@ -0,0 +1,111 @@
+from unittest.mock import MagicMock
+
+from scipy import sparse
+
+import model
+from prediction_cache import PredictionCache
+from tests.model_test import FakeClock
+
+
+def create_cached_model_service(cache, run_id="run"):
+    """Create a ModelService whose mocks count how many rides they encode and predict"""
+    preprocessor = MagicMock()
+    preprocessor.fields = ['PU_DO', 'trip_distance']
+    preprocessor.transform.side_effect = lambda rides: sparse.csr_matrix(
+        [[ride['trip_distance']] for ride in rides]
+    )
+    mock_model = MagicMock()
+    mock_model.predict.side_effect = lambda features: features.toarray()[:, 0] * 2
+    return model.ModelService(
+        mock_model, preprocessor, run_id, "model", True, prediction_cache=cache
+    )
+
+
+def test_lru_eviction_and_counters():
+    """Test that the least recently used entry is evicted once max_size is reached"""
+    cache = PredictionCache(max_size=2)
+
+    cache.put('a', 1.0)
+    cache.put('b', 2.0)
+    assert cache.get('a') == 1.0
+    cache.put('c', 3.0)
+
+    assert cache.get('b') is None
+    assert cache.get('c') == 3.0
+    assert cache.stats() == {
+        'size': 2,
+        'max_size': 2,
+        'hits': 2,
+        'misses': 1,
+        'evictions': 1,
+        'expirations': 0,
+        'hit_rate': 2 / 3,
+    }
+
+
+def test_entries_expire_after_ttl():
+    """Test that entries older than the TTL count as misses"""
+    clock = FakeClock()
+    cache = PredictionCache(max_size=10, ttl_seconds=60, clock=clock)
+    cache.put('a', 1.0)
+
+    clock.now = 59
+    assert cache.get('a') == 1.0
+    clock.now = 60
+    assert cache.get('a') is None
+    assert cache.stats()['expirations'] == 1
+
+
+def test_hot_rides_skip_encoder_and_model():
+    """Test that cached rides are served without calling the encoder or the model"""
+    model_service = create_cached_model_service(PredictionCache(max_size=10))
+    rides = [(1, {'PU_DO': '43_151', 'trip_distance': 2.0})]
+
+    assert model_service.predict_rides(rides) == [4.0]
+    repeated = [(2, {'trip_distance': 2.0, 'PU_DO': '43_151'}), (3, {'trip_distance': 5.0})]
+    assert model_service.predict_rides(repeated) == [4.0, 10.0]
+
+    assert model_service.preprocessor.transform.call_count == 2
+    assert model_service.preprocessor.transform.call_args[0][0] == [{'trip_distance': 5.0}]
+    assert model_service.prediction_cache.stats()['hits'] == 1
+
+
+def test_fields_the_encoder_ignores_share_one_cache_entry():
+    """Test that rides differing only in fields the encoder does not read hit the same entry"""
+    model_service = create_cached_model_service(PredictionCache(max_size=10))
+    rides = [
+        (i, {'ride_id': i, 'PU_DO': '43_151', 'trip_distance': 2.0, 'vendor': f'v{i}'})
+        for i in range(3)
+    ]
+
+    assert model_service.predict_rides(rides[:1]) == [4.0]
+    assert model_service.predict_rides(rides[1:]) == [4.0, 4.0]
+
+    assert model_service.preprocessor.transform.call_count == 1
+    assert model_service.prediction_cache.stats()['size'] == 1
+    assert model_service.prediction_cache.stats()['hits'] == 2
+
+
+def test_cache_keys_are_scoped_to_model_version():
+    """Test that a shared cache never serves one run's prediction for another run"""
+    cache = PredictionCache(max_size=10)
+    ride = {'PU_DO': '43_151', 'trip_distance': 2.0}
+
+    create_cached_model_service(cache, run_id="run-1").predict_rides([(1, ride)])
+    model_service = create_cached_model_service(cache, run_id="run-2")
+    model_service.predict_rides([(1, ride)])
+
+    assert model_service.preprocessor.transform.call_count == 1
+    assert cache.stats()['hits'] == 0
+
+
+def test_unhashable_rides_are_not_cached():
+    """Test that rides with unhashable values are predicted but never cached"""
+    model_service = create_cached_model_service(PredictionCache(max_size=10))
+    model_service.model.predict.side_effect = lambda features: [1.0] * features.shape[0]
+    model_service.preprocessor.transform.side_effect = lambda rides: sparse.csr_matrix(
+        [[1.0]] * len(rides)
+    )
+
+    assert model_service.predict_rides([(1, {'PU_DO': ['43_151']})]) == [1.0]
+    assert model_service.prediction_cache.stats()['size'] == 0
@@ -0,0 +1,215 @@
+import asyncio
+import json
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+import uvicorn
+from sklearn.feature_extraction import DictVectorizer
+
+import model
+from feature_encoder import FeatureEncoder
+from prediction_server import MicroBatcher, create_app
+from tests.model_test import (
+    create_mock_model,
+    create_model_service,
+    create_sample_ride_data,
+    create_sample_ride_event,
+)
+
+
+def test_micro_batcher_groups_concurrent_requests():
+    """Test that queued requests are predicted together, up to max_batch_size"""
+    batches = []
+
+    def predict_batch(items):
+        batches.append(list(items))
+        return [item * 2 for item in items]
+
+    async def scenario():
+        batcher = MicroBatcher(predict_batch, max_batch_size=4, max_wait=0.01)
+        await batcher.start()
+        try:
+            return await asyncio.gather(*(batcher.submit(i) for i in range(10))), batcher.stats()
+        finally:
+            await batcher.stop()
+
+    results, stats = asyncio.run(scenario())
+
+    assert results == [i * 2 for i in range(10)]
+    assert batches == [[0, 1, 2, 3], [4, 5, 6, 7], [8, 9]]
+    assert stats == {'batches': 3, 'requests': 10, 'fallbacks': 0, 'mean_batch_size': 10 / 3}
+
+
+def test_micro_batcher_waits_at_most_max_wait():
+    """Test that a lone request is not held back longer than the batching window"""
+
+    async def scenario():
+        batcher = MicroBatcher(lambda items: items, max_batch_size=64, max_wait=0.05)
+        await batcher.start()
+        try:
+            start = time.perf_counter()
+            result = await batcher.submit('ride')
+            return result, time.perf_counter() - start
+        finally:
+            await batcher.stop()
+
+    result, elapsed = asyncio.run(scenario())
+
+    assert result == 'ride'
+    assert 0.04 <= elapsed < 1.0
+
+
+def test_micro_batcher_isolates_failing_requests():
+    """Test that a failed batch is re-run per request, so only the bad request fails"""
+    batches = []
+
+    def predict_batch(items):
+        batches.append(list(items))
+        if 'bad' in items:
+            raise ValueError("unsupported ride")
+        return [item.upper() for item in items]
+
+    async def scenario():
+        batcher = MicroBatcher(predict_batch, max_batch_size=4, max_wait=0.01)
+        await batcher.start()
+        try:
+            results = await asyncio.gather(
+                *(batcher.submit(item) for item in ['a', 'bad', 'c']), return_exceptions=True
+            )
+            return results, batcher.stats()
+        finally:
+            await batcher.stop()
+
+    results, stats = asyncio.run(scenario())
+
+    assert results[0] == 'A'
+    assert isinstance(results[1], ValueError)
+    assert results[2] == 'C'
+    assert batches == [['a', 'bad', 'c'], ['a'], ['bad'], ['c']]
+    assert stats['fallbacks'] == 1
+
+
+class RunningServer:
+    """Serve an app with uvicorn on a free local port in a background thread"""
+
+    def __init__(self, app):
+        self.server = uvicorn.Server(
+            uvicorn.Config(app, host='127.0.0.1', port=0, log_level='warning')
+        )
+        self.thread = threading.Thread(target=self.server.run, daemon=True)
+        self.url = None
+
+    def __enter__(self):
+        self.thread.start()
+        while not self.server.started:
+            time.sleep(0.01)
+        port = self.server.servers[0].sockets[0].getsockname()[1]
+        self.url = f'http://127.0.0.1:{port}'
+        return self
+
+    def __exit__(self, *_):
+        self.server.should_exit = True
+        self.thread.join(timeout=5)
+
+    def request(self, path, body=None):
+        data = None if body is None else json.dumps(body).encode('utf-8')
+        request = urllib.request.Request(
+            self.url + path, data=data, headers={'Content-Type': 'application/json'}
+        )
+        try:
+            with urllib.request.urlopen(request, timeout=5) as response:
+                return response.status, json.loads(response.read())
+        except urllib.error.HTTPError as e:
+            return e.code, json.loads(e.read())
+
+    def wait_until_ready(self, timeout=5):
+        deadline = time.time() + timeout
+        while self.request('/ready')[0] != 200:
+            assert time.time() < deadline, "Server did not become ready"
+            time.sleep(0.01)
+
+
+def test_server_answers_predictions_after_loading():
+    """Test the probes and a prediction round trip over HTTP"""
+    loaded = threading.Event()
+
+    def load_service():
+        loaded.wait(timeout=5)
+        return create_model_service(mock_model=create_mock_model(return_value=21.5))
+
+    with RunningServer(create_app(load_service, max_wait=0.001)) as server:
+        assert server.request('/health') == (200, {'status': 'ok'})
+        assert server.request('/ready')[0] == 503
+        assert server.request('/predict', create_sample_ride_event())[0] == 503
+
+        loaded.set()
+        server.wait_until_ready()
+        status, body = server.request('/predict', create_sample_ride_event(ride_id='ride-1'))
+
+    assert status == 200
+    assert body == {
+        'statusCode': 200,
+        'model': 'ride_duration_prediction_test',
+        'version': 'test-run-id',
+        'prediction': {'ride_id': 'ride-1', 'predicted_duration': 21.5},
+    }
+
+
+@pytest.mark.parametrize("body", [{"ride_id": 1}, {"ride": [1, 2], "ride_id": 1}])
+def test_server_rejects_requests_without_a_ride(body):
+    """Test that malformed requests get a 400 without reaching the model"""
+    with RunningServer(create_app(create_model_service)) as server:
+        server.wait_until_ready()
+        status, _ = server.request('/predict', body)
+
+    assert status == 400
+
+
+def test_server_keeps_errors_to_the_request_that_caused_them():
+    """Test that a ride with an unusable field value does not fail concurrent requests"""
+    dv = DictVectorizer()
+    dv.fit([create_sample_ride_data()])
+
+    def load_service():
+        return model.ModelService(
+            create_mock_model(), FeatureEncoder.from_dict_vectorizer(dv), "run", "model", False
+        )
+
+    bad_event = create_sample_ride_event(ride_id='bad')
+    bad_event['ride']['PU_DO'] = {'x': 1}
+    events = [create_sample_ride_event(ride_id=f'ride-{i}') for i in range(3)] + [bad_event]
+
+    with RunningServer(create_app(load_service, max_wait=0.05)) as server:
+        server.wait_until_ready()
+        with ThreadPoolExecutor(max_workers=len(events)) as executor:
+            responses = list(executor.map(lambda event: server.request('/predict', event), events))
+
+    assert [status for status, _ in responses] == [200, 200, 200, 422]
+    assert [body['prediction']['ride_id'] for _, body in responses[:3]] == [
+        'ride-0',
+        'ride-1',
+        'ride-2',
+    ]
+
+
+def test_health_fails_when_model_cannot_be_loaded():
+    """Test that a failed model load is reported by the liveness probe"""
+
+    def load_service():
+        raise RuntimeError("artifacts unavailable")
+
+    with RunningServer(create_app(load_service)) as server:
+        deadline = time.time() + 5
+        while server.request('/health')[0] != 503:
+            assert time.time() < deadline
+            time.sleep(0.01)
+        status, body = server.request('/health')
+        ready_status, _ = server.request('/ready')
+
+    assert status == 503
+    assert body == {'status': 'failed', 'error': 'artifacts unavailable'}
+    assert ready_status == 503
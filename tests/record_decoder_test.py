@@ -0,0 +1,66 @@
+import base64
+import json
+from unittest.mock import patch
+
+import pytest
+
+import record_decoder
+
+
+def encode(payload):
+    """Base64-encode a payload the way Kinesis delivers it to Lambda"""
+    data = payload if isinstance(payload, bytes) else json.dumps(payload).encode('utf-8')
+    return {'kinesis': {'data': base64.b64encode(data).decode('utf-8')}}
+
+
+def create_records():
+    """Create a batch mixing valid records with every kind of bad record"""
+    return [
+        encode({'ride': {'PU_DO': '43_151', 'trip_distance': 18.4}, 'ride_id': 1}),
+        encode(b'invalid json'),
+        encode({'ride_id': 3}),
+        encode({'ride': 'not an object', 'ride_id': 4}),
+        encode([1, 2, 3]),
+        {'kinesis': {'data': '!!! not base64 !!!'}},
+        {'kinesis': {}},
+        encode({'ride': {'trip_distance': 2.0}, 'ride_id': 'ride-8'}),
+        encode('{"ride": {"PU_DO": "1_1"}, "ride_id": "unicodé"}'.encode('utf-8')),
+    ]
+
+
+@pytest.mark.parametrize("backend", ["default", "stdlib"])
+def test_decode_records_isolates_failures(backend):
+    """Test that bad records are reported by index while the rest decode"""
+    loads = json.loads if backend == "stdlib" else record_decoder.json_loads
+
+    with patch.object(record_decoder, 'json_loads', loads):
+        rides, failures = record_decoder.decode_records(create_records())
+
+    assert rides == [
+        (0, 1, {'PU_DO': '43_151', 'trip_distance': 18.4}),
+        (7, 'ride-8', {'trip_distance': 2.0}),
+        (8, 'unicodé', {'PU_DO': '1_1'}),
+    ]
+    assert [index for index, _ in failures] == [1, 2, 3, 4, 5, 6]
+    assert isinstance(failures[0][1], json.JSONDecodeError)
+    assert isinstance(failures[1][1], KeyError)
+    assert all(isinstance(error, (KeyError, ValueError)) for _, error in failures)
+
+
+def test_decode_records_handles_empty_batch():
+    """Test that an empty record list decodes to nothing"""
+    assert record_decoder.decode_records([]) == ([], [])
+
+
+def test_batch_item_failures_hold_back_later_records_of_a_failed_key():
+    """Test that failures are reported with every later record of the same partition key"""
+    records = [
+        {'kinesis': {'partitionKey': key, 'sequenceNumber': str(i)}}
+        for i, key in enumerate(['a', 'b', 'a', 'c', 'b', None, None])
+    ]
+
+    held_back, failures = record_decoder.batch_item_failures(records, {1, 5})
+
+    assert held_back == {1, 4, 5}
+    assert failures == [{'itemIdentifier': '1'}, {'itemIdentifier': '4'}, {'itemIdentifier': '5'}]
+    assert record_decoder.batch_item_failures(records, set()) == (set(), [])
@@ -0,0 +1,96 @@
+import time
+
+from benchmarks import serving
+from record_decoder import decode_records
+
+
+def test_synthetic_events_decode_like_kinesis_records():
+    """Test that generated events go through the Lambda decoder with unique ride IDs"""
+    events = serving.synthetic_events(batch_size=4, n_batches=3, distribution='zipf')
+
+    rides = [ride for event in events for ride in decode_records(event['Records'])[0]]
+
+    assert [len(event['Records']) for event in events] == [4, 4, 4]
+    assert [ride_id for _, ride_id, _ in rides] == list(range(12))
+    for _, _, ride in rides:
+        assert set(ride) == {'PU_DO', 'trip_distance'}
+        pickup, dropoff = map(int, ride['PU_DO'].split('_'))
+        assert 1 <= pickup <= serving.N_LOCATIONS and 1 <= dropoff <= serving.N_LOCATIONS
+
+
+def test_key_distributions_control_repetition():
+    """Test that zipf and repeated rides reuse far fewer routes than uniform ones"""
+    uniform = serving.synthetic_rides(5000, 'uniform')
+    zipf = serving.synthetic_rides(5000, 'zipf')
+    repeated = serving.synthetic_rides(5000, 'repeated', n_keys=50)
+
+    def distinct_routes(rides):
+        return len({ride['PU_DO'] for ride in rides})
+
+    assert distinct_routes(zipf) < distinct_routes(uniform) / 2
+    assert len({tuple(ride.items()) for ride in repeated}) <= 50
+
+
+def test_compare_flags_only_regressions_beyond_tolerance():
+    """Test that slower throughput or higher latency fails, while improvements pass"""
+    baseline = {
+        'init': {'cold_init_ms': 1000.0},
+        'scenarios': {'batch_10/uniform': {'records_per_sec': 1000.0, 'p50_ms': 10.0}},
+        'peak_rss_mb': 200.0,
+    }
+    results = {
+        'init': {'cold_init_ms': 500.0},
+        'scenarios': {'batch_10/uniform': {'records_per_sec': 700.0, 'p50_ms': 11.0}},
+        'peak_rss_mb': 300.0,
+    }
+
+    regressions = serving.compare(results, baseline, tolerance=0.2)
+
+    assert [regression.split(':')[0] for regression in regressions] == [
+        'batch_10/uniform/records_per_sec',
+        'peak_rss_mb',
+    ]
+    assert not serving.compare(baseline, baseline)
+    assert not serving.compare(
+        {'scenarios': {'batch_1/uniform': {'p50_ms': 1.6, 'p99_ms': 30.0}}},
+        {'scenarios': {'batch_1/uniform': {'p50_ms': 1.0, 'p99_ms': 1.0}}},
+        min_delta_ms=1.0,
+    )
+
+
+def test_time_batches_reports_throughput_and_percentiles():
+    """Test that only events after the warmup are timed and summarized"""
+    invoked = []
+    events = serving.synthetic_events(batch_size=5, n_batches=4)
+
+    stats = serving.time_batches(invoked.append, events, warmup=2)
+
+    assert len(invoked) == 6
+    assert stats['records_per_sec'] > 0
+    assert 0 < stats['p50_ms'] <= stats['p99_ms']
+
+
+def test_synthetic_model_serves_the_benchmark_events(tmp_path):
+    """Test that the embedded synthetic model loads through model.load_model and predicts"""
+    embedded_dir = serving.build_synthetic_artifacts(
+        str(tmp_path / 'embedded'), preset='fast', n_rides=500
+    )
+
+    with serving.serving_artifacts(embedded_dir):
+        service = serving.create_service(serving.SYNTHETIC_RUN_ID, serving.SYNTHETIC_MODEL_ID)
+    predictions = service.lambda_handler(serving.synthetic_events(8, 1)[0])['predictions']
+
+    assert len(predictions) == 8
+    assert {prediction['version'] for prediction in predictions} == {serving.SYNTHETIC_RUN_ID}
+
+
+def test_run_scenarios_keeps_the_fastest_repeat():
+    """Test that repeated scenarios report their fastest run"""
+    delays = iter([0.02] * 4 + [0.0] * 4 + [0.01] * 4)
+
+    def invoke(_):
+        time.sleep(next(delays))
+
+    scenarios = serving.run_scenarios(invoke, [1], ['uniform'], n_batches=1, repeats=3)
+
+    assert scenarios['batch_1/uniform']['p50_ms'] < 5
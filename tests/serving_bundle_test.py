@@ -0,0 +1,151 @@
+from unittest.mock import patch
+
+import numpy as np
+import pandas as pd
+import pytest
+import xgboost as xgb
+from sklearn.feature_extraction import DictVectorizer
+
+import model
+from artifact_cache import ArtifactCache
+from feature_encoder import FeatureEncoder, SortedLookup
+from serving_bundle import BUNDLE_FORMAT_VERSION, PREAMBLE, BundleError, ServingBundle, write_bundle
+from tests.feature_encoder_test import assert_same_matrix, create_training_rides
+
+
+@pytest.fixture(name="dv", scope="module")
+def fixture_dv():
+    dv = DictVectorizer(sparse=True)
+    dv.fit(create_training_rides(count=500) + [{'PU_DO': 'Zürich_東京', 'trip_distance': 1.0}])
+    return dv
+
+
+@pytest.fixture(name="booster", scope="module")
+def fixture_booster(dv):
+    rides = create_training_rides(count=500)
+    labels = [ride['trip_distance'] * 3 for ride in rides]
+    return xgb.train({'max_depth': 3}, xgb.DMatrix(dv.transform(rides), label=labels), 5)
+
+
+@pytest.fixture(name="bundle_path")
+def fixture_bundle_path(dv, booster, tmp_path):
+    encoder = FeatureEncoder.from_dict_vectorizer(dv)
+    return write_bundle(tmp_path / "serving.bundle", booster, encoder, metadata={'run_id': 'run'})
+
+
+def test_round_trip_matches_vectorizer_and_booster(dv, booster, bundle_path):
+    """Test that the mapped encoder and booster reproduce the originals exactly"""
+    bundle = ServingBundle(bundle_path)
+    encoder = bundle.encoder()
+    loaded = xgb.Booster()
+    loaded.load_model(bundle.booster_buffer())
+    rides = create_training_rides(count=200, seed=5) + [
+        {'PU_DO': 'Zürich_東京', 'trip_distance': 2.0},
+        {'PU_DO': 'unknown_pair', 'trip_distance': None},
+        {'PU_DO': 43151},
+        {},
+    ]
+
+    assert bundle.metadata == {'run_id': 'run'}
+    assert isinstance(encoder.categorical['PU_DO'], SortedLookup)
+    assert (
+        dict(encoder.categorical['PU_DO'])
+        == FeatureEncoder.from_dict_vectorizer(dv).categorical['PU_DO']
+    )
+    assert_same_matrix(encoder.transform(rides), dv.transform(rides))
+    np.testing.assert_array_equal(
+        loaded.inplace_predict(encoder.transform(rides)),
+        booster.inplace_predict(dv.transform(rides)),
+    )
+
+
+def test_frame_encoding_uses_sorted_lookups(dv, bundle_path):
+    """Test that encoding a categorical frame through the mapped lookups matches the vectorizer"""
+    encoder = ServingBundle(bundle_path).encoder()
+    rides = create_training_rides(count=100, seed=9)
+    df = pd.DataFrame(rides)
+    df['PU_DO'] = df['PU_DO'].astype('category')
+
+    assert_same_matrix(encoder.transform_frame(df), dv.transform(rides))
+
+
+def test_sorted_lookup_only_matches_whole_keys():
+    """Test that longer, shorter and empty queries never match a fixed-width key"""
+    lookup = SortedLookup(np.array([b'1_1', b'1_10'], dtype=np.bytes_), np.array([4, 7]))
+
+    assert lookup.get_many(['1_1', '1_10', '1_100', '1_', '', '9']).tolist() == [
+        4,
+        7,
+        -1,
+        -1,
+        -1,
+        -1,
+    ]
+    assert lookup['1_10'] == 7
+    assert '1_100' not in lookup
+    assert 1 not in lookup
+    assert SortedLookup(np.array([], dtype=np.bytes_), np.array([])).get_many(['1']).tolist() == [
+        -1
+    ]
+
+
+def test_corrupted_section_is_rejected(bundle_path):
+    """Test that a flipped byte fails the checksum unless verification is skipped"""
+    data = bytearray(bundle_path.read_bytes())
+    data[-10] ^= 0xFF
+    bundle_path.write_bytes(bytes(data))
+
+    with pytest.raises(BundleError, match='booster'):
+        ServingBundle(bundle_path)
+    ServingBundle(bundle_path, verify=False)
+
+
+def test_corrupted_download_is_rejected_before_caching(bundle_path, tmp_path):
+    """Test that a downloaded bundle is verified before it enters the artifact cache"""
+    data = bytearray(bundle_path.read_bytes())
+    data[-10] ^= 0xFF
+    bundle_path.write_bytes(bytes(data))
+    cache_dir = tmp_path / "cache"
+
+    with (
+        patch.object(model, 'embedded_artifacts_dir', ''),
+        patch.object(model, 'artifact_cache_dir', str(cache_dir)),
+        patch('mlflow.artifacts.download_artifacts', return_value=str(bundle_path)),
+        pytest.raises(BundleError, match='booster'),
+    ):
+        model.load_bundle("run", "model")
+
+    assert ArtifactCache(cache_dir, max_bytes=0).get("run", "model", "serving_bundle") is None
+
+
+def test_cached_bundle_is_loaded_without_download(booster, bundle_path, tmp_path):
+    """Test that a verified download is cached and served from the cache afterwards"""
+    cache_dir = tmp_path / "cache"
+
+    with (
+        patch.object(model, 'embedded_artifacts_dir', ''),
+        patch.object(model, 'artifact_cache_dir', str(cache_dir)),
+        patch('mlflow.artifacts.download_artifacts', return_value=str(bundle_path)) as download,
+    ):
+        model.load_bundle("run", "model")
+        loaded_model, _ = model.load_bundle("run", "model")
+
+    assert download.call_count == 1
+    assert loaded_model.booster.num_boosted_rounds() == booster.num_boosted_rounds()
+
+
+@pytest.mark.parametrize(
+    "preamble, error",
+    [
+        (PREAMBLE.pack(b'PK\x03\x04', 1, 0), 'not a serving bundle'),
+        (PREAMBLE.pack(b'RDSB', BUNDLE_FORMAT_VERSION + 1, 0), 'format version'),
+        (b'RDSB', 'too short'),
+    ],
+)
+def test_unreadable_bundles_are_rejected(tmp_path, preamble, error):
+    """Test that other files and bundles from a newer format are refused before parsing"""
+    path = tmp_path / "serving.bundle"
+    path.write_bytes(preamble)
+
+    with pytest.raises(BundleError, match=error):
+        ServingBundle(path)
@@ -0,0 +1,139 @@
+import numpy as np
+import pandas as pd
+import xgboost as xgb
+from pyarrow import feather
+from scipy import sparse
+from sklearn.feature_extraction import DictVectorizer
+
+from streaming_training import ChunkIter, build_dmatrix, fit_encoder, iter_chunks
+from tests.trip_features_test import create_raw_trips
+from training_performance import PhaseTimer, training_params
+from trip_features import prepare_trips
+
+
+def write_cached_months(tmp_path, count=3, rows=2000):
+    """Write prepared months the way read_dataframe caches them, one seed per month"""
+    paths = []
+    for seed in range(count):
+        df = prepare_trips(create_raw_trips(count=rows, seed=seed))
+        path = tmp_path / f'month-{seed}.arrow'
+        feather.write_feather(
+            df.reset_index(drop=True), path, compression='uncompressed', chunksize=500
+        )
+        paths.append(path)
+    return paths
+
+
+def read_months(paths):
+    return pd.concat([feather.read_table(path).to_pandas() for path in paths])
+
+
+def fit_dict_vectorizer(df):
+    dicts = df[['PU_DO', 'trip_distance']].astype({'PU_DO': str}).to_dict(orient='records')
+    dv = DictVectorizer(sparse=True)
+    return dv, dv.fit_transform(dicts)
+
+
+def test_fit_encoder_matches_dict_vectorizer_fit(tmp_path):
+    """Test that the streamed vocabulary equals DictVectorizer fit on all months at once"""
+    paths = write_cached_months(tmp_path)
+
+    dv, encoder = fit_encoder(paths)
+    expected_dv, _ = fit_dict_vectorizer(read_months(paths))
+
+    assert dv.feature_names_ == expected_dv.feature_names_
+    assert dv.vocabulary_ == expected_dv.vocabulary_
+    assert encoder.n_features == len(expected_dv.vocabulary_)
+
+
+def test_fit_encoder_skips_unused_categories(tmp_path):
+    """Test that categories kept in the Arrow dictionary but never observed are ignored"""
+    df = pd.DataFrame(
+        {
+            'PU_DO': pd.Categorical(['1_2', '3_4'], categories=['1_2', '3_4', '5_6']),
+            'trip_distance': [1.0, 2.0],
+            'duration': [10.0, 20.0],
+        }
+    )
+    path = tmp_path / 'month.arrow'
+    feather.write_feather(df.iloc[:1], path, compression='uncompressed')
+
+    dv, _ = fit_encoder([path])
+
+    assert dv.feature_names_ == ['PU_DO=1_2', 'trip_distance']
+
+
+def test_iter_chunks_matches_dict_vectorizer_transform(tmp_path):
+    """Test that the chunks stacked together equal the in-memory create_X output"""
+    paths = write_cached_months(tmp_path)
+    _, encoder = fit_encoder(paths)
+    df = read_months(paths)
+    _, expected = fit_dict_vectorizer(df)
+
+    chunks = list(iter_chunks(paths, encoder, chunk_rows=300))
+
+    assert max(X.shape[0] for X, _ in chunks) == 300
+    actual = sparse.vstack([X for X, _ in chunks]).tocsr()
+    assert (actual != expected).nnz == 0
+    np.testing.assert_array_equal(np.concatenate([y for _, y in chunks]), df['duration'])
+
+
+def test_chunk_iter_restarts_on_reset():
+    """Test that every pass over the iterator gets a fresh set of chunks"""
+    chunk = (sparse.csr_matrix(np.eye(2)), np.array([1.0, 2.0]))
+    batch_iter = ChunkIter(lambda: iter([chunk, chunk]), cache_prefix=None)
+    received = []
+
+    def input_data(data, label):
+        received.append((data, label))
+
+    for _ in range(2):
+        while batch_iter.next(input_data):
+            pass
+        batch_iter.reset()
+
+    assert len(received) == 4
+
+
+def test_build_dmatrix_streams_all_chunks(tmp_path):
+    """Test that the external-memory DMatrix holds every row of every chunk"""
+    paths = write_cached_months(tmp_path)
+    _, encoder = fit_encoder(paths)
+
+    def chunks():
+        return iter_chunks(paths, encoder, chunk_rows=400)
+
+    train = build_dmatrix(chunks, str(tmp_path / 'train'))
+    valid = build_dmatrix(chunks, str(tmp_path / 'valid'), quantile=False)
+
+    assert isinstance(train, xgb.ExtMemQuantileDMatrix)
+    assert not isinstance(valid, xgb.QuantileDMatrix)
+    assert train.num_row() == len(read_months(paths))
+    assert train.num_col() == encoder.n_features
+    assert valid.num_row() == train.num_row()
+
+
+def test_build_dmatrix_uses_raw_pages_for_approx(tmp_path):
+    """Test that 'approx', which cannot train from quantized pages, gets a plain DMatrix"""
+    paths = write_cached_months(tmp_path, count=1)
+    _, encoder = fit_encoder(paths)
+
+    train = build_dmatrix(
+        lambda: iter_chunks(paths, encoder),
+        str(tmp_path / 'train'),
+        params=training_params(tree_method='approx'),
+    )
+
+    assert not isinstance(train, xgb.QuantileDMatrix)
+    xgb.train(training_params('fast', tree_method='approx'), train, num_boost_round=2)
+
+
+def test_iter_chunks_times_load_and_encode(tmp_path):
+    """Test that reading and encoding each chunk are recorded as separate phases"""
+    paths = write_cached_months(tmp_path, count=1)
+    _, encoder = fit_encoder(paths)
+    timer = PhaseTimer()
+
+    list(iter_chunks(paths, encoder, chunk_rows=400, timer=timer))
+
+    assert set(timer.seconds) == {'load', 'encode'}
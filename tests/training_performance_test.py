@@ -0,0 +1,72 @@
+import pytest
+
+from tests.model_test import FakeClock
+from training_performance import (
+    TRAINING_PHASES,
+    PhaseTimer,
+    training_params,
+    uses_quantile_dmatrix,
+)
+
+
+def test_training_params_presets():
+    """Test that presets trade depth for speed on top of the shared hyperparameters"""
+    accurate = training_params('accurate')
+    fast = training_params('fast', tree_method='approx', nthread=4)
+
+    assert accurate['max_depth'] == 30
+    assert accurate['objective'] == 'reg:squarederror'
+    assert accurate['tree_method'] == 'hist'
+    assert 'nthread' not in accurate
+    assert fast['max_depth'] < accurate['max_depth']
+    assert fast['learning_rate'] == accurate['learning_rate']
+    assert fast['tree_method'] == 'approx'
+    assert fast['nthread'] == 4
+
+
+def test_training_params_rejects_unknown_options():
+    """Test that typos in the preset or tree method fail before any data is loaded"""
+    with pytest.raises(ValueError, match="preset"):
+        training_params('fastest')
+    with pytest.raises(ValueError, match="tree method"):
+        training_params(tree_method='exact')
+
+
+def test_only_hist_uses_quantile_dmatrix():
+    """Test that the quantile DMatrix is only chosen for the hist tree method"""
+    assert uses_quantile_dmatrix(training_params(tree_method='hist'))
+    assert not uses_quantile_dmatrix(training_params(tree_method='approx'))
+
+
+def test_phase_timer_excludes_nested_phases():
+    """Test that time spent in a nested phase is not counted twice"""
+    clock = FakeClock()
+    timer = PhaseTimer(clock=clock)
+
+    with timer.phase('dmatrix'):
+        clock.now += 1.0
+        with timer.phase('load'):
+            clock.now += 2.0
+        with timer.phase('encode'):
+            clock.now += 3.0
+        clock.now += 0.5
+
+    with timer.phase('load'):
+        clock.now += 4.0
+
+    assert timer.seconds == {'dmatrix': 1.5, 'load': 6.0, 'encode': 3.0}
+    assert timer.metrics()['time_total_seconds'] == 10.5
+
+
+def test_phase_timer_metrics_cover_every_phase():
+    """Test that phases that did not run are still logged, as zero"""
+    timer = PhaseTimer(clock=FakeClock())
+
+    with timer.phase('boost'):
+        pass
+
+    metrics = timer.metrics()
+    assert list(metrics) == [f'time_{phase}_seconds' for phase in TRAINING_PHASES] + [
+        'time_total_seconds'
+    ]
+    assert metrics['time_load_seconds'] == 0.0
@@ -0,0 +1,119 @@
+from unittest.mock import patch
+
+import numpy as np
+import pandas as pd
+import pytest
+from pyarrow import feather
+from sklearn.feature_extraction import DictVectorizer
+
+from benchmarks.training_prep import legacy_prepare_trips
+from feature_encoder import FeatureEncoder
+from trip_features import build_pu_do, cache_trips, prepare_trips
+
+
+def create_raw_trips(count=5000, seed=42):
+    """Create a frame shaped like a raw green taxi month"""
+    rng = np.random.default_rng(seed)
+    pickup = pd.Timestamp('2022-01-01') + pd.to_timedelta(
+        rng.integers(0, 86400 * 30, count), unit='s'
+    )
+    # Include the exact 1 and 60 minute boundaries and sub-second durations
+    seconds = rng.integers(0, 5000, count).astype('timedelta64[s]')
+    seconds[:4] = np.array([60, 3600, 59, 3601], dtype='timedelta64[s]')
+    dropoff = pickup + pd.to_timedelta(seconds) + pd.to_timedelta(rng.integers(0, 999, count), 'ms')
+    return pd.DataFrame(
+        {
+            'lpep_pickup_datetime': pickup,
+            'lpep_dropoff_datetime': dropoff,
+            'PULocationID': rng.integers(1, 266, count),
+            'DOLocationID': rng.integers(1, 266, count),
+            'trip_distance': rng.uniform(0, 30, count),
+        },
+        index=pd.RangeIndex(100, 100 + count),
+    )
+
+
+def test_prepare_trips_matches_legacy_prep():
+    """Test that the vectorized prep keeps the same rows and values as the per-row code"""
+    raw = create_raw_trips()
+
+    expected = legacy_prepare_trips(raw)
+    actual = prepare_trips(raw)
+
+    assert actual.index.equals(expected.index)
+    np.testing.assert_array_equal(actual['duration'], expected['duration'])
+    for column in ['PULocationID', 'DOLocationID', 'PU_DO']:
+        assert isinstance(actual[column].dtype, pd.CategoricalDtype)
+        assert actual[column].astype(str).tolist() == expected[column].tolist()
+
+
+def test_build_pu_do_only_builds_observed_pairs():
+    """Test that PU_DO categories are the distinct observed pairs"""
+    pickup = pd.Series([43, 1, 43, 7])
+    dropoff = pd.Series([151, 2, 151, 7])
+
+    pu_do = build_pu_do(pickup, dropoff)
+
+    assert pu_do.tolist() == ['43_151', '1_2', '43_151', '7_7']
+    assert sorted(pu_do.cat.categories) == ['1_2', '43_151', '7_7']
+
+
+@pytest.mark.parametrize("categorical", [True, False])
+def test_transform_frame_matches_dict_vectorizer(categorical):
+    """Test that encoding a prepared frame column-wise matches DictVectorizer on dicts"""
+    train = prepare_trips(create_raw_trips(seed=1))
+    dv = DictVectorizer()
+    dv.fit(train[['PU_DO', 'trip_distance']].to_dict(orient='records'))
+    encoder = FeatureEncoder.from_dict_vectorizer(dv)
+
+    frame = prepare_trips(create_raw_trips(count=2000, seed=2))[['PU_DO', 'trip_distance']]
+    if not categorical:
+        frame = frame.astype({'PU_DO': str})
+    frame.iloc[0, 1] = np.nan
+
+    expected = dv.transform(frame.to_dict(orient='records'))
+    actual = encoder.transform_frame(frame)
+
+    assert actual.indptr.tolist() == expected.indptr.tolist()
+    assert actual.indices.tolist() == expected.indices.tolist()
+    np.testing.assert_array_equal(actual.data, expected.data)
+
+
+def test_cache_trips_round_trip_and_hit(tmp_path):
+    """Test that a missing month is loaded and written once, then read back unchanged"""
+    trips = prepare_trips(create_raw_trips(count=500))
+    path = str(tmp_path / "month.arrow")
+    loads = []
+
+    def load_trips():
+        loads.append(1)
+        return trips
+
+    assert cache_trips(path, load_trips) == path
+    assert cache_trips(path, load_trips) == path
+
+    assert len(loads) == 1
+    cached = feather.read_table(path, memory_map=True).to_pandas()
+    pd.testing.assert_frame_equal(cached, trips.reset_index(drop=True))
+    assert list(tmp_path.iterdir()) == [tmp_path / "month.arrow"]
+
+
+def test_interrupted_cache_write_leaves_no_cache_hit(tmp_path):
+    """Test that a write failing midway leaves neither the final file nor a temp file"""
+    trips = prepare_trips(create_raw_trips(count=500))
+    path = tmp_path / "month.arrow"
+
+    def partial_write(_, dest, **__):
+        with open(dest, 'wb') as f:
+            f.write(b'ARROW1')
+        raise KeyboardInterrupt
+
+    with (
+        patch('trip_features.feather.write_feather', side_effect=partial_write),
+        pytest.raises(KeyboardInterrupt),
+    ):
+        cache_trips(str(path), lambda: trips)
+
+    assert not list(tmp_path.iterdir())
+    cache_trips(str(path), lambda: trips)
+    assert len(feather.read_table(path)) == len(trips)